@@ -97,7 +97,7 @@ async def test_get_admin_token(admin_access):
 @pytest.mark.asyncio
 async def test_generate_admin(local_dsrc):
     admin_password = "admin"
-    setup = await get_apake_setup(DontReplaceContext(), local_dsrc.store)
+    setup = await get_apake_setup(local_dsrc.store)
 
     cl_req, cl_state = opq.register_client(admin_password)
     serv_resp = opq.register(setup, cl_req, util.usp_hex("0_admin"))
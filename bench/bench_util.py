@@ -0,0 +1,220 @@
+"""
+Shared helpers for the standalone benchmark runners in this package. The runners are not collected by pytest, run
+them as modules from the project root, e.g. `python -m bench.token_bench`. Results are written as JSON to
+`bench/results`, tagged with the current git commit, so that two runs can be compared with `--compare`.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, ContextManager, Iterator, Optional
+
+# This depends on the 'results' folder being in the same folder as this file
+results_path = Path(__file__).absolute().parent.joinpath("results").resolve()
+
+
+def percentile(sorted_values: list[int], q: float) -> int:
+    """Nearest-rank percentile, `sorted_values` must already be sorted."""
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, round(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+@contextmanager
+def time_stage(durations: dict[str, int], stage: str) -> Iterator[None]:
+    """Adds the duration of the block to `durations`, for operations that run concurrently and can therefore not
+    share the current operation of a `Samples` object."""
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        durations[stage] = durations.get(stage, 0) + time.perf_counter_ns() - start
+
+
+@dataclass
+class Samples:
+    """Collects durations (in nanoseconds) per named stage. A single operation can record the same stage multiple
+    times, e.g. two DB calls, which are then added together by `end_op`."""
+
+    stages: dict[str, list[int]] = field(default_factory=dict)
+    _current: dict[str, int] = field(default_factory=dict)
+
+    def add(self, stage: str, duration_ns: int) -> None:
+        self._current[stage] = self._current.get(stage, 0) + duration_ns
+
+    def time(self, stage: str) -> ContextManager[None]:
+        return time_stage(self._current, stage)
+
+    def end_op(self, total_ns: int, durations: Optional[dict[str, int]] = None) -> None:
+        """Stores the stage durations of the finished operation. By default these are the ones recorded using `add`
+        and `time`, but they can also be provided directly."""
+        if durations is None:
+            durations = self._current
+            self._current = {}
+        for stage, duration in durations.items():
+            self.stages.setdefault(stage, []).append(duration)
+        self.stages.setdefault("total", []).append(total_ns)
+
+    def discard_op(self) -> None:
+        self._current = {}
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        result = {}
+        for stage, values in self.stages.items():
+            ordered = sorted(values)
+            total_s = sum(ordered) / 1e9
+            result[stage] = {
+                "count": len(ordered),
+                "ops_per_sec": len(ordered) / total_s if total_s > 0 else 0.0,
+                "mean_ms": total_s * 1e3 / len(ordered) if ordered else 0.0,
+                "p50_ms": percentile(ordered, 0.50) / 1e6,
+                "p95_ms": percentile(ordered, 0.95) / 1e6,
+                "p99_ms": percentile(ordered, 0.99) / 1e6,
+            }
+        return result
+
+
+class StandInConnection:
+    async def commit(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class StandInEngine:
+    """Replaces the database engine when all data functions are replaced by a stand-in context. Some modules still
+    open a `store_session`, which only needs to be able to open and close a connection.
+    """
+
+    def connect(self) -> "StandInEngine":
+        return self
+
+    async def start(self) -> StandInConnection:
+        return StandInConnection()
+
+
+def git_commit() -> str:
+    try:
+        res = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return res.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(name: str, results: dict[str, Any], out_dir: Path) -> Path:
+    commit = git_commit()
+    document = {
+        "benchmark": name,
+        "commit": commit,
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_file = out_dir.joinpath(f"{name}-{commit}-{document['timestamp']}.json")
+    with open(out_file, "w") as f:
+        json.dump(document, f, indent=2)
+
+    return out_file
+
+
+def print_summary(title: str, summary: dict[str, dict[str, float]]) -> None:
+    print(f"\n{title}")
+    print(
+        f"  {'stage':<18} {'count':>7} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9}"
+        f" {'p99 ms':>9}"
+    )
+    for stage, s in summary.items():
+        print(
+            f"  {stage:<18} {s['count']:>7.0f} {s['ops_per_sec']:>10.1f}"
+            f" {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f}"
+        )
+
+
+def print_histogram(title: str, values_ns: list[int], buckets: int = 10) -> None:
+    """Prints a text latency histogram with logarithmically spaced buckets between the smallest and largest value."""
+    if not values_ns:
+        return
+    low = max(min(values_ns), 1)
+    high = max(values_ns)
+    ratio = (high / low) ** (1 / buckets) if high > low else 2.0
+    bounds = [low * ratio**i for i in range(1, buckets + 1)]
+    bounds[-1] = high
+    counts = [0] * buckets
+    for value in values_ns:
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                counts[i] += 1
+                break
+    largest = max(counts)
+    print(f"  {title}")
+    for bound, count in zip(bounds, counts):
+        bar = "#" * round(40 * count / largest)
+        print(f"    <= {bound / 1e6:>9.3f} ms {count:>7} {bar}")
+
+
+def compare_results(
+    previous_file: Path, current: dict[str, Any], metric: str = "p50_ms"
+) -> None:
+    """Prints the relative change of `metric` for every group and stage that exists in both result sets."""
+    with open(previous_file, "rb") as f:
+        previous = json.load(f)
+
+    print(f"\nCompared to {previous['commit']} ({metric}, negative is faster):")
+    for group, stages in current.items():
+        prev_stages = previous["results"].get(group, {})
+        for stage, s in stages.items():
+            if not isinstance(s, dict) or metric not in s:
+                continue
+            if stage not in prev_stages or prev_stages[stage][metric] == 0:
+                continue
+            prev_val = prev_stages[stage][metric]
+            change = (s[metric] - prev_val) / prev_val * 100
+            print(
+                f"  {group}.{stage:<12} {prev_val:>9.3f} ->"
+                f" {s[metric]:>9.3f} ({change:+.1f}%)"
+            )
+
+
+def bench_args(description: str, default_iterations: int) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-n", "--iterations", type=int, default=default_iterations)
+    parser.add_argument(
+        "-w", "--warmup", type=int, default=max(default_iterations // 20, 1)
+    )
+    parser.add_argument("-o", "--out", type=Path, default=results_path)
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        default=None,
+        help="Previous result JSON file to compare against.",
+    )
+    parser.add_argument("--no-save", action="store_true", help="Do not write JSON.")
+    return parser
+
+
+def finish(
+    name: str,
+    results: dict[str, Any],
+    out_dir: Path,
+    compare: Optional[Path],
+    no_save: bool,
+) -> None:
+    if compare is not None:
+        compare_results(compare, results)
+    if not no_save:
+        out_file = save_results(name, results, out_dir)
+        print(f"\nSaved results to {out_file}")
@@ -0,0 +1,139 @@
+"""
+Overhead of calling a data function through a context, compared to calling it directly. The variants are:
+
+- direct: calling the function itself
+- context: calling it through a context without hooks, as when metrics are disabled
+- hooked: calling it through a context with the `ContextMetricsHook`, as in the app
+
+The data function does nothing, so the results are the overhead per call. Calls are timed in batches, as a single call
+is too short to time accurately. Both a sync and an async function are measured, as async calls also need a wrapping
+coroutine when hooked.
+
+Run with `python -m bench.context_bench`, see `--help` for options.
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Type
+
+from apiserver.app.metrics import ContextMetricsHook
+from bench.bench_util import Samples, bench_args, finish, print_summary
+from datacontext.context import (
+    AbstractContexts,
+    Context,
+    ContextError,
+    ContextNotImpl,
+    ContextRegistry,
+)
+
+BATCH_SIZE = 1000
+
+
+class BenchContext(Context):
+    @classmethod
+    def sync_noop(cls, value: int) -> int:
+        raise ContextNotImpl()
+
+    @classmethod
+    async def async_noop(cls, value: int) -> int:
+        raise ContextNotImpl()
+
+
+class BenchContexts(AbstractContexts):
+    bench_ctx: BenchContext
+
+    def __init__(self) -> None:
+        self.bench_ctx = BenchContext()
+
+    def context_from_type(self, registry_type: Type[Context]) -> Context:
+        if registry_type is BenchContext:
+            return self.bench_ctx
+
+        raise ContextError("Type does not match any valid contexts!")
+
+
+ctx_reg = ContextRegistry()
+
+
+def sync_noop_impl(value: int) -> int:
+    return value
+
+
+async def async_noop_impl(value: int) -> int:
+    return value
+
+
+# The names must match the stubs, so the undecorated versions above are used for the direct calls
+@ctx_reg.register(BenchContext)
+def sync_noop(value: int) -> int:
+    return value
+
+
+@ctx_reg.register(BenchContext)
+async def async_noop(value: int) -> int:
+    return value
+
+
+def bench_sync(call: Callable[[int], Any], batches: int, samples: Samples) -> None:
+    for _ in range(batches):
+        start = time.perf_counter_ns()
+        for i in range(BATCH_SIZE):
+            call(i)
+        per_call = (time.perf_counter_ns() - start) // BATCH_SIZE
+        samples.end_op(per_call, {"sync": per_call})
+
+
+async def bench_async(
+    call: Callable[[int], Any], batches: int, samples: Samples
+) -> None:
+    for _ in range(batches):
+        start = time.perf_counter_ns()
+        for i in range(BATCH_SIZE):
+            await call(i)
+        per_call = (time.perf_counter_ns() - start) // BATCH_SIZE
+        samples.end_op(per_call, {"async": per_call})
+
+
+async def bench(iterations: int, warmup: int) -> dict[str, Any]:
+    contexts = BenchContexts()
+    contexts.include_registry(ctx_reg)
+    ctx = contexts.bench_ctx
+
+    variants: dict[str, tuple[Callable[[int], Any], Callable[[int], Any]]] = {
+        # All variants call through a lambda, so that only the difference is measured
+        "direct": (lambda v: sync_noop_impl(v), lambda v: async_noop_impl(v)),
+        "context": (lambda v: sync_noop(ctx, v), lambda v: async_noop(ctx, v)),
+        "hooked": (lambda v: sync_noop(ctx, v), lambda v: async_noop(ctx, v)),
+    }
+
+    results: dict[str, Any] = {}
+    for name, (sync_call, async_call) in variants.items():
+        contexts.set_hooks([ContextMetricsHook()] if name == "hooked" else [])
+        bench_sync(sync_call, warmup, Samples())
+        await bench_async(async_call, warmup, Samples())
+
+        samples = Samples()
+        bench_sync(sync_call, iterations, samples)
+        await bench_async(async_call, iterations, samples)
+        summary = samples.summary()
+        results[name] = {"sync": summary["sync"], "async": summary["async"]}
+
+    return results
+
+
+def main() -> None:
+    parser = bench_args(
+        f"Context call overhead benchmark (batches of {BATCH_SIZE} calls)",
+        default_iterations=500,
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args.iterations, args.warmup))
+    print("\nDurations are per call, so ops/s is the number of calls per second")
+    for name, summary in results.items():
+        print_summary(f"variant={name}", summary)
+    finish("context", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Throughput of a minimal app with the `LoggerMiddleware`, for different logging sinks and levels. The middleware logs the
+path and status of every request at DEBUG, so at INFO those messages are skipped. The variants are:
+
+- text_sync_debug: the colorized text format written synchronously, at DEBUG (the previous stderr sink)
+- text_debug: the same, but written by a background thread (enqueue), as the stderr sink now does
+- text_info: as text_debug, but at INFO
+- struct_debug: JSON lines written to a rotated file by a background thread, at DEBUG
+- struct_info: as struct_debug, but at INFO
+- struct_sampled: as struct_debug, but only 1 in 10 requests is sampled (see `LogSampler`)
+
+Text is written to the null device instead of stderr, so the terminal does not influence the results. Structured logs
+are written to a temporary directory. Requests are sent in-process using httpx's ASGITransport.
+
+Run with `python -m bench.logging_bench`, see `--help` for options.
+"""
+
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable
+
+from fastapi.middleware import Middleware
+from loguru import logger
+
+from apiserver.app.app_logging import (
+    LoggerMiddleware,
+    log_sampler,
+    logger_format,
+    logger_struct_file_sink,
+)
+from apiserver.env import load_config
+from apiserver.resources import project_path
+from bench.bench_util import bench_args, finish, print_summary
+from bench.middleware_bench import create_bench_app, run_variant, trace_routes
+
+
+def text_sink(level: str, enqueue: bool) -> Callable[[Path], None]:
+    def add_sink(_log_dir: Path) -> None:
+        devnull = open(os.devnull, "w")
+        logger.add(
+            devnull, colorize=True, format=logger_format, level=level, enqueue=enqueue
+        )
+
+    return add_sink
+
+
+def struct_sink(level: str) -> Callable[[Path], None]:
+    def add_sink(log_dir: Path) -> None:
+        config = load_config(project_path.joinpath("devenv.toml")).model_copy(
+            update={"LOG_STRUCT_PATH": str(log_dir.joinpath("bench.jsonl"))}
+        )
+        logger_struct_file_sink(config, level)
+
+    return add_sink
+
+
+def sampled(add_sink: Callable[[Path], None], every: int) -> Callable[[Path], None]:
+    def add_sampled_sink(log_dir: Path) -> None:
+        add_sink(log_dir)
+        log_sampler.configure(every, 0)
+
+    return add_sampled_sink
+
+
+variants: dict[str, Callable[[Path], None]] = {
+    "text_sync_debug": text_sink("DEBUG", enqueue=False),
+    "text_debug": text_sink("DEBUG", enqueue=True),
+    "text_info": text_sink("INFO", enqueue=True),
+    "struct_debug": struct_sink("DEBUG"),
+    "struct_info": struct_sink("INFO"),
+    "struct_sampled": sampled(struct_sink("DEBUG"), every=10),
+}
+
+
+async def bench(iterations: int, warmup: int, concurrency: int) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    rates = {}
+    app = create_bench_app([Middleware(LoggerMiddleware, trace_routes=trace_routes)])
+    for name, add_sink in variants.items():
+        with tempfile.TemporaryDirectory() as log_dir:
+            logger.remove()
+            add_sink(Path(log_dir))
+            samples, rate = await run_variant(app, iterations, warmup, concurrency)
+            # Waits until all queued messages are written, which is not included in the rate
+            logger.remove()
+            log_sampler.configure(1, 0)
+        results[name] = {"request": samples.summary()["request"]}
+        rates[name] = rate
+    results["rates"] = {"requests_per_sec": rates}
+    return results
+
+
+def main() -> None:
+    parser = bench_args("Logging sink benchmark", default_iterations=5000)
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=10, help="Concurrent clients."
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args.iterations, args.warmup, args.concurrency))
+    for name in variants:
+        print_summary(f"sink={name}", results[name])
+    print("\nRequest rates (per second, wall time)")
+    for name, rate in results["rates"]["requests_per_sec"].items():
+        print(f"  {name:<16} {rate:>10.1f}")
+    finish("logging", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
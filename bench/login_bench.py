@@ -0,0 +1,351 @@
+"""
+Load generation for the full login flow. It simulates N concurrent users that each do the complete sequence of
+requests the authpage and the frontend perform, using the `opaquepy` client functions:
+
+1. authorize: GET /oauth/authorize/, stores the auth request and redirects to the authpage
+2. login_start: POST /login/start/, the OPAQUE server login step
+3. login_finish: POST /login/finish/, verifies the OPAQUE client finish message
+4. callback: GET /oauth/callback/, redirects back to the client with the authorization code
+5. token: POST /oauth/token/, exchanges the code for tokens
+
+The requests are sent to the ASGI app in-process using httpx's ASGITransport. Redis and the database are replaced by
+in-memory stand-ins through the contexts, so this measures the application and not the network. The OPAQUE client
+computations are done outside the timed sections, but as they run on the same event loop they do reduce the total
+throughput.
+
+Run with `python -m bench.login_bench`, see `--help` for options.
+"""
+
+import asyncio
+import hashlib
+import secrets
+import time
+import tomllib
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import opaquepy.lib as opq
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient, codes
+from loguru import logger
+from starlette.types import Receive, Scope, Send
+from yarl import URL
+
+from apiserver.app_def import create_app
+from apiserver.app_lifespan import State, register_and_define_code, safe_startup
+from apiserver.data import Source
+from apiserver.define import DEFINE
+from apiserver.env import load_config
+from apiserver.lib.hazmat.keys import gen_pw_file
+from apiserver.lib.model.entities import IdInfo
+from apiserver.data.api.ud.userdata import IdUserData
+from auth.core.model import AuthRequest, FlowUser, KeyState, SavedState
+from auth.core.util import enc_b64url
+from auth.data.authentication import FAKE_RECORD_ID
+from auth.data.context import AuthorizeContext, LoginContext
+from auth.data.relational.user import UserOps
+from bench.bench_util import (
+    Samples,
+    StandInEngine,
+    bench_args,
+    finish,
+    print_histogram,
+    print_summary,
+    time_stage,
+)
+from bench.token_bench import StandInStore, stand_in_context
+from store import Store
+from store.error import NoDataError
+from tests.test_resources import res_path
+from tests.test_util import KeyValues, mock_redirect
+
+steps = ["authorize", "login_start", "login_finish", "callback", "token"]
+bench_password = "benchpassword"
+
+
+class BenchUser:
+    user_id: str
+    email: str
+    password_file: str
+
+    def __init__(self, user_id: str, email: str, password_file: str) -> None:
+        self.user_id = user_id
+        self.email = email
+        self.password_file = password_file
+
+
+def stand_in_login_context(
+    stand_in: StandInStore, users: dict[str, BenchUser]
+) -> LoginContext:
+    """Mirrors the real implementation: the real user is looked up, falling back to the cached fake record."""
+
+    class StandInLoginContext(LoginContext):
+        @classmethod
+        async def get_user_auth_data(
+            cls,
+            store: Store,
+            user_ops: UserOps,
+            fake_password_file: str,
+            login_mail: str,
+        ) -> tuple[str, str, str, str]:
+            user_id = FAKE_RECORD_ID
+            password_file = fake_password_file
+            scope = "none"
+            real_user = users.get(login_mail)
+            if real_user is not None:
+                user_id = real_user.user_id
+                password_file = real_user.password_file
+                scope = "member"
+            return user_id, scope, password_file, secrets.token_hex(16)
+
+        @classmethod
+        async def store_auth_state(
+            cls, store: Store, auth_id: str, state: SavedState
+        ) -> None:
+            stand_in.kv[auth_id] = state.model_dump_json()
+
+        @classmethod
+        async def get_state(cls, store: Store, auth_id: str) -> SavedState:
+            state = stand_in.kv.get(auth_id)
+            if state is None:
+                raise NoDataError("No data", "bench_no_data")
+            return SavedState.model_validate_json(state)
+
+        @classmethod
+        async def store_flow_user(
+            cls, store: Store, session_key: str, flow_user: FlowUser
+        ) -> None:
+            stand_in.kv[session_key] = flow_user.model_dump_json()
+
+    return StandInLoginContext()
+
+
+def stand_in_authorize_context(stand_in: StandInStore) -> AuthorizeContext:
+    class StandInAuthorizeContext(AuthorizeContext):
+        @classmethod
+        async def store_auth_request(
+            cls, store: Store, auth_request: AuthRequest
+        ) -> str:
+            flow_id = secrets.token_hex(16)
+            stand_in.kv[flow_id] = auth_request.model_dump_json()
+            return flow_id
+
+        @classmethod
+        async def get_auth_request(cls, store: Store, flow_id: str) -> AuthRequest:
+            auth_request = stand_in.kv.get(flow_id)
+            if auth_request is None:
+                raise NoDataError("No data", "bench_no_data")
+            return AuthRequest.model_validate_json(auth_request)
+
+    return StandInAuthorizeContext()
+
+
+class StateApp:
+    """httpx's ASGITransport does not run the lifespan, so we run it ourselves and add its state to every request,
+    like the ASGI server would."""
+
+    def __init__(self, app: FastAPI, state: State) -> None:
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scope["state"] = dict(self.state)
+        await self.app(scope, receive, send)
+
+
+@asynccontextmanager
+async def bench_client(
+    n_users: int,
+) -> AsyncIterator[tuple[AsyncClient, list[BenchUser]]]:
+    with open(res_path.joinpath("test_values.toml"), "rb") as f:
+        key_values = KeyValues.model_validate(tomllib.load(f)["keys"])
+    key_state = KeyState(
+        current_symmetric="sym",
+        old_symmetric="sym_old",
+        current_signing="sig-pem-private",
+    )
+    stand_in = StandInStore(key_values, key_state)
+
+    opaque_setup = opq.create_setup()
+    fake_password_file = gen_pw_file(
+        opaque_setup, secrets.token_hex(16), FAKE_RECORD_ID
+    )
+    users = []
+    for i in range(n_users):
+        user_id = f"{i + 2}_benchuser"
+        users.append(
+            BenchUser(
+                user_id,
+                f"user{i}@example.com",
+                gen_pw_file(opaque_setup, bench_password, user_id),
+            )
+        )
+    id_userdata = IdUserData(
+        IdInfo(
+            email="bench@example.com",
+            name="Bench User",
+            given_name="Bench",
+            family_name="User",
+            nickname="Bench",
+            preferred_username="bench",
+            birthdate="2000-01-01",
+        )
+    )
+
+    cd = register_and_define_code()
+    cd.auth_context.login_ctx = stand_in_login_context(
+        stand_in, {u.email: u for u in users}
+    )
+    cd.auth_context.authorize_ctx = stand_in_authorize_context(stand_in)
+    cd.auth_context.token_ctx = stand_in_context(stand_in, id_userdata)
+
+    dsrc = Source()
+    safe_startup(dsrc, load_config(res_path.joinpath("testenv.toml")))
+    dsrc.store.db = StandInEngine()  # type: ignore
+    dsrc.key_state = key_state
+    dsrc.opaque_setup = opaque_setup
+    dsrc.fake_password_file = fake_password_file
+
+    @asynccontextmanager
+    async def bench_lifespan(_app: FastAPI) -> AsyncIterator[State]:
+        yield {"dsrc": dsrc, "cd": cd}
+
+    app = create_app(bench_lifespan)
+    async with bench_lifespan(app) as state:
+        transport = ASGITransport(app=StateApp(app, state))  # type: ignore
+        async with AsyncClient(transport=transport, base_url=DEFINE.api_root) as client:
+            yield client, users
+
+
+def check(response: Any, status: int, step: str) -> None:
+    if response.status_code != status:
+        raise RuntimeError(
+            f"{step} failed with {response.status_code}: {response.text}"
+        )
+
+
+async def login_flow(client: AsyncClient, user: BenchUser, samples: Samples) -> None:
+    """A single full login for one user, recording the latency of every request."""
+    code_verifier = secrets.token_urlsafe(32)
+    code_challenge = enc_b64url(hashlib.sha256(code_verifier.encode("ascii")).digest())
+    durations: dict[str, int] = {}
+    flow_start = time.perf_counter_ns()
+
+    with time_stage(durations, "authorize"):
+        response = await client.get(
+            "/oauth/authorize/",
+            params={
+                "response_type": "code",
+                "client_id": DEFINE.frontend_client_id,
+                "redirect_uri": mock_redirect,
+                "state": secrets.token_urlsafe(16),
+                "code_challenge": code_challenge,
+                "code_challenge_method": "S256",
+                "nonce": secrets.token_urlsafe(16),
+            },
+        )
+    check(response, codes.SEE_OTHER, "authorize")
+    flow_id = URL(response.headers["location"]).query["flow_id"]
+
+    client_request, client_state = opq.login_client(bench_password)
+    with time_stage(durations, "login_start"):
+        response = await client.post(
+            "/login/start/",
+            json={"email": user.email, "client_request": client_request},
+        )
+    check(response, codes.OK, "login_start")
+    login_start = response.json()
+
+    finish_request, session_key = opq.login_client_finish(
+        client_state, bench_password, login_start["server_message"]
+    )
+    with time_stage(durations, "login_finish"):
+        response = await client.post(
+            "/login/finish/",
+            json={
+                "auth_id": login_start["auth_id"],
+                "email": user.email,
+                "client_request": finish_request,
+                "flow_id": flow_id,
+            },
+        )
+    check(response, codes.OK, "login_finish")
+
+    with time_stage(durations, "callback"):
+        response = await client.get(
+            "/oauth/callback/", params={"flow_id": flow_id, "code": session_key}
+        )
+    check(response, codes.SEE_OTHER, "callback")
+    code = URL(response.headers["location"]).query["code"]
+
+    with time_stage(durations, "token"):
+        response = await client.post(
+            "/oauth/token/",
+            json={
+                "client_id": DEFINE.frontend_client_id,
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": mock_redirect,
+                "code_verifier": code_verifier,
+            },
+        )
+    check(response, codes.OK, "token")
+
+    samples.end_op(time.perf_counter_ns() - flow_start, durations)
+
+
+async def bench(
+    n_users: int, iterations: int, warmup: int
+) -> tuple[dict[str, Any], Samples]:
+    async with bench_client(n_users) as (client, users):
+        warmup_samples = Samples()
+        await asyncio.gather(
+            *(
+                login_flow(client, users[i % n_users], warmup_samples)
+                for i in range(warmup)
+            )
+        )
+
+        samples = Samples()
+        remaining = iter(range(iterations))
+
+        async def simulate_user(user: BenchUser) -> None:
+            # Every simulated user keeps logging in until the total number of iterations is reached
+            for _ in remaining:
+                await login_flow(client, user, samples)
+
+        start = time.perf_counter_ns()
+        await asyncio.gather(*(simulate_user(user) for user in users))
+        elapsed_s = (time.perf_counter_ns() - start) / 1e9
+
+    summary = samples.summary()
+    # Requests per second of wall time, as the steps are interleaved between the concurrent users
+    rates = {step: summary[step]["count"] / elapsed_s for step in steps}
+    rates["flows"] = iterations / elapsed_s
+    return {"steps": summary, "rates": {"requests_per_sec": rates}}, samples
+
+
+def main() -> None:
+    parser = bench_args("Login flow load generator", default_iterations=500)
+    parser.add_argument("-u", "--users", type=int, default=20, help="Concurrent users.")
+    args = parser.parse_args()
+    # The app logs every request at DEBUG level, which would dominate the output
+    logger.remove()
+
+    results, samples = asyncio.run(bench(args.users, args.iterations, args.warmup))
+
+    print_summary(
+        f"login flow, {args.users} concurrent users (latency per request)",
+        results["steps"],
+    )
+    print("\nRequest rates (per second, wall time)")
+    for step, rate in results["rates"]["requests_per_sec"].items():
+        print(f"  {step:<12} {rate:>10.1f}")
+    print("\nLatency histograms")
+    for step in steps:
+        print_histogram(step, samples.stages[step])
+    finish("login", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
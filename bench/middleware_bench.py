@@ -0,0 +1,133 @@
+"""
+Throughput of a minimal app with and without the request logging and metrics middleware. The variants are:
+
+- none: no middleware
+- base_http: the previous logging implementation, a `BaseHTTPMiddleware` that hashes random bytes for every request ID
+- asgi: the current pure ASGI `LoggerMiddleware`
+- metrics: the `LoggerMiddleware` and the `MetricsMiddleware`, as in the app
+
+Log messages are formatted with the app's format but written to a sink that discards them, so the cost of logging
+itself is included but not that of writing to stderr. Requests are sent in-process using httpx's ASGITransport.
+
+Run with `python -m bench.middleware_bench`, see `--help` for options.
+"""
+
+import asyncio
+import time
+from typing import Any
+
+from fastapi import FastAPI, Request, Response
+from fastapi.middleware import Middleware
+from httpx import ASGITransport, AsyncClient
+from loguru import logger
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import ASGIApp
+
+from apiserver.app.app_logging import LoggerMiddleware, logger_format
+from apiserver.app.metrics import MetricsMiddleware
+from auth.core.util import random_time_hash_hex
+from bench.bench_util import Samples, bench_args, finish, print_summary
+
+
+class BaseHTTPLoggerMiddleware(BaseHTTPMiddleware):
+    """The `LoggerMiddleware` as it was before it became a pure ASGI middleware."""
+
+    def __init__(self, app: ASGIApp, trace_routes: set[str]) -> None:
+        super().__init__(app)
+        self.trace_routes = trace_routes
+
+    async def dispatch(
+        self, request: Request, call_next: RequestResponseEndpoint
+    ) -> Response:
+        request_id = random_time_hash_hex(short=True) + ": "
+        with logger.contextualize(request_id=request_id):
+            req_path_parts = request.url.path.split("/")
+            level = "TRACE" if req_path_parts[1] in self.trace_routes else "DEBUG"
+            logger.log(level, request.url.path)
+            response = await call_next(request)
+            logger.log(level, response.status_code)
+
+        return response
+
+
+def create_bench_app(middleware: list[Middleware]) -> FastAPI:
+    app = FastAPI(middleware=middleware)
+
+    @app.get("/bench/")
+    async def bench_route() -> dict[str, str]:
+        return {"status": "ok"}
+
+    return app
+
+
+trace_routes = {"credentials"}
+variants: dict[str, list[Middleware]] = {
+    "none": [],
+    "base_http": [Middleware(BaseHTTPLoggerMiddleware, trace_routes=trace_routes)],
+    "asgi": [Middleware(LoggerMiddleware, trace_routes=trace_routes)],
+    "metrics": [
+        Middleware(MetricsMiddleware),
+        Middleware(LoggerMiddleware, trace_routes=trace_routes),
+    ],
+}
+
+
+async def run_variant(
+    app: FastAPI, iterations: int, warmup: int, concurrency: int
+) -> tuple[Samples, float]:
+    samples = Samples()
+    transport = ASGITransport(app=app)  # type: ignore
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(warmup):
+            await client.get("/bench/")
+
+        remaining = iter(range(iterations))
+
+        async def worker() -> None:
+            for _ in remaining:
+                start = time.perf_counter_ns()
+                response = await client.get("/bench/")
+                durations = {"request": time.perf_counter_ns() - start}
+                response.raise_for_status()
+                samples.end_op(durations["request"], durations)
+
+        start = time.perf_counter_ns()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed_s = (time.perf_counter_ns() - start) / 1e9
+
+    return samples, iterations / elapsed_s
+
+
+async def bench(iterations: int, warmup: int, concurrency: int) -> dict[str, Any]:
+    results: dict[str, Any] = {}
+    rates = {}
+    for name, middleware in variants.items():
+        samples, rate = await run_variant(
+            create_bench_app(middleware), iterations, warmup, concurrency
+        )
+        results[name] = {"request": samples.summary()["request"]}
+        rates[name] = rate
+    results["rates"] = {"requests_per_sec": rates}
+    return results
+
+
+def main() -> None:
+    parser = bench_args("Logging middleware benchmark", default_iterations=5000)
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=10, help="Concurrent clients."
+    )
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(lambda _: None, format=logger_format, level="DEBUG")
+
+    results = asyncio.run(bench(args.iterations, args.warmup, args.concurrency))
+    for name in variants:
+        print_summary(f"middleware={name}", results[name])
+    print("\nRequest rates (per second, wall time)")
+    for name, rate in results["rates"]["requests_per_sec"].items():
+        print(f"  {name:<12} {rate:>10.1f}")
+    finish("middleware", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Rendering of every email template (text and HTML), comparing:
+
+- environment: loading both templates from the Jinja environment and rendering them with the localization merged into
+  the variables, as was done for every email before the templates were compiled at startup
+- compiled: rendering the `EmailTemplates` used by the app, where the localization is part of the compiled template
+
+Renders are timed in batches, as a single render is too short to time accurately.
+
+Run with `python -m bench.template_bench`, see `--help` for options.
+"""
+
+import time
+from typing import Any, Callable
+
+from apiserver.define import get_template_env, loc_dict
+from apiserver.lib.actions.mail import EmailTemplates
+from bench.bench_util import Samples, bench_args, finish, print_summary
+
+BATCH_SIZE = 100
+
+# Values for all variables used by the templates
+ADD_VARS = {
+    "redirect_link": "https://example.com/signup/?confirm_id=abcdef0123456789",
+    "signup_link": "https://example.com/signup",
+    "register_link": "https://example.com/register/?info=abcdef0123456789",
+    "reset_link": "https://example.com/reset/?reset_id=abcdef0123456789",
+    "old_email": "old@example.com",
+}
+
+
+def render_environment(name: str) -> None:
+    templ_vars = loc_dict | ADD_VARS
+    get_template_env().get_template(name).render(templ_vars)
+    html_name = f"{name.removesuffix('.jinja2')}.html.jinja2"
+    get_template_env().get_template(html_name).render(templ_vars)
+
+
+def bench_render(render: Callable[[], Any], batches: int, samples: Samples) -> None:
+    for _ in range(batches):
+        start = time.perf_counter_ns()
+        for _ in range(BATCH_SIZE):
+            render()
+        per_render = (time.perf_counter_ns() - start) // BATCH_SIZE
+        samples.end_op(per_render, {})
+
+
+def bench(iterations: int, warmup: int) -> dict[str, Any]:
+    templates = EmailTemplates(get_template_env(), loc_dict)
+    templates.load_all()
+
+    results: dict[str, Any] = {}
+    for name in templates.compiled:
+        variants: dict[str, Callable[[], Any]] = {
+            "environment": lambda: render_environment(name),
+            "compiled": lambda: templates.render(name, ADD_VARS),
+        }
+        results[name] = {}
+        for variant, render in variants.items():
+            bench_render(render, warmup, Samples())
+            samples = Samples()
+            bench_render(render, iterations, samples)
+            results[name][variant] = samples.summary()["total"]
+
+    return results
+
+
+def main() -> None:
+    parser = bench_args(
+        f"Email template rendering benchmark (batches of {BATCH_SIZE} renders)",
+        default_iterations=200,
+    )
+    args = parser.parse_args()
+
+    results = bench(args.iterations, args.warmup)
+    print("\nDurations are per email (text and HTML)")
+    for name, summary in results.items():
+        print_summary(f"template={name}", summary)
+    finish("template", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
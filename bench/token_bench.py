@@ -0,0 +1,265 @@
+"""
+Benchmark of the token endpoint logic (`process_token_request`) for both the 'authorization_code' and the
+'refresh_token' grant. Redis and the database are replaced by an in-memory stand-in through the TokenContext, so the
+results show the cost of our own code and the cryptography, not of the network. Per operation it records the time
+spent in each of the spans marked in the token modules (see `auth.core.span`), e.g. `get_keys` or `sign_id_token`.
+
+Run with `python -m bench.token_bench`, see `--help` for options.
+"""
+
+import asyncio
+import json
+import time
+import tomllib
+from typing import Any, Callable
+
+from apiserver.data import schema
+from apiserver.data.api.ud.userdata import IdUserData
+from apiserver.define import DEFINE
+from apiserver.lib.model.entities import IdInfo
+from auth.core.model import (
+    AuthKeys,
+    AuthRequest,
+    FlowUser,
+    KeyState,
+    RefreshToken,
+    TokenRequest,
+)
+from auth.core.span import record_spans
+from auth.core.util import utc_timestamp
+from auth.data.context import TokenContext
+from auth.data.relational.entities import SavedRefreshToken
+from auth.data.relational.ops import RelationOps
+from auth.hazmat.key_decode import aes_from_symmetric
+from auth.hazmat.structs import A256GCMKey, PEMPrivateKey
+from auth.modules.token.process import process_token_request
+from bench.bench_util import (
+    Samples,
+    StandInEngine,
+    bench_args,
+    finish,
+    print_summary,
+)
+from store import Store
+from store.error import NoDataError
+from tests.test_resources import res_path
+from tests.test_util import KeyValues, mock_auth_request, mock_redirect
+
+# Code verifier that corresponds to the code challenge of `mock_auth_request`
+code_verifier = "NiiCPTK4e73kAVCfWZyZX6AvIXyPg396Q4063oGOI3w"
+bench_user_id = "12_benchuser"
+
+
+class StandInStore:
+    """In-memory replacement of what is stored in Redis and the database. KV values are stored as JSON strings, so
+    loading them has a similar parsing cost to the real thing."""
+
+    kv: dict[str, str]
+    refresh: dict[int, SavedRefreshToken]
+    refresh_counter: int
+
+    def __init__(self, key_values: KeyValues, key_state: KeyState) -> None:
+        self.kv = {}
+        self.refresh = {}
+        self.refresh_counter = 0
+        symmetric = A256GCMKey(
+            kid=key_state.current_symmetric, symmetric=key_values.symmetric
+        )
+        old_symmetric = A256GCMKey(
+            kid=key_state.old_symmetric, symmetric=key_values.symmetric
+        )
+        signing = PEMPrivateKey(
+            kid=key_state.current_signing,
+            public=key_values.signing_public,
+            private=key_values.signing_private,
+        )
+        for key in (symmetric, old_symmetric, signing):
+            self.kv[key.kid] = json.dumps(key.model_dump())
+        self.kv[mock_auth_request_flow] = json.dumps(mock_auth_request.model_dump())
+
+    def insert_refresh(self, refresh_save: SavedRefreshToken) -> int:
+        self.refresh_counter += 1
+        refresh_save.id = self.refresh_counter
+        self.refresh[self.refresh_counter] = refresh_save
+        return self.refresh_counter
+
+
+mock_auth_request_flow = "benchflow"
+
+
+def stand_in_context(stand_in: StandInStore, id_userdata: IdUserData) -> TokenContext:
+    class StandInTokenContext(TokenContext):
+        @classmethod
+        async def pop_flow_user(cls, store: Store, authorization_code: str) -> FlowUser:
+            flow_user = stand_in.kv.pop(authorization_code, None)
+            if flow_user is None:
+                raise NoDataError("No data", "bench_no_data")
+            return FlowUser.model_validate_json(flow_user)
+
+        @classmethod
+        async def get_auth_request(cls, store: Store, flow_id: str) -> AuthRequest:
+            return AuthRequest.model_validate_json(stand_in.kv[flow_id])
+
+        @classmethod
+        async def get_keys(cls, store: Store, key_state: KeyState) -> AuthKeys:
+            symmetric = A256GCMKey.model_validate_json(
+                stand_in.kv[key_state.current_symmetric]
+            )
+            old_symmetric = A256GCMKey.model_validate_json(
+                stand_in.kv[key_state.old_symmetric]
+            )
+            signing = PEMPrivateKey.model_validate_json(
+                stand_in.kv[key_state.current_signing]
+            )
+            return AuthKeys(
+                symmetric=aes_from_symmetric(symmetric.symmetric),
+                old_symmetric=aes_from_symmetric(old_symmetric.symmetric),
+                signing=signing,
+            )
+
+        @classmethod
+        async def get_id_userdata(
+            cls, store: Store, ops: RelationOps, user_id: str
+        ) -> IdUserData:
+            return id_userdata
+
+        @classmethod
+        async def add_refresh_token(
+            cls, store: Store, ops: RelationOps, refresh_save: SavedRefreshToken
+        ) -> int:
+            return stand_in.insert_refresh(refresh_save)
+
+        @classmethod
+        async def get_saved_refresh(
+            cls, store: Store, ops: RelationOps, old_refresh: RefreshToken
+        ) -> SavedRefreshToken:
+            return stand_in.refresh[old_refresh.id]
+
+        @classmethod
+        async def replace_refresh(
+            cls,
+            store: Store,
+            ops: RelationOps,
+            old_refresh_id: int,
+            new_refresh_save: SavedRefreshToken,
+        ) -> int:
+            del stand_in.refresh[old_refresh_id]
+            return stand_in.insert_refresh(new_refresh_save)
+
+    return StandInTokenContext()
+
+
+def new_flow_user(stand_in: StandInStore, i: int) -> str:
+    code = f"benchcode{i}"
+    flow_user = FlowUser(
+        user_id=bench_user_id,
+        scope="member",
+        flow_id=mock_auth_request_flow,
+        auth_time=utc_timestamp() - 20,
+    )
+    stand_in.kv[code] = flow_user.model_dump_json()
+    return code
+
+
+async def run_grant(
+    make_request: Callable[[int], TokenRequest],
+    on_response: Callable[[Any], None],
+    context: TokenContext,
+    key_state: KeyState,
+    samples: Samples,
+    iterations: int,
+    warmup: int,
+) -> None:
+    store = Store()
+    store.db = StandInEngine()  # type: ignore
+    for i in range(warmup + iterations):
+        token_request = make_request(i)
+        with record_spans() as recorder:
+            start = time.perf_counter_ns()
+            response = await process_token_request(
+                store, DEFINE, schema.OPS, context, key_state, token_request
+            )
+            total = time.perf_counter_ns() - start
+        on_response(response)
+        if i >= warmup:
+            durations: dict[str, int] = {}
+            for stage, duration in recorder.spans:
+                durations[stage] = durations.get(stage, 0) + duration
+            samples.end_op(total, durations)
+
+
+async def bench(iterations: int, warmup: int) -> dict[str, Any]:
+    with open(res_path.joinpath("test_values.toml"), "rb") as f:
+        key_values = KeyValues.model_validate(tomllib.load(f)["keys"])
+    key_state = KeyState(
+        current_symmetric="sym",
+        old_symmetric="sym_old",
+        current_signing="sig-pem-private",
+    )
+    id_userdata = IdUserData(
+        IdInfo(
+            email="bench@example.com",
+            name="Bench User",
+            given_name="Bench",
+            family_name="User",
+            nickname="Bench",
+            preferred_username="bench",
+            birthdate="2000-01-01",
+        )
+    )
+
+    stand_in = StandInStore(key_values, key_state)
+    context = stand_in_context(stand_in, id_userdata)
+    latest_refresh: list[str] = []
+
+    def keep_refresh(response: Any) -> None:
+        latest_refresh[:] = [response.refresh_token]
+
+    def code_request(i: int) -> TokenRequest:
+        return TokenRequest(
+            client_id=DEFINE.frontend_client_id,
+            grant_type="authorization_code",
+            code=new_flow_user(stand_in, i),
+            redirect_uri=mock_redirect,
+            code_verifier=code_verifier,
+        )
+
+    def refresh_request(_i: int) -> TokenRequest:
+        # Refresh tokens are rotated, so every request uses the one returned by the previous request
+        return TokenRequest(
+            client_id=DEFINE.frontend_client_id,
+            grant_type="refresh_token",
+            refresh_token=latest_refresh[0],
+        )
+
+    results = {}
+    # The refresh grant starts from the refresh token of the last authorization_code request
+    for grant, make_request in (
+        ("authorization_code", code_request),
+        ("refresh_token", refresh_request),
+    ):
+        samples = Samples()
+        await run_grant(
+            make_request,
+            keep_refresh,
+            context,
+            key_state,
+            samples,
+            iterations,
+            warmup,
+        )
+        results[grant] = samples.summary()
+
+    return results
+
+
+def main() -> None:
+    args = bench_args("Token endpoint benchmark", default_iterations=2000).parse_args()
+    results = asyncio.run(bench(args.iterations, args.warmup))
+    for grant, summary in results.items():
+        print_summary(f"grant_type={grant}", summary)
+    finish("token", results, args.out, args.compare, args.no_save)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 import inspect
+import itertools
+import json
 import logging
+import os
+import secrets
 import sys
-from typing import Any
-from fastapi import FastAPI, Request, Response
+import time
+import traceback
+import weakref
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
 import loguru
 from loguru import logger
 
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from apiserver.env import Config
-from auth.core.util import random_time_hash_hex
 
 
 # copied from loguru docs
@@ -64,72 +70,276 @@ def logger_format(record: "loguru.Record") -> str:
     )
 
 
-def logger_stderr_sink() -> None:
-    # Adapted from default loguru format
+# Used when LOG_LEVEL is not set in the config, environments that are not listed use DEBUG
+DEFAULT_LOG_LEVELS = {"production": "INFO"}
+
+
+def log_level(config: Config) -> str:
+    if config.LOG_LEVEL:
+        return config.LOG_LEVEL
+    return DEFAULT_LOG_LEVELS.get(config.APISERVER_ENV, "DEBUG")
+
+
+class LogSampler:
+    """
+    Decides which requests are sampled, i.e. have their DEBUG and TRACE messages logged. This allows keeping debug
+    logging on in production for a fraction of the traffic. Sampling is done per key (the first segment of the path), so
+    rare routes are not drowned out by common ones.
+
+    Of every `every` requests with the same key one is sampled, which is further limited by a token bucket allowing
+    `per_second` sampled requests per second (if it is larger than 0). By default every request is sampled.
+    """
+
+    # Keys come from the path, so to bound the memory use any keys beyond this share a single key
+    MAX_KEYS = 256
+    OTHER_KEY = "<other>"
+
+    every: int
+    per_second: float
+    counts: dict[str, int]
+    buckets: dict[str, tuple[float, float]]
+
+    def __init__(self, every: int = 1, per_second: float = 0) -> None:
+        self.configure(every, per_second)
+
+    def configure(self, every: int, per_second: float) -> None:
+        self.every = max(every, 1)
+        self.per_second = per_second
+        self.counts = {}
+        self.buckets = {}
+
+    def sample(self, key: str) -> bool:
+        if key not in self.counts and len(self.counts) >= self.MAX_KEYS:
+            key = self.OTHER_KEY
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        if count % self.every != 0:
+            return False
+        if self.per_second <= 0:
+            return True
+
+        # The bucket holds at most one second worth of tokens
+        capacity = max(self.per_second, 1.0)
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * self.per_second)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+
+# Used by the LoggerMiddleware, configured at startup using `configure_log_sampling`
+log_sampler = LogSampler()
+
+
+class RequestInfo:
+    """Information about the request that is currently being handled, set by the `LoggerMiddleware`. The scope is the
+    one that is used by the app, so after routing it also contains the matched route."""
+
+    __slots__ = ("request_id", "sampled", "scope")
+
+    request_id: str
+    scope: Scope
+    sampled: bool
+
+    def __init__(self, request_id: str, scope: Scope, sampled: bool) -> None:
+        self.request_id = request_id
+        self.scope = scope
+        self.sampled = sampled
+
+
+current_request: ContextVar[Optional[RequestInfo]] = ContextVar(
+    "current_request", default=None
+)
+_info_no = logger.level("INFO").no
+
+
+def configure_log_sampling(config: Config) -> None:
+    log_sampler.configure(config.LOG_SAMPLE_EVERY, config.LOG_SAMPLE_PER_SECOND)
 
-    logger.add(sys.stderr, colorize=True, format=logger_format, level="DEBUG")
+
+def sampled_filter(record: "loguru.Record") -> bool:
+    """Sink filter that drops messages below INFO of requests that are not sampled. Filters run before a message is
+    formatted and written, so only the cost of creating the record remains."""
+    if record["level"].no >= _info_no:
+        return True
+    # Outside of requests everything is logged
+    request = current_request.get()
+    return request is None or request.sampled
+
+
+def logger_stderr_sink(level: str = "DEBUG") -> None:
+    # Adapted from default loguru format
+    # With enqueue, messages are written by a background thread, so writing to stderr does not block the event loop
+    logger.add(
+        sys.stderr,
+        colorize=True,
+        format=logger_format,
+        level=level,
+        enqueue=True,
+        filter=sampled_filter,
+    )
     # logger = logger.patch(lambda record: record["extra"].update(utc=datetime.utcnow()))
 
 
-# we need 'loguru.Message' due to the way Loguru's type hints work
-def dict_sink(msg: "loguru.Message") -> None:
-    # TODO implement
-    pass
+def struct_record(record: "loguru.Record") -> dict[str, Any]:
+    """Converts a log record to a flat dictionary that can be serialized as JSON."""
+    extra = record["extra"]
+    struct: dict[str, Any] = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "name": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+        # The request ID is stored with the separator used in the text format
+        "request_id": extra.get("request_id", "").removesuffix(": "),
+    }
+    for key, value in extra.items():
+        if key not in {"request_id", "struct"}:
+            struct[key] = value
+    exception = record["exception"]
+    if exception is not None:
+        struct["exception"] = "".join(
+            traceback.format_exception(
+                exception.type, exception.value, exception.traceback
+            )
+        )
+    return struct
 
 
-def logger_dict_sink(log_dict: dict[str, Any]) -> None:
-    logger.add(dict_sink, format=logger_format, level="DEBUG")
+def struct_format(record: "loguru.Record") -> str:
+    # Loguru formats the returned string with the record, so the JSON itself must not be part of it
+    record["extra"]["struct"] = json.dumps(struct_record(record), default=str)
+    return "{extra[struct]}\n"
 
 
 # we need 'loguru.Message' due to the way Loguru's type hints work
-def struct_file_sink(msg: "loguru.Message") -> None:
-    # TODO implement
-    pass
+def dict_sink(records: list[dict[str, Any]]) -> Callable[["loguru.Message"], None]:
+    def sink(msg: "loguru.Message") -> None:
+        records.append(struct_record(msg.record))
+
+    return sink
+
+
+def logger_dict_sink(records: list[dict[str, Any]], level: str = "DEBUG") -> int:
+    """Adds every log message as a dictionary (see `struct_record`) to `records`. Returns the handler ID."""
+    return logger.add(dict_sink(records), format="{message}", level=level)
+
+
+def logger_struct_file_sink(config: Config, level: str = "DEBUG") -> Optional[int]:
+    """Writes log messages as JSON lines to the file at LOG_STRUCT_PATH, if it is set. Messages are written by a
+    background thread and the file is rotated once it reaches LOG_ROTATION (e.g. '100 MB'), keeping the last
+    LOG_RETENTION files. Returns the handler ID."""
+    if not config.LOG_STRUCT_PATH:
+        return None
+
+    return logger.add(
+        config.LOG_STRUCT_PATH,
+        format=struct_format,
+        level=level,
+        enqueue=True,
+        filter=sampled_filter,
+        rotation=config.LOG_ROTATION,
+        retention=config.LOG_RETENTION,
+        encoding="utf-8",
+    )
+
+
+class RequestIdGenerator:
+    """Request IDs only need to be unique enough to tell requests apart in the logs, so instead of hashing random
+    bytes for every request we use a random prefix (which distinguishes processes) followed by a counter. They have the
+    same length (16 hex characters) as `random_time_hash_hex(short=True)`.
+
+    A new prefix is chosen in every process forked from the one that created it, as the workers would otherwise share
+    the prefix of the master process when the app is preloaded."""
+
+    prefix: str
+    counter: "itertools.count[int]"
 
+    def __init__(self) -> None:
+        self.reset()
+        _request_id_generators.add(self)
 
-def logger_struct_file_sink(config: Config) -> None:
-    # debug
-    logger.add(struct_file_sink, format=logger_format, level="DEBUG")
+    def reset(self) -> None:
+        self.prefix = secrets.token_hex(3)
+        self.counter = itertools.count()
 
-    # trace
-    logger.add(struct_file_sink, format=logger_format, level="TRACE")
+    def next_id(self) -> str:
+        return f"{self.prefix}{next(self.counter) & 0xFFFFFFFFFF:010x}"
 
-    # warning
-    logger.add(struct_file_sink, format=logger_format, level="WARNING")
 
+_request_id_generators: "weakref.WeakSet[RequestIdGenerator]" = weakref.WeakSet()
 
-class LoggerMiddleware(BaseHTTPMiddleware):
+
+def _reset_request_ids() -> None:
+    for generator in _request_id_generators:
+        generator.reset()
+
+
+os.register_at_fork(after_in_child=_reset_request_ids)
+
+
+class LoggerMiddleware:
     """
     Logs every request and response. By default it logs at DEBUG level, but routes set in `trace_routes` are logged
-    at TRACE level.
+    at TRACE level. Only requests sampled by the `LogSampler` are logged, which also determines whether the DEBUG and
+    TRACE messages logged while handling the request are kept (see `sampled_filter`).
+
+    This is a pure ASGI middleware rather than a `BaseHTTPMiddleware`, as the latter runs every request in a separate
+    task and wraps the response in a stream, which adds overhead to every request.
     """
 
+    app: ASGIApp
     trace_routes: set[str]
-
-    def __init__(self, app: FastAPI, trace_routes: set[str]) -> None:
+    request_ids: RequestIdGenerator
+    sampler: LogSampler
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        trace_routes: set[str],
+        sampler: Optional[LogSampler] = None,
+    ) -> None:
         """
         Args:
-            app: the FastAPI app that will use this middleware.
+            app: the ASGI app that will use this middleware.
             trace_routes: set of routes that will not be logged at debug level but at trace level instead.
+            sampler: decides which requests are logged, by default the module's `log_sampler`.
         """
-        super().__init__(app)
+        self.app = app
         self.trace_routes = trace_routes
-
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        # For the static files we do not want debug logs for every request
-        request_id = random_time_hash_hex(short=True) + ": "
-        with logger.contextualize(request_id=request_id):
-            req_path_parts = request.url.path.split("/")
-            if len(req_path_parts) < 1:
-                level = "DEBUG"
-            else:
-                level = "TRACE" if req_path_parts[1] in self.trace_routes else "DEBUG"
-
-            logger.log(level, request.url.path)
-
-            response = await call_next(request)
-            logger.log(level, response.status_code)
-
-        return response
+        self.request_ids = RequestIdGenerator()
+        self.sampler = log_sampler if sampler is None else sampler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = self.request_ids.next_id() + ": "
+        path: str = scope["path"]
+        # The path starts with '/', so the first segment is the second element
+        req_path_parts = path.split("/", 2)
+        first_segment = req_path_parts[1] if len(req_path_parts) > 1 else ""
+        sampled = self.sampler.sample(first_segment)
+        request_token = current_request.set(RequestInfo(request_id, scope, sampled))
+        try:
+            with logger.contextualize(request_id=request_id):
+                if sampled:
+                    # For the static files we do not want debug logs for every request
+                    level = "TRACE" if first_segment in self.trace_routes else "DEBUG"
+                    logger.log(level, path)
+
+                    async def send_log_status(message: Message) -> None:
+                        if message["type"] == "http.response.start":
+                            logger.log(level, message["status"])
+                        await send(message)
+
+                    await self.app(scope, receive, send_log_status)
+                else:
+                    await self.app(scope, receive, send)
+        finally:
+            current_request.reset(request_token)
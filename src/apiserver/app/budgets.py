@@ -0,0 +1,92 @@
+"""
+Round trip budgets of routes (see `store.round_trips`). The budget of a route is the maximum number of round trips a
+single request to it may make, so adding a round trip to one of these routes requires updating its budget here. This
+makes it a deliberate choice instead of an accident.
+
+Set ROUND_TRIP_BUDGETS in the config to 'warn' to log a warning for requests that exceed their budget, or to 'fail' to
+also raise an error after the response has been sent, which fails tests. It is 'off' by default, in which case nothing
+is counted.
+"""
+
+from typing import Optional
+
+from loguru import logger
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from apiserver.data.source import Source
+from store.round_trips import RoundTrips, count_round_trips
+
+ROUTE_BUDGETS: dict[str, RoundTrips] = {
+    # Retrieves the user's password file and stores the login state
+    "/login/start/": RoundTrips(db_checkouts=1, statements=1, kv_commands=1),
+    # Retrieves the login state and stores the authenticated user
+    "/login/finish/": RoundTrips(db_checkouts=0, statements=0, kv_commands=2),
+    # The refresh token grant retrieves the keys (3 commands), retrieves the saved refresh token and replaces it. The
+    # authorization code grant retrieves the keys, the authenticated user and the auth request, then retrieves the user
+    # data and saves the refresh token using a single connection.
+    "/oauth/token/": RoundTrips(db_checkouts=2, statements=3, kv_commands=5),
+}
+
+
+class RoundTripBudgetExceeded(AssertionError):
+    pass
+
+
+def budget_mode(scope: Scope) -> str:
+    dsrc: Optional[Source] = scope.get("state", {}).get("dsrc")
+    if dsrc is None:
+        return "off"
+    return dsrc.config.ROUND_TRIP_BUDGETS
+
+
+class RoundTripBudgetMiddleware:
+    """Counts the round trips of every request and compares them to the budget of its route, if it has one."""
+
+    app: ASGIApp
+    budgets: dict[str, RoundTrips]
+    mode: Optional[str]
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        budgets: Optional[dict[str, RoundTrips]] = None,
+        mode: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            app: the ASGI app that will use this middleware.
+            budgets: budgets by route template, by default `ROUTE_BUDGETS`.
+            mode: overrides ROUND_TRIP_BUDGETS of the config.
+        """
+        self.app = app
+        self.budgets = ROUTE_BUDGETS if budgets is None else budgets
+        self.mode = mode
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        mode = budget_mode(scope) if self.mode is None else self.mode
+        if scope["type"] != "http" or mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        with count_round_trips() as trips:
+            await self.app(scope, receive, send)
+
+        # FastAPI adds the matched route to the scope during routing
+        route = scope.get("route")
+        if route is None:
+            return
+        route_path: str = route.path
+        budget = self.budgets.get(route_path)
+        if budget is None:
+            return
+        exceeded = trips.exceeded(budget)
+        if not exceeded:
+            return
+
+        message = (
+            f"Request to {route_path} exceeded its round trip budget ({budget}) for"
+            f" {', '.join(exceeded)}: {trips}"
+        )
+        if mode == "fail":
+            raise RoundTripBudgetExceeded(message)
+        logger.warning(message)
@@ -1,3 +1,4 @@
+import secrets
 from typing import Annotated
 from fastapi import Depends, Request
 from apiserver.app.error import ErrorResponse
@@ -109,3 +110,24 @@ async def require_member(acc: AccessDep) -> AccessToken:
 
 RequireMember = Annotated[AccessToken, Depends(require_member)]
 RequireAdmin = Annotated[AccessToken, Depends(require_admin)]
+
+
+async def require_metrics_token(authorization: Authorization, dsrc: SourceDep) -> None:
+    """Prometheus cannot log in to get an access token, so the metrics are protected by a static bearer token."""
+    metrics_token = dsrc.config.METRICS_TOKEN
+    if not metrics_token:
+        raise ErrorResponse(
+            404,
+            err_type="not_found",
+            err_desc="Metrics are not enabled.",
+            debug_key="metrics_disabled",
+        )
+    if not secrets.compare_digest(
+        authorization.encode("utf-8"), f"Bearer {metrics_token}".encode("utf-8")
+    ):
+        raise ErrorResponse(
+            403,
+            err_type="invalid_token",
+            err_desc="Invalid metrics token.",
+            debug_key="bad_metrics_token",
+        )
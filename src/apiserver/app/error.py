@@ -12,6 +12,7 @@ class ErrorKeys(StrEnum):
     GET_CLASS = "invalid_get_class"
     CHECK = "invalid_code_check"
     UPDATE = "invalid_update"
+    KEY_ROTATION = "invalid_key_rotation"
 
 
 class AppError(Exception):
@@ -0,0 +1,101 @@
+"""
+Detects synchronous work that blocks the event loop, which delays every other request handled by the worker.
+
+- The lag monitor is a background task that sleeps for a fixed interval and measures how much later it woke up than
+  scheduled. This works with every event loop, but does not tell what blocked it.
+- The slow callback monitor times every callback run by the event loop (every step of every task is a callback), by
+  wrapping `asyncio.Handle._run`. Callbacks that take longer than the threshold are logged with the request ID and route
+  of the request they belong to. This only works with the default asyncio event loop, not with uvloop, as its handles
+  are not Python objects. The gunicorn workers therefore run on the asyncio loop (see `apiserver.gunicorn_conf`). With
+  uvloop, the lag monitor logs blocking of the loop instead.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+from loguru import logger
+
+from apiserver.app.app_logging import current_request
+from apiserver.app.metrics import (
+    UNMATCHED_ROUTE,
+    event_loop_lag,
+    slow_callback_duration,
+)
+
+LAG_INTERVAL = 0.5
+
+_original_handle_run = asyncio.Handle._run
+# A threshold of 0 means the slow callback monitor is not installed
+_slow_callback = {"threshold": 0.0}
+
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    # For the steps of a task the callback is a method of the task
+    task = getattr(handle._callback, "__self__", None)  # type: ignore[attr-defined]
+    if isinstance(task, asyncio.Task):
+        coro_name = getattr(task.get_coro(), "__qualname__", "?")
+        return f"task {task.get_name()} ({coro_name})"
+    return repr(handle)
+
+
+def report_slow_callback(handle: asyncio.Handle, duration: float) -> None:
+    # The callback ran in the context of the handle, which is where the request is set
+    request = handle._context.get(current_request)  # type: ignore[attr-defined]
+    request_id = ""
+    route_path = UNMATCHED_ROUTE
+    if request is not None:
+        request_id = request.request_id
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else UNMATCHED_ROUTE
+
+    slow_callback_duration.labels(route_path).observe(duration)
+    logger.bind(request_id=request_id).warning(
+        f"Event loop blocked for {duration * 1000:.1f} ms by"
+        f" {describe_callback(handle)} (route {route_path})."
+    )
+
+
+def _timed_handle_run(self: asyncio.Handle) -> None:
+    start = time.perf_counter()
+    _original_handle_run(self)
+    duration = time.perf_counter() - start
+    if duration >= _slow_callback["threshold"]:
+        report_slow_callback(self, duration)
+
+
+def install_slow_callback_monitor(threshold: float) -> bool:
+    """Reports every callback that takes at least `threshold` seconds. Returns False if it is not installed, because the
+    threshold is 0 or the running event loop is not the default asyncio loop."""
+    if threshold <= 0:
+        return False
+    if not isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop):
+        logger.info(
+            "Slow callbacks cannot be monitored for this event loop, only the loop lag"
+            " is."
+        )
+        return False
+
+    _slow_callback["threshold"] = threshold
+    asyncio.Handle._run = _timed_handle_run  # type: ignore[method-assign]
+    return True
+
+
+def uninstall_slow_callback_monitor() -> None:
+    asyncio.Handle._run = _original_handle_run  # type: ignore[method-assign]
+    _slow_callback["threshold"] = 0.0
+
+
+async def loop_lag_loop(
+    log_threshold: Optional[float] = None, interval: float = LAG_INTERVAL
+) -> None:
+    """Run as a background task. Lag of at least `log_threshold` seconds is also logged, which should only be set when
+    the slow callback monitor is not installed."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        event_loop_lag.observe(lag)
+        if log_threshold is not None and lag >= log_threshold:
+            logger.warning(f"Event loop blocked for {lag * 1000:.1f} ms.")
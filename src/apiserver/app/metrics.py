@@ -0,0 +1,234 @@
+"""
+Prometheus metrics for the apiserver. The metrics are defined at module level, so every process has exactly one set.
+
+When running with multiple gunicorn workers, every worker is a separate process with its own metrics. To aggregate
+them, set the `PROMETHEUS_MULTIPROC_DIR` environment variable to an empty directory before the workers start. Each
+worker then writes its values to memory-mapped files in that directory, which are combined when `/metrics` is scraped,
+no matter which worker handles the scrape. The gunicorn `child_exit` hook (see `apiserver.gunicorn_conf`) calls
+`mark_worker_dead`, so that the gauges of exited workers are removed.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+
+from loguru import logger
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from apiserver.data.source import Source
+from auth.core.span import SpanRecorder, record_spans
+from store import Store
+
+# Requests that do not match any route (e.g. 404s or static files) all get the same label, to bound the cardinality
+UNMATCHED_ROUTE = "<unmatched>"
+# How often the connection pool gauges are updated by every worker
+POOL_STATS_INTERVAL = 5.0
+
+http_requests = Counter(
+    "http_requests",
+    "Total number of HTTP requests.",
+    ["method", "route", "status"],
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, from receiving the request until the response has been"
+    " sent.",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+http_requests_in_progress = Gauge(
+    "http_requests_in_progress",
+    "Number of HTTP requests that are currently being handled.",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+span_duration = Histogram(
+    "span_duration_seconds",
+    "Duration of the stages (spans) of operations, such as fetching keys or signing"
+    " tokens.",
+    ["span"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 1),
+)
+data_function_duration = Histogram(
+    "data_function_duration_seconds",
+    "Duration of calls to data functions through a context, by whether they raised an"
+    " exception.",
+    ["function", "outcome"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 1),
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "How much later than scheduled the event loop ran a periodic check, i.e. how long"
+    " it was blocked.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+slow_callback_duration = Histogram(
+    "event_loop_slow_callback_duration_seconds",
+    "Duration of event loop callbacks that took longer than the slow callback"
+    " threshold, by the route of the request they belong to.",
+    ["route"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+pool_connections = Gauge(
+    "pool_connections",
+    "Connections of the database ('db') and Redis ('kv') connection pools, by state.",
+    ["pool", "state"],
+    multiprocess_mode="livesum",
+)
+
+
+def metrics_registry() -> CollectorRegistry:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # A new registry is necessary, as the default one would also include the metrics of this process twice
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Returns the metrics of all workers in the Prometheus text format, along with its content type. In multiprocess
+    mode this reads files, so it should not be called from the event loop."""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid: int) -> None:
+    """For use in the gunicorn `child_exit` hook."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)  # type: ignore[no-untyped-call]
+
+
+def update_pool_metrics(store: Store) -> None:
+    for stat, value in store.pool_stats().items():
+        pool, state = stat.split("_", 1)
+        pool_connections.labels(pool, state).set(value)
+
+
+async def pool_metrics_loop(store: Store) -> None:
+    """Every worker has its own connection pools, so every worker updates its own gauges. Run as a background task."""
+    while True:
+        try:
+            update_pool_metrics(store)
+        except Exception:
+            # The gauges are only informational, so the next update is tried anyway
+            logger.exception("Could not update the connection pool metrics.")
+        await asyncio.sleep(POOL_STATS_INTERVAL)
+
+
+class ContextMetricsHook:
+    """Records the latency and number of calls of every data function called through a context (see
+    `datacontext.context.ContextHook`)."""
+
+    children: dict[tuple[str, str], Histogram]
+
+    def __init__(self) -> None:
+        self.children = {}
+
+    def before(self, name: str) -> int:
+        return time.perf_counter_ns()
+
+    def after(self, name: str, state: int, error: Optional[BaseException]) -> None:
+        duration_ns = time.perf_counter_ns() - state
+        key = (name, "ok" if error is None else "error")
+        child = self.children.get(key)
+        if child is None:
+            child = data_function_duration.labels(*key)
+            self.children[key] = child
+        child.observe(duration_ns / 1e9)
+
+
+def server_timing_enabled(scope: Scope) -> bool:
+    """The span durations reveal details of what the server does, so they are only sent outside production."""
+    dsrc: Optional[Source] = scope.get("state", {}).get("dsrc")
+    if dsrc is None:
+        return False
+    return dsrc.config.APISERVER_ENV != "production"
+
+
+def server_timing_header(recorder: SpanRecorder) -> str:
+    return ", ".join(
+        f"{name};dur={duration / 1e6:.3f}" for name, duration in recorder.spans
+    )
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and records their latency, labeled by method, route template (e.g. '/admin/users/') and status.
+    The route template is only known after routing, which is why this wraps the whole app. As it runs on every
+    request, it is a pure ASGI middleware and caches the labeled metrics.
+
+    The spans (see `auth.core.span`) of every request are also recorded and, outside production, sent in the
+    `Server-Timing` header.
+    """
+
+    app: ASGIApp
+    children: dict[tuple[str, str, str], tuple[Counter, Histogram]]
+    span_children: dict[str, Histogram]
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.children = {}
+        self.span_children = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method: str = scope["method"]
+        status = 500
+        recorder = SpanRecorder()
+        server_timing = server_timing_enabled(scope)
+
+        async def send_record_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if server_timing and recorder.spans:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", server_timing_header(recorder))
+            await send(message)
+
+        in_progress = http_requests_in_progress.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            with record_spans(recorder):
+                await self.app(scope, receive, send_record_status)
+        finally:
+            duration = time.perf_counter() - start
+            in_progress.dec()
+            # FastAPI adds the matched route to the scope during routing
+            route = scope.get("route")
+            route_path: str = route.path if route is not None else UNMATCHED_ROUTE
+            key = (method, route_path, str(status))
+            children = self.children.get(key)
+            if children is None:
+                children = (
+                    http_requests.labels(*key),
+                    http_request_duration.labels(*key),
+                )
+                self.children[key] = children
+            children[0].inc()
+            children[1].observe(duration)
+            self.observe_spans(recorder)
+
+    def observe_spans(self, recorder: SpanRecorder) -> None:
+        for name, duration_ns in recorder.spans:
+            child = self.span_children.get(name)
+            if child is None:
+                child = span_duration.labels(name)
+                self.span_children[name] = child
+            child.observe(duration_ns / 1e9)
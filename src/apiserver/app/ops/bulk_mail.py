@@ -0,0 +1,177 @@
+"""
+Sending a message to all active members. The job runs as a task in the worker that received the request. It reads the
+members a page at a time, each with its own short-lived connection, so no database connection is held while the emails
+are sent. Every page is rendered at once and then sent concurrently over the SMTP pool (so over at most SMTP_POOL_SIZE
+connections). At most BULK_MAIL_PER_SECOND emails are sent per second, to stay within the limits of the mail server.
+The progress is stored in Redis after every batch, so it can be retrieved from any worker.
+"""
+
+import asyncio
+from email.message import EmailMessage
+from typing import AsyncIterator
+
+from aiosmtplib import SMTPException
+from loguru import logger
+
+from apiserver import data
+from apiserver.app.ops.mail import get_mail_templates
+from apiserver.data import Source
+from apiserver.define import DEFINE, loc_dict
+from apiserver.lib.actions.mail import SmtpPool, build_email_message
+from apiserver.lib.model.entities import BulkMailJob, UserEmail
+from auth.core.util import random_time_hash_hex, utc_timestamp
+
+BULK_BATCH_SIZE = 50
+BULK_TEMPLATE = "announcement.jinja2"
+
+# The event loop only keeps weak references to tasks, so the running jobs are kept here
+bulk_tasks: set[asyncio.Task[None]] = set()
+
+
+class RateLimiter:
+    """Spaces out the returns of `wait`, so that it returns at most `per_second` times per second."""
+
+    interval: float
+    next_time: float
+
+    def __init__(self, per_second: float) -> None:
+        self.interval = 1 / per_second
+        self.next_time = 0.0
+
+    async def wait(self) -> None:
+        now = asyncio.get_running_loop().time()
+        # The slot is reserved before sleeping, so that concurrent callers get the next slots
+        slot = max(self.next_time, now)
+        self.next_time = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def render_bulk_batch(
+    recipients: list[UserEmail], subject: str, message: str
+) -> list[EmailMessage]:
+    from_name = loc_dict["loc"]["org_name"]
+    messages = []
+    for recipient in recipients:
+        text, html = get_mail_templates().render(
+            BULK_TEMPLATE, {"firstname": recipient.firstname, "message": message}
+        )
+        messages.append(
+            build_email_message(
+                text,
+                html,
+                recipient.email,
+                DEFINE.onboard_email,
+                subject,
+                f"{recipient.firstname} {recipient.lastname}",
+                from_name,
+            )
+        )
+    return messages
+
+
+async def send_limited(
+    smtp_pool: SmtpPool, limiter: RateLimiter, message: EmailMessage
+) -> bool:
+    await limiter.wait()
+    try:
+        await smtp_pool.send(message)
+    except (SMTPException, OSError) as e:
+        logger.warning(f"Could not send bulk email to {message['To']}: {e}")
+        return False
+    return True
+
+
+async def active_email_batches(
+    dsrc: Source, batch_size: int
+) -> AsyncIterator[list[UserEmail]]:
+    """Pages through the active members by user ID. Members added or deactivated during the job may or may not be
+    included, but no member is included twice."""
+    after_user_id = ""
+    while True:
+        async with data.get_conn(dsrc) as conn:
+            recipients = await data.ud.get_active_emails_page(
+                conn, after_user_id, batch_size
+            )
+        if recipients:
+            yield recipients
+        if len(recipients) < batch_size:
+            return
+        after_user_id = recipients[-1].user_id
+
+
+async def send_bulk_mail(
+    dsrc: Source,
+    smtp_pool: SmtpPool,
+    job: BulkMailJob,
+    message: str,
+    batches: AsyncIterator[list[UserEmail]],
+    limiter: RateLimiter,
+) -> None:
+    async for recipients in batches:
+        emails = render_bulk_batch(recipients, job.subject, message)
+        results = await asyncio.gather(
+            *(send_limited(smtp_pool, limiter, email) for email in emails)
+        )
+        sent = sum(results)
+        job.sent += sent
+        job.failed += len(results) - sent
+        await data.trs.bulk_mail.store_bulk_job(dsrc, job)
+
+
+async def run_bulk_mail(
+    dsrc: Source, smtp_pool: SmtpPool, job: BulkMailJob, message: str
+) -> None:
+    try:
+        limiter = RateLimiter(dsrc.config.BULK_MAIL_PER_SECOND)
+        batches = active_email_batches(dsrc, BULK_BATCH_SIZE)
+        await send_bulk_mail(dsrc, smtp_pool, job, message, batches, limiter)
+        job.status = "finished"
+    except asyncio.CancelledError:
+        # The worker is shutting down (see `stop_bulk_mail`), the remaining members do not receive the message
+        job.status = "cancelled"
+        raise
+    except Exception:
+        # There is no one to report the error to, so it is recorded in the job
+        logger.exception(f"Bulk mail job {job.job_id} failed.")
+        job.status = "failed"
+    finally:
+        job.finished = utc_timestamp()
+        try:
+            await data.trs.bulk_mail.store_bulk_job(dsrc, job)
+        except Exception:
+            logger.exception(
+                f"Could not store the result of bulk mail job {job.job_id}."
+            )
+        logger.info(
+            f"Bulk mail job {job.job_id} {job.status}, sent {job.sent} and failed"
+            f" {job.failed} emails."
+        )
+
+
+async def start_bulk_mail(
+    dsrc: Source, smtp_pool: SmtpPool, subject: str, message: str
+) -> BulkMailJob:
+    """Starts sending the message to all active members. Returns the job, which is stored before any email is sent."""
+    job = BulkMailJob(
+        job_id=random_time_hash_hex(short=True),
+        subject=subject,
+        started=utc_timestamp(),
+    )
+    await data.trs.bulk_mail.store_bulk_job(dsrc, job)
+    # The job continues after the request, with its own copy of the progress
+    task = asyncio.create_task(
+        run_bulk_mail(dsrc, smtp_pool, job.model_copy(), message)
+    )
+    bulk_tasks.add(task)
+    task.add_done_callback(bulk_tasks.discard)
+    return job
+
+
+async def stop_bulk_mail() -> None:
+    """Cancels the running jobs and waits until they have stored their result. Call it before the store and the SMTP
+    pool are closed."""
+    tasks = list(bulk_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
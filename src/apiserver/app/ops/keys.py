@@ -0,0 +1,112 @@
+"""
+Rotation of the keys used for tokens while the server is running. A new key is added to the encrypted JWK Set in the
+database and becomes the current key of its use (the newest one). Once that is committed, the worker that rotates the
+keys loads them like the startup leader does and publishes the new key state over Redis. Every worker listens for new
+key states (see `key_state_loop`) and replaces its own, so new tokens use the new key without any restart.
+
+The previous symmetric key remains the old symmetric key, so refresh tokens encrypted with it can still be used. Those
+encrypted with any key before that are rejected, so a symmetric key is only rotated once the refresh tokens encrypted
+with the old one have expired, i.e. at least the refresh token lifetime after the current one was added.
+"""
+
+import asyncio
+from typing import Literal
+
+from loguru import logger
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from apiserver import data
+from apiserver.app.error import AppError, ErrorKeys
+from apiserver.app.ops.startup import (
+    load_keys_from_jwk,
+    load_public_keys,
+    store_keys,
+)
+from apiserver.data import Source
+from apiserver.data.source import KeyState
+from apiserver.define import refresh_exp
+from apiserver.env import Config
+from apiserver.lib.hazmat import keys
+from apiserver.lib.model.entities import JWK
+from auth.core import util
+
+KeyUse = Literal["enc", "sig"]
+
+# Time to wait before listening again after an error, such as Redis not being reachable
+KEY_STATE_ERROR_DELAY = 5
+
+
+def new_key(use: KeyUse) -> JWK:
+    kid = util.random_time_hash_hex(short=True)
+    if use == "enc":
+        return keys.new_symmetric_key(kid)
+    return keys.new_ed448_keypair(kid)
+
+
+async def check_symmetric_rotation(conn: AsyncConnection) -> None:
+    issued = await data.key.get_newest_symmetric_issued(conn)
+    if util.utc_timestamp() < issued + refresh_exp:
+        raise AppError(
+            ErrorKeys.KEY_ROTATION,
+            "Refresh tokens encrypted with the old symmetric key could still be valid"
+            " and would be rejected. Symmetric keys can be rotated once every"
+            f" {refresh_exp // (24 * 60 * 60)} days.",
+            "symmetric_rotation_too_soon",
+        )
+
+
+async def rotate_keys(dsrc: Source, config: Config, use: KeyUse) -> KeyState:
+    """Adds a new key for `use` and makes it the current one in all workers. Raises AppError if a symmetric key was
+    rotated within the refresh token lifetime."""
+    key = new_key(use)
+    async with data.get_conn(dsrc) as conn:
+        # The JWK Set is locked until the key is committed, so concurrent rotations do not overwrite each other's keys
+        await load_keys_from_jwk(conn, config, [key])
+        # Checked while locked, so two concurrent rotations cannot both pass
+        if use == "enc":
+            await check_symmetric_rotation(conn)
+        await data.key.insert_key(conn, key.kid, util.utc_timestamp(), use)
+    # The key is only used once it is committed, as tokens issued with a key that is lost can never be verified again
+    async with data.get_conn(dsrc) as conn:
+        # Locked again until the key state is published, so concurrent rotations publish in order and the last one
+        # includes the keys of all of them
+        key_set = await load_keys_from_jwk(conn, config)
+        key_state = await store_keys(dsrc, conn, key_set)
+        await data.trs.key.publish_key_state(dsrc, key_state)
+    # This worker does not have to wait for its own message
+    await use_key_state(dsrc, key_state)
+    logger.info(f"Rotated {use} key, new key {key.kid}.")
+    return key_state
+
+
+async def use_key_state(dsrc: Source, key_state: KeyState) -> None:
+    if key_state.generation == dsrc.key_state.generation:
+        return
+    public_keys = await load_public_keys(dsrc, key_state)
+    # Requests read the key state once, so they use either all old or all new keys. Both are replaced without awaiting
+    # in between, so no request sees the public keys of another generation.
+    dsrc.public_keys = public_keys
+    dsrc.key_state = key_state
+    logger.info(f"Using keys of generation {key_state.generation}.")
+
+
+async def key_state_loop(dsrc: Source) -> None:
+    """Run as a background task in every worker."""
+    while True:
+        try:
+            async for key_state in data.trs.key.key_state_updates(dsrc):
+                try:
+                    await use_key_state(dsrc, key_state)
+                except Exception:
+                    # The next key state may work, such as when the public keys were not stored yet
+                    logger.exception(
+                        f"Could not use keys of generation {key_state.generation}."
+                    )
+        except RedisError as e:
+            logger.warning(f"Could not listen for new keys: {e}")
+            await asyncio.sleep(KEY_STATE_ERROR_DELAY)
+        except Exception:
+            # Such as a message that is not a valid key state, we subscribe again and read the stored key state
+            logger.exception("Unexpected error while listening for new keys.")
+            await asyncio.sleep(KEY_STATE_ERROR_DELAY)
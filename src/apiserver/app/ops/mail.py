@@ -1,13 +1,24 @@
-from typing import Optional, Any, TypedDict
+import asyncio
+import os
+import socket
+from functools import cache
+from typing import TYPE_CHECKING, Optional, Any
 
-
-from fastapi import BackgroundTasks
 from loguru import logger
+from redis.exceptions import RedisError
 
+from apiserver.data import Source
+from apiserver.data.trs import outbox
+from apiserver.data.trs.outbox import InvalidEntry, OutboxEntry
 from apiserver.env import Config
-from apiserver.lib.actions.mail import send_email_vars
-from apiserver.define import template_env, loc_dict, DEFINE
+from apiserver.lib.model.entities import QueuedEmail
+from apiserver.define import get_template_env, loc_dict, DEFINE
+from auth.core.util import random_time_hash_hex, utc_timestamp
 
+if TYPE_CHECKING:
+    # Only needed to actually send mail, so they are imported when mail is enabled (see `mail_from_config`). Queueing
+    # emails does not need them.
+    from apiserver.lib.actions.mail import EmailTemplates, SmtpPool
 
 __all__ = [
     "send_signup_email",
@@ -15,128 +26,155 @@ __all__ = [
     "send_change_email_email",
     "send_reset_email",
     "mail_from_config",
+    "mail_outbox_loop",
+    "get_mail_templates",
 ]
 
+# Emails read from the outbox at once, which are sent concurrently (limited by the size of the SMTP pool)
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_BLOCK_MS = 5000
+# Emails that have been pending for this long are assumed to be from a worker that stopped
+OUTBOX_CLAIM_IDLE_MS = 5 * 60 * 1000
+# Failed emails are retried after 30 seconds, doubling every attempt up to an hour, and are dropped after 10 attempts
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+MAX_ATTEMPTS = 10
+# Time to wait before reading again after an error, such as Redis not being reachable
+OUTBOX_ERROR_DELAY = 5
+
+
+@cache
+def get_mail_templates() -> "EmailTemplates":
+    """All templates are compiled at startup if mail is enabled."""
+    from apiserver.lib.actions.mail import EmailTemplates
 
-class MailServer(TypedDict):
-    mail_pass: str
-    smtp_server: str
-    smtp_port: int
+    return EmailTemplates(get_template_env(), loc_dict)
 
 
-def mail_from_config(config: Config) -> Optional[MailServer]:
+def mail_from_config(config: Config) -> Optional["SmtpPool"]:
+    """Creates the connection pool for sending mail, which only connects when the first email is sent."""
     if not config.MAIL_ENABLED:
-        logger.debug("Mail disabled, not sending email.")
+        logger.debug("Mail disabled, emails will not be sent.")
         return None
-    return {
-        "mail_pass": config.MAIL_PASS,
-        "smtp_port": config.SMTP_PORT,
-        "smtp_server": config.SMTP_SERVER,
-    }
+    from apiserver.lib.actions.mail import SmtpPool
+
+    return SmtpPool(
+        config.SMTP_SERVER,
+        config.SMTP_PORT,
+        username=DEFINE.onboard_email,
+        password=config.MAIL_PASS,
+        size=config.SMTP_POOL_SIZE,
+    )
 
 
-def send_email(
+async def send_email(
     template: str,
     receiver_email: str,
-    mail_server: Optional[MailServer],
+    mail_server: Optional["SmtpPool"],
     subject: str,
     receiver_name: Optional[str] = None,
     add_vars: Optional[dict[str, Any]] = None,
 ) -> None:
-    """Automatically loads the localization dictionary from the filesystem, with add_vars replacing any keys and adding
-    any ones that are undefined by the localization."""
+    """The localization is already part of the compiled templates (see `get_mail_templates`), add_vars contains the
+    variables of this email."""
     if mail_server is None:
         # Don't send anything
         return
-    if add_vars is None:
-        add_vars = dict()
-    templ_vars = loc_dict | add_vars
-    send_email_vars(
+    from apiserver.lib.actions.mail import send_email_vars
+
+    await send_email_vars(
         template_name=template,
-        has_html=True,
-        loaded_env=template_env,
-        templ_vars=templ_vars,
+        templates=get_mail_templates(),
+        templ_vars=add_vars if add_vars is not None else {},
         receiver_email=receiver_email,
         receiver_name=receiver_name,
-        mail_pass=mail_server["mail_pass"],
+        smtp_pool=mail_server,
         from_email=DEFINE.onboard_email,
         from_name=loc_dict["loc"]["org_name"],
-        l_smtp_server=mail_server["smtp_server"],
-        l_smtp_port=mail_server["smtp_port"],
         subject=subject,
     )
 
 
-def send_signup_email(
-    background_tasks: BackgroundTasks,
+async def queue_email(
+    dsrc: Source,
+    template: str,
+    receiver_email: str,
+    subject: str,
+    receiver_name: Optional[str] = None,
+    add_vars: Optional[dict[str, str]] = None,
+) -> None:
+    """Adds the email to the outbox, from which it is sent by one of the workers (see `mail_outbox_loop`)."""
+    if dsrc.mail_server is None:
+        # Don't send anything
+        return
+    email = QueuedEmail(
+        email_id=random_time_hash_hex(short=True),
+        template=template,
+        receiver=receiver_email,
+        subject=subject,
+        receiver_name=receiver_name,
+        add_vars=add_vars if add_vars is not None else {},
+    )
+    await outbox.enqueue_email(dsrc, email)
+
+
+async def send_signup_email(
+    dsrc: Source,
     receiver: str,
     receiver_name: str,
-    mail_server: Optional[MailServer],
     redirect_link: str,
     signup_link: str,
 ) -> None:
     add_vars = {"redirect_link": redirect_link, "signup_link": signup_link}
 
-    def send_lam() -> None:
-        send_email(
-            "confirm.jinja2",
-            receiver,
-            mail_server,
-            "Please confirm your email",
-            receiver_name,
-            add_vars=add_vars,
-        )
-
-    background_tasks.add_task(send_lam)
+    await queue_email(
+        dsrc,
+        "confirm.jinja2",
+        receiver,
+        "Please confirm your email",
+        receiver_name,
+        add_vars=add_vars,
+    )
 
 
-def send_register_email(
-    background_tasks: BackgroundTasks,
+async def send_register_email(
+    dsrc: Source,
     receiver: str,
-    mail_server: Optional[MailServer],
     register_link: str,
 ) -> None:
     add_vars = {"register_link": register_link}
+    org_name = loc_dict["loc"]["org_name"]
 
-    def send_lam() -> None:
-        org_name = loc_dict["loc"]["org_name"]
-        send_email(
-            "register.jinja2",
-            receiver,
-            mail_server,
-            f"Welcome to {org_name}",
-            add_vars=add_vars,
-        )
-
-    background_tasks.add_task(send_lam)
+    await queue_email(
+        dsrc,
+        "register.jinja2",
+        receiver,
+        f"Welcome to {org_name}",
+        add_vars=add_vars,
+    )
 
 
-def send_reset_email(
-    background_tasks: BackgroundTasks,
+async def send_reset_email(
+    dsrc: Source,
     receiver: str,
-    mail_server: Optional[MailServer],
     reset_link: str,
 ) -> None:
     add_vars = {
         "reset_link": reset_link,
     }
 
-    def send_lam() -> None:
-        send_email(
-            "passwordchange.jinja2",
-            receiver,
-            mail_server,
-            "Request for password reset",
-            add_vars=add_vars,
-        )
-
-    background_tasks.add_task(send_lam)
+    await queue_email(
+        dsrc,
+        "passwordchange.jinja2",
+        receiver,
+        "Request for password reset",
+        add_vars=add_vars,
+    )
 
 
-def send_change_email_email(
-    background_tasks: BackgroundTasks,
+async def send_change_email_email(
+    dsrc: Source,
     receiver: str,
-    mail_server: Optional[MailServer],
     reset_link: str,
     old_email: str,
 ) -> None:
@@ -145,13 +183,106 @@ def send_change_email_email(
         "reset_link": reset_link,
     }
 
-    def send_lam() -> None:
-        send_email(
-            "emailchange.jinja2",
-            receiver,
-            mail_server,
-            "Please confirm your new email",
-            add_vars=add_vars,
+    await queue_email(
+        dsrc,
+        "emailchange.jinja2",
+        receiver,
+        "Please confirm your new email",
+        add_vars=add_vars,
+    )
+
+
+def retry_delay(attempts: int) -> int:
+    """Seconds to wait before retrying an email that failed `attempts` times."""
+    return min(RETRY_BASE_DELAY << (attempts - 1), RETRY_MAX_DELAY)
+
+
+async def deliver_email(dsrc: Source, entry_id: str, email: QueuedEmail) -> None:
+    from aiosmtplib import SMTPException
+
+    try:
+        await send_email(
+            email.template,
+            email.receiver,
+            dsrc.mail_server,
+            email.subject,
+            email.receiver_name,
+            email.add_vars,
+        )
+    except (SMTPException, OSError) as e:
+        attempts = email.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(
+                f"Dropping email {email.email_id} ({email.template}) after {attempts}"
+                f" failed attempts: {e}"
+            )
+            await outbox.complete_email(dsrc, entry_id)
+            return
+        delay = retry_delay(attempts)
+        logger.warning(
+            f"Sending email {email.email_id} ({email.template}) failed, retrying in"
+            f" {delay} seconds: {e}"
         )
+        retried = email.model_copy(update={"attempts": attempts})
+        await outbox.retry_email(dsrc, entry_id, retried, utc_timestamp() + delay)
+        return
+    except Exception:
+        # Retrying does not help for other errors, such as a missing template
+        logger.exception(f"Dropping email {email.email_id} ({email.template}).")
+
+    await outbox.complete_email(dsrc, entry_id)
+
+
+async def deliver_batch(dsrc: Source, entries: list[OutboxEntry]) -> None:
+    results = await asyncio.gather(
+        *(deliver_email(dsrc, entry_id, email) for entry_id, email in entries),
+        return_exceptions=True,
+    )
+    for result in results:
+        # The email remains pending and is claimed again later
+        if isinstance(result, BaseException):
+            logger.opt(exception=result).warning(
+                "Could not update the outbox for an email."
+            )
+
+
+async def drop_invalid_entries(dsrc: Source, invalid: list[InvalidEntry]) -> None:
+    for entry_id, reason in invalid:
+        # Otherwise it would remain pending and be claimed by every worker
+        logger.error(f"Dropping invalid outbox entry {entry_id}: {reason}")
+        await outbox.complete_email(dsrc, entry_id)
+
+
+async def process_outbox(dsrc: Source, consumer: str, block_ms: int) -> int:
+    """Sends one batch of emails from the outbox, preferring emails left by stopped workers over new ones. Returns the
+    number of entries in the batch."""
+    await outbox.requeue_due_emails(dsrc, utc_timestamp(), OUTBOX_BATCH_SIZE)
+    entries, invalid = await outbox.claim_stale_emails(
+        dsrc, consumer, OUTBOX_CLAIM_IDLE_MS, OUTBOX_BATCH_SIZE
+    )
+    if not entries and not invalid:
+        entries, invalid = await outbox.read_emails(
+            dsrc, consumer, OUTBOX_BATCH_SIZE, block_ms
+        )
+    await drop_invalid_entries(dsrc, invalid)
+    await deliver_batch(dsrc, entries)
+    return len(entries) + len(invalid)
+
 
-    background_tasks.add_task(send_lam)
+async def mail_outbox_loop(dsrc: Source) -> None:
+    """Run as a background task in every worker, if mail is enabled."""
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    group_created = False
+    while True:
+        try:
+            if not group_created:
+                await outbox.create_outbox_group(dsrc)
+                group_created = True
+            await process_outbox(dsrc, consumer, OUTBOX_BLOCK_MS)
+        except RedisError as e:
+            logger.warning(f"Could not read the mail outbox: {e}")
+            await asyncio.sleep(OUTBOX_ERROR_DELAY)
+        except Exception:
+            # The task must keep running, otherwise no emails are sent by this worker anymore
+            logger.exception("Unexpected error while sending emails from the outbox.")
+            await asyncio.sleep(OUTBOX_ERROR_DELAY)
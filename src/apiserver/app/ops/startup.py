@@ -1,20 +1,25 @@
+import hashlib
+
+import orjson
 from loguru import logger
-from asyncio import sleep
 from datetime import date
-from random import random
+from typing import Optional
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncConnection
 
 from apiserver.data.api.classifications import insert_classification
-from apiserver.data.source import KeyState
+from apiserver.data.source import KeyState, PublicKeys
 from apiserver.env import Config
 from apiserver.lib.model.entities import (
+    JWK,
     JWKSet,
     User,
     UserData,
     JWKPublicEdDSA,
     JWKSymmetricA256GCM,
 )
+from auth.data.authentication import get_apake_setup, get_fake_password_file
 from auth.data.relational.opaque import insert_opaque_row
 from auth.hazmat.structs import A256GCMKey
 from apiserver.lib.hazmat import keys
@@ -25,60 +30,80 @@ from auth.core import util
 from store import StoreError
 from apiserver import data
 from apiserver.data import Source
+from apiserver.data.trs.startup import LOCK_EXPIRE_MS
 from schema.model import metadata as db_model
 from apiserver.data.admin import drop_recreate_database
 from store.error import DataError
 
 
 async def startup(dsrc: Source, config: Config, recreate: bool = False) -> None:
-    # Checks lock: returns True if it is the first lock since at least 25 seconds (lock expire time)
-    is_first_process = await wait_for_lock_is_first(dsrc)
+    # Unique to this process, so only this process can release the lock if it acquires it
+    lock_token = util.random_time_hash_hex()
+    # Returns True if it is the first process since at least 25 seconds (expire time of a released lock)
+    is_first_process = await wait_for_lock_is_first(dsrc, lock_token)
     logger.debug(f"Unlocked startup, first={is_first_process}")
-    # Only recreates if it is also the first lock since at least 25 seconds (lock expire time)
-    logger.debug(f"Startup with recreate={recreate and is_first_process}")
+    try:
+        await startup_steps(dsrc, config, is_first_process, recreate)
+    except BaseException:
+        if is_first_process:
+            # Waiting processes are notified, so they do not continue with a failed startup
+            await data.trs.startup.release_startup_lock(dsrc, lock_token, "failed")
+        raise
+
+    # Release lock
+    if is_first_process:
+        await data.trs.startup.release_startup_lock(dsrc, lock_token, "done")
 
-    # Set lock
-    await data.trs.startup.set_startup_lock(dsrc)
-    if is_first_process and recreate:
+
+async def startup_steps(
+    dsrc: Source, config: Config, is_first_process: bool, recreate: bool
+) -> None:
+    # Only recreates if it is also the first process since at least 25 seconds
+    recreate = recreate and is_first_process
+    logger.debug(f"Startup with recreate={recreate}")
+    if recreate:
         logger.warning("Dropping and recreating...")
         drop_create_database(config)
 
     # Store startup (tests connection)
     await dsrc.store.startup()
 
-    if is_first_process and recreate:
+    if recreate:
         logger.warning("Initial population...")
         await initial_population(dsrc, config)
 
-    # Load keys
-    logger.debug("Loading keys.")
-    key_state = await load_keys(dsrc, config)
+    if is_first_process:
+        logger.debug("Loading keys.")
+        key_state = await load_keys(dsrc, config)
+        # Other processes use the keys prepared by this one
+        await data.trs.key.store_key_state(dsrc, key_state)
+    else:
+        key_state = await load_prepared_keys(dsrc, config)
+    logger.debug(f"Loaded keys of generation {key_state.generation}.")
+    dsrc.public_keys = await load_public_keys(dsrc, key_state)
     dsrc.key_state = key_state
 
-    # Release lock
-    await data.trs.startup.set_startup_lock(dsrc, "not")
+    logger.debug("Loading OPAQUE setup.")
+    await load_opaque_setup(dsrc)
 
 
-MAX_WAIT_INDEX = 15
+# Waiting processes give up when the lock expires, as the process holding it must have stopped
+MAX_WAIT = LOCK_EXPIRE_MS / 1000
 
 
-async def wait_for_lock_is_first(dsrc: Source) -> bool:
+async def wait_for_lock_is_first(dsrc: Source, lock_token: str) -> bool:
     """We need this lock because in production we spawn multiple processes, which each startup separately. Returns
-    true if it is the first lock since at least 25 seconds (lock expire time)."""
-    # We sleep for a shor time to increase the distribution in startup times, hopefully reducing race conditions
-    await sleep(random() + 0.1)
-    was_locked = await data.trs.startup.startup_is_locked(dsrc)
-    logger.debug(f"Checked for startup lock: {was_locked}")
-    if was_locked is None:
+    True if this process acquired the lock, which must then be released using `lock_token`. Otherwise, it waits until
+    the process that holds the lock has finished its startup."""
+    if await data.trs.startup.acquire_startup_lock(dsrc, lock_token):
         return True
-    elif was_locked is False:
-        return False
-    i = 0
-    while await data.trs.startup.startup_is_locked(dsrc):
-        await sleep(1)
-        i += 1
-        if i > MAX_WAIT_INDEX:
-            raise StoreError("Waited too long during startup!")
+
+    outcome = await data.trs.startup.wait_startup_lock_released(dsrc, MAX_WAIT)
+    logger.debug(f"Waited for startup lock: {outcome}")
+    if outcome is None:
+        raise StoreError("Waited too long during startup!")
+    elif outcome == "failed":
+        raise StoreError("Startup failed in the process that held the startup lock!")
     return False
 
 
@@ -168,42 +193,88 @@ async def initial_population(dsrc: Source, config: Config) -> None:
         await insert_classification(conn, "points")
 
 
-async def get_keystate(dsrc: Source) -> KeyState:
+async def load_opaque_setup(dsrc: Source) -> None:
+    """The OPAQUE setup and the fake record are written once at initial population and are used by every login and
+    registration, so we keep them in memory. Call this again to reload them if they have been replaced in the database.
+    """
+    dsrc.opaque_setup = await get_apake_setup(dsrc.store)
+    dsrc.fake_password_file = await get_fake_password_file(
+        dsrc.store, data.schema.UserOps
+    )
+
+
+async def get_keystate(conn: AsyncConnection) -> KeyState:
     """The KeyState object includes the key IDs (kids) of the currently used keys."""
-    async with data.get_conn(dsrc) as conn:
-        # We get the Key IDs (kid) of the newest keys and also previous symmetric key
-        # These newest ones will be used for signing new tokens
-        new_pem_kid = await data.key.get_newest_pem(conn)
-        new_symmetric_kid, old_symmetric_kid = await data.key.get_newest_symmetric(conn)
+    # We get the Key IDs (kid) of the newest keys and also previous symmetric key
+    # These newest ones will be used for signing new tokens
+    new_pem_kid = await data.key.get_newest_pem(conn)
+    new_symmetric_kid, old_symmetric_kid = await data.key.get_newest_symmetric(conn)
+    # The generation only changes when the keys do, so reloading the same keys does not make workers switch or
+    # invalidate the cached public keys
+    kids = sorted([new_pem_kid, new_symmetric_kid, old_symmetric_kid])
+    generation = hashlib.sha256(" ".join(kids).encode()).hexdigest()[:16]
 
     return KeyState(
         current_symmetric=new_symmetric_kid,
         old_symmetric=old_symmetric_kid,
         current_signing=f"{new_pem_kid}-pem-private",
+        generation=generation,
     )
 
 
-async def load_keys_from_jwk(dsrc: Source, config: Config) -> JWKSet:
+async def load_keys_from_jwk(
+    conn: AsyncConnection, config: Config, new_keys: Optional[list[JWK]] = None
+) -> JWKSet:
     """Loads keys from the database's jwk table (JSON Web Key). These are stored in standard JWK format and then
-    encrypted with the runtime key. After decrypting, it re-encrypts the keys and stores them again.
+    encrypted with the runtime key. After decrypting, it adds `new_keys`, re-encrypts the keys and stores them again.
+    The row is locked until the transaction ends, so concurrent updates (such as key rotations) wait for this one
+    instead of overwriting it.
     """
 
     # Key used to decrypt the keys stored in the database
     runtime_key = aes_from_symmetric(config.KEY_PASS)
-    async with data.get_conn(dsrc) as conn:
-        encrypted_key_set = await data.key.get_jwk(conn)
-        key_set_dict = decrypt_dict(runtime_key.private, encrypted_key_set)
-        key_set = JWKSet.model_validate(key_set_dict)
-        # We re-encrypt as is required when using AES encryption
-        reencrypted_key_set = encrypt_dict(runtime_key.private, key_set_dict)
-        await data.key.update_jwk(conn, reencrypted_key_set)
+    encrypted_key_set = await data.key.get_jwk(conn, for_update=True)
+    key_set_dict = decrypt_dict(runtime_key.private, encrypted_key_set)
+    if new_keys:
+        key_set_dict["keys"].extend(key.model_dump() for key in new_keys)
+    key_set = JWKSet.model_validate(key_set_dict)
+    # We re-encrypt as is required when using AES encryption
+    reencrypted_key_set = encrypt_dict(runtime_key.private, key_set_dict)
+    await data.key.update_jwk(conn, reencrypted_key_set)
 
     return key_set
 
 
+async def load_prepared_keys(dsrc: Source, config: Config) -> KeyState:
+    """The first process decrypts the keys and stores them in the KV, so other processes only need the key state."""
+    key_state = await data.trs.key.get_key_state(dsrc)
+    if key_state is None:
+        # Only if the KV was cleared after the first process started
+        logger.warning("Keys were not prepared by the first process, loading them.")
+        key_state = await load_keys(dsrc, config)
+        await data.trs.key.store_key_state(dsrc, key_state)
+    return key_state
+
+
+async def load_public_keys(dsrc: Source, key_state: KeyState) -> PublicKeys:
+    """Serializes the public keys stored by `load_keys`, so they can be served without any lookup."""
+    jwk_set = await data.trs.key.get_jwks(dsrc, data.trs.key.jwk_set_key)
+    jwks = orjson.dumps(jwk_set.model_dump(exclude_none=True))
+    return PublicKeys(generation=key_state.generation, jwks=jwks)
+
+
 async def load_keys(dsrc: Source, config: Config) -> KeyState:
-    key_set = await load_keys_from_jwk(dsrc, config)
-    key_state = await get_keystate(dsrc)
+    """Decrypts the keys, stores them in the KV in the formats used by the requests and returns the new key state."""
+    async with data.get_conn(dsrc) as conn:
+        key_set = await load_keys_from_jwk(conn, config)
+        return await store_keys(dsrc, conn, key_set)
+
+
+async def store_keys(dsrc: Source, conn: AsyncConnection, key_set: JWKSet) -> KeyState:
+    """Stores the keys in the KV in the formats used by the requests and returns the new key state. Call it in the
+    transaction that loaded the keys with `load_keys_from_jwk`, so that concurrent loads store their keys in order.
+    """
+    key_state = await get_keystate(conn)
 
     pem_keys = []
     pem_private_keys = []
@@ -224,7 +295,7 @@ async def load_keys(dsrc: Source, config: Config) -> KeyState:
             # The public keys we will store in raw format, we want to exclude the private key as we want to be able to
             # publish these keys
             # The 'x' are the public key bytes (as set by the JWK standard)
-            public_key = JWKPublicEdDSA.model_validate(key.model_dump())
+            public_key = JWKPublicEdDSA.model_validate(key.model_dump(exclude={"d"}))
             public_keys.append(public_key)
         elif key.alg == "A256GCM":
             symmetric_key_jwk = JWKSymmetricA256GCM.model_validate(key.model_dump())
@@ -233,13 +304,12 @@ async def load_keys(dsrc: Source, config: Config) -> KeyState:
             )
             symmetric_keys.append(symmetric_key)
 
-    # In the future we can publish these keys
+    # Published at /.well-known/jwks.json
     public_jwk_set = JWKSet(keys=public_keys)
 
     # Store in KV for quick access
     await data.trs.key.store_pem_keys(dsrc, pem_keys, pem_private_keys)
     await data.trs.key.store_symmetric_keys(dsrc, symmetric_keys)
-    # Currently, this is not actually used, but it could be used to publicize the public key
     await data.trs.key.store_jwks(dsrc, public_jwk_set)
 
     return key_state
@@ -0,0 +1,60 @@
+"""
+Statistical profiler for a running worker. A separate thread periodically takes the current stack of the thread
+running the event loop, so it sees everything the worker does during that time (including all requests), with little
+overhead and without changing the code that is profiled.
+
+The result is in the collapsed stack format ('frame;frame;frame count' per line, root first), which can be turned
+into a flamegraph by e.g. `flamegraph.pl` or speedscope.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+# 200 samples per second, which is cheap but still shows stages that take a few milliseconds
+DEFAULT_INTERVAL = 0.005
+MAX_DURATION = 60.0
+
+
+def frame_name(frame: FrameType) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_qualname}"
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def sample_stacks(
+    thread_id: int, duration: float, interval: float = DEFAULT_INTERVAL
+) -> Counter[str]:
+    """Samples the stack of the thread with `thread_id` every `interval` seconds for `duration` seconds. This blocks,
+    so it must be run in a different thread than the one that is sampled."""
+    if thread_id == threading.get_ident():
+        raise ValueError("Cannot sample the stack of the current thread!")
+
+    stacks: Counter[str] = Counter()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            # The thread has exited
+            break
+        stacks[collapse_stack(frame)] += 1
+        # Not holding on to the frame allows it to be freed
+        del frame
+        time.sleep(interval)
+
+    return stacks
+
+
+def format_collapsed(stacks: Counter[str]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
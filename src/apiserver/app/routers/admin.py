@@ -8,7 +8,9 @@ from apiserver.app.dependencies import SourceDep, require_admin
 import apiserver.data.api.scope
 import apiserver.data.api.ud.userdata
 from apiserver import data
-from apiserver.app.error import ErrorResponse
+from apiserver.app.error import AppError, ErrorResponse
+from apiserver.app.ops.keys import KeyUse, rotate_keys
+from apiserver.data.source import KeyState
 from apiserver.lib.model.entities import UserData, UserScopeData, UserID
 from store.error import DataError, NoDataError
 
@@ -128,3 +130,23 @@ async def get_user_names(dsrc: SourceDep) -> ORJSONResponse:
     async with data.get_conn(dsrc) as conn:
         user_names = await data.ud.get_all_usernames(conn)
     return ORJSONResponse([u_n.model_dump() for u_n in user_names])
+
+
+class KeyRotateRequest(BaseModel):
+    use: KeyUse
+
+
+@admin_router.post("/keys/rotate/", response_model=KeyState)
+async def rotate_key(
+    rotate_request: KeyRotateRequest, dsrc: SourceDep
+) -> ORJSONResponse:
+    """Replaces the current symmetric ('enc') or signing ('sig') key by a new one in all workers. Returns the new key
+    state, which only contains key IDs."""
+    try:
+        key_state = await rotate_keys(dsrc, dsrc.config, rotate_request.use)
+    except AppError as e:
+        logger.debug(e.err_desc)
+        raise ErrorResponse(
+            400, err_type=e.err_type, err_desc=e.err_desc, debug_key=e.debug_key
+        )
+    return ORJSONResponse(key_state.model_dump())
@@ -35,7 +35,12 @@ async def start_login(
     check flow."""
 
     return await auth_start_login(
-        dsrc.store, schema.UserOps, auth_context.login_ctx, login_start
+        dsrc.store,
+        schema.UserOps,
+        auth_context.login_ctx,
+        dsrc.opaque_setup,
+        dsrc.fake_password_file,
+        login_start,
     )
 
 
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+from anyio import to_thread
+from fastapi import APIRouter, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from loguru import logger
+
+from apiserver.app.dependencies import SourceDep
+from apiserver.app.error import ErrorResponse
+from apiserver.app.profiler import (
+    DEFAULT_INTERVAL,
+    MAX_DURATION,
+    format_collapsed,
+    sample_stacks,
+)
+from store.stats import StatementStatsCollector, StatsOrder
+
+diagnostics_admin_router = APIRouter(prefix="/diagnostics", tags=["diagnostics"])
+
+# Every worker is profiled separately, so this only prevents concurrent profiles of the same worker
+profile_lock = asyncio.Lock()
+
+
+@diagnostics_admin_router.get("/profile/", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(default=10.0, gt=0, le=MAX_DURATION),
+    interval: float = Query(default=DEFAULT_INTERVAL, ge=0.001, le=1.0),
+) -> PlainTextResponse:
+    """Profiles the worker that handles this request for the given number of seconds, including all other requests it
+    handles during that time. Returns the sampled stacks in the collapsed stack format, for use in a flamegraph.
+    """
+    if profile_lock.locked():
+        raise ErrorResponse(
+            409,
+            err_type="profile_running",
+            err_desc="This worker is already being profiled.",
+            debug_key="profile_running",
+        )
+
+    async with profile_lock:
+        # The event loop runs in the current thread, which is sampled from another thread
+        loop_thread_id = threading.get_ident()
+        logger.info(f"Profiling worker for {seconds} seconds.")
+        stacks = await to_thread.run_sync(
+            sample_stacks, loop_thread_id, seconds, interval
+        )
+
+    return PlainTextResponse(format_collapsed(stacks))
+
+
+def statement_stats_enabled(dsrc: SourceDep) -> StatementStatsCollector:
+    stats = dsrc.store.statement_stats
+    if stats is None:
+        raise ErrorResponse(
+            404,
+            err_type="statement_stats_disabled",
+            err_desc="Statement statistics are not enabled (DB_STATEMENT_STATS).",
+            debug_key="statement_stats_disabled",
+        )
+    return stats
+
+
+@diagnostics_admin_router.get("/statements/")
+async def get_statement_stats(
+    dsrc: SourceDep,
+    n: int = Query(default=20, ge=1, le=1000),
+    order: StatsOrder = "total_time",
+) -> ORJSONResponse:
+    """The `n` SQL statement templates with the highest `order` value, as collected by the worker that handles this
+    request since it started or was reset."""
+    stats = statement_stats_enabled(dsrc)
+    return ORJSONResponse([s.as_dict() for s in stats.top(n, order)])
+
+
+@diagnostics_admin_router.post("/statements/reset/")
+async def reset_statement_stats(dsrc: SourceDep) -> None:
+    statement_stats_enabled(dsrc).reset()
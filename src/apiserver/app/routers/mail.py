@@ -0,0 +1,47 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from apiserver import data
+from apiserver.app.dependencies import SourceDep
+from apiserver.app.error import ErrorResponse
+from apiserver.lib.model.entities import BulkMailJob
+
+mail_admin_router = APIRouter(prefix="/mail", tags=["mail"])
+
+
+class BulkMailRequest(BaseModel):
+    subject: str
+    message: str
+
+
+@mail_admin_router.post("/bulk/")
+async def send_bulk_mail(bulk_mail: BulkMailRequest, dsrc: SourceDep) -> ORJSONResponse:
+    """Sends the message to all active members. Returns the ID of the job, with which its progress can be retrieved."""
+    if dsrc.mail_server is None:
+        raise ErrorResponse(
+            400,
+            err_type="mail_disabled",
+            err_desc="Mail is not enabled (MAIL_ENABLED).",
+            debug_key="mail_disabled",
+        )
+    # Rarely used, so only imported when needed
+    from apiserver.app.ops.bulk_mail import start_bulk_mail
+
+    job = await start_bulk_mail(
+        dsrc, dsrc.mail_server, bulk_mail.subject, bulk_mail.message
+    )
+    return ORJSONResponse({"job_id": job.job_id})
+
+
+@mail_admin_router.get("/bulk/{job_id}/", response_model=BulkMailJob)
+async def get_bulk_mail_job(job_id: str, dsrc: SourceDep) -> ORJSONResponse:
+    job = await data.trs.bulk_mail.get_bulk_job(dsrc, job_id)
+    if job is None:
+        raise ErrorResponse(
+            404,
+            err_type="bulk_mail_not_found",
+            err_desc="Bulk mail job does not exist or expired.",
+            debug_key="bulk_mail_not_found",
+        )
+    return ORJSONResponse(job.model_dump())
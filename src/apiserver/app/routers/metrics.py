@@ -0,0 +1,14 @@
+from anyio import to_thread
+from fastapi import APIRouter, Depends, Response
+
+from apiserver.app.dependencies import require_metrics_token
+from apiserver.app.metrics import render_metrics
+
+router = APIRouter(dependencies=[Depends(require_metrics_token)])
+
+
+@router.get("/metrics")
+async def get_metrics() -> Response:
+    # In multiprocess mode the metrics of all workers are read from files
+    content, content_type = await to_thread.run_sync(render_metrics)
+    return Response(content=content, media_type=content_type)
@@ -4,7 +4,7 @@ from datetime import date
 from urllib.parse import urlencode
 
 from anyio import sleep
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter
 from pydantic import BaseModel
 
 from apiserver import data
@@ -19,7 +19,6 @@ from apiserver.app.modules.register import (
 from apiserver.app.ops.mail import (
     send_signup_email,
     send_register_email,
-    mail_from_config,
 )
 from apiserver.define import (
     DEFINE,
@@ -44,9 +43,7 @@ class SignupRequest(BaseModel):
 
 
 @router.post("/signup/")
-async def init_signup(
-    signup: SignupRequest, dsrc: SourceDep, background_tasks: BackgroundTasks
-) -> None:
+async def init_signup(signup: SignupRequest, dsrc: SourceDep) -> None:
     """Signup is initiated by leaving basic information. User is redirected to AV'40 page, where they will actually
     sign up. Board can see who has signed up this way. There might not be full correspondence between exact signup and
     what is provided to AV'40. So there is a manual check."""
@@ -79,11 +76,10 @@ async def init_signup(
 
     if do_send_email:
         logger.opt(ansi=True).debug(f"Creating email with confirmation url <u><red>{confirmation_url}</red></u>")
-        send_signup_email(
-            background_tasks,
+        await send_signup_email(
+            dsrc,
             signup.email,
             f"{signup.firstname} {signup.lastname}",
-            mail_from_config(dsrc.config),
             confirmation_url,
             DEFINE.signup_url,
         )
@@ -151,7 +147,11 @@ async def start_register(
         )
 
     return await send_register_start(
-        dsrc.store, auth_context.register_ctx, user_id, register_start.client_request
+        dsrc.store,
+        auth_context.register_ctx,
+        dsrc.opaque_setup,
+        user_id,
+        register_start.client_request,
     )
 
 
@@ -196,7 +196,6 @@ class SignupConfirm(BaseModel):
 async def confirm_join(
     dsrc: SourceDep,
     signup: SignupConfirm,
-    background_tasks: BackgroundTasks,
 ) -> None:
     """Board confirms data from AV`40 signup through admin tool."""
     signup_email = signup.email.lower()
@@ -243,15 +242,12 @@ async def confirm_join(
     registration_url = f"{DEFINE.credentials_url}register/?{urlencode(params)}"
 
     logger.opt(ansi=True).debug(f"Creating email with registration url <u><red>{registration_url}</red></u>")
-    send_register_email(
-        background_tasks, signup_email, mail_from_config(dsrc.config), registration_url
-    )
+    await send_register_email(dsrc, signup_email, registration_url)
 
 
 @router.post("/confirm/")
 async def confirm_join_old(
     dsrc: SourceDep,
     signup: SignupConfirm,
-    background_tasks: BackgroundTasks,
 ) -> None:
-    return await confirm_join(dsrc, signup, background_tasks)
+    return await confirm_join(dsrc, signup)
@@ -2,7 +2,7 @@ from loguru import logger
 from urllib.parse import urlencode
 
 import opaquepy as opq
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter
 from pydantic import BaseModel
 from apiserver.app.dependencies import (
     AppContext,
@@ -23,7 +23,6 @@ from apiserver.app.error import AppError, ErrorKeys, ErrorResponse
 from apiserver.app.ops.mail import (
     send_change_email_email,
     send_reset_email,
-    mail_from_config,
 )
 from apiserver.data import ops
 from apiserver.data.context.update import store_email_flow_password_change
@@ -47,7 +46,6 @@ async def request_password_change(
     change_pass: ChangePasswordRequest,
     dsrc: SourceDep,
     app_context: AppContext,
-    background_tasks: BackgroundTasks,
 ) -> None:
     """Initiated from authpage. Sends out e-mail with reset link. Does nothing if user does not exist or is not yet
     properly registered."""
@@ -69,10 +67,9 @@ async def request_password_change(
     reset_url = f"{DEFINE.credentials_url}reset/?{urlencode(params)}"
 
     logger.opt(ansi=True).debug(f"Creating password reset email with url <u><red>{reset_url}</red></u>")
-    send_reset_email(
-        background_tasks,
+    await send_reset_email(
+        dsrc,
         change_pass.email,
-        mail_from_config(dsrc.config),
         reset_url,
     )
 
@@ -119,7 +116,11 @@ async def update_password_start(
 
     logger.debug(f"Initiating password reset for user {u.user_id} with email {update_pass.email}")
     return await send_register_start(
-        dsrc.store, auth_context.register_ctx, u.user_id, update_pass.client_request
+        dsrc.store,
+        auth_context.register_ctx,
+        dsrc.opaque_setup,
+        u.user_id,
+        update_pass.client_request,
     )
 
 
@@ -161,7 +162,6 @@ async def update_email(
     new_email: UpdateEmail,
     dsrc: SourceDep,
     member: RequireMember,
-    background_tasks: BackgroundTasks,
 ) -> None:
     user_id = new_email.user_id
 
@@ -199,10 +199,9 @@ async def update_email(
     logger.debug(f"Stored user {user_id} email change from {old_email} to {new_email.new_email} with flow_id {flow_id}.")
 
     logger.opt(ansi=True).debug(f"Creating email change email with url <red><u>{reset_url}</u></red>")
-    send_change_email_email(
-        background_tasks,
+    await send_change_email_email(
+        dsrc,
         new_email.new_email,
-        mail_from_config(dsrc.config),
         reset_url,
         old_email,
     )
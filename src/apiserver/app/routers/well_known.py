@@ -0,0 +1,57 @@
+import orjson
+from fastapi import APIRouter, Request, Response
+
+from apiserver.app.dependencies import SourceDep
+from apiserver.define import DEFINE
+
+router = APIRouter(prefix="/.well-known", tags=["well-known"])
+
+# Resource servers should fetch the keys again when they see a token with an unknown key ID, after keys are rotated
+JWKS_MAX_AGE = 24 * 60 * 60
+OPENID_CONFIG_MAX_AGE = 24 * 60 * 60
+
+# Only depends on the define, so it is the same for the lifetime of the process
+openid_configuration = orjson.dumps({
+    "issuer": DEFINE.issuer,
+    "authorization_endpoint": f"{DEFINE.api_root}/oauth/authorize/",
+    "token_endpoint": f"{DEFINE.api_root}/oauth/token/",
+    "jwks_uri": f"{DEFINE.api_root}/.well-known/jwks.json",
+    "response_types_supported": ["code"],
+    "grant_types_supported": ["authorization_code", "refresh_token"],
+    "subject_types_supported": ["public"],
+    "id_token_signing_alg_values_supported": ["EdDSA"],
+    "code_challenge_methods_supported": ["S256"],
+    "token_endpoint_auth_methods_supported": ["none"],
+})
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether the `If-None-Match` header matches the ETag. The header can list several (possibly weak) ETags or be
+    "*", and a weak comparison is used as required for `If-None-Match`."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+@router.get("/jwks.json")
+async def get_jwks(request: Request, dsrc: SourceDep) -> Response:
+    """The public keys used to sign access and ID tokens, so they can be verified without calling this server."""
+    public_keys = dsrc.public_keys
+    headers = {
+        "Cache-Control": f"public, max-age={JWKS_MAX_AGE}",
+        "ETag": public_keys.etag,
+    }
+    if etag_matches(request.headers.get("If-None-Match", ""), public_keys.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(public_keys.jwks, media_type="application/json", headers=headers)
+
+
+@router.get("/openid-configuration")
+async def get_openid_configuration() -> Response:
+    return Response(
+        openid_configuration,
+        media_type="application/json",
+        headers={"Cache-Control": f"public, max-age={OPENID_CONFIG_MAX_AGE}"},
+    )
@@ -8,6 +8,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import Mount
 from fastapi.staticfiles import StaticFiles
 from apiserver.app.app_logging import LoggerMiddleware
+from apiserver.app.budgets import RoundTripBudgetMiddleware
+from apiserver.app.metrics import MetricsMiddleware
 from apiserver.app_lifespan import AppLifespan
 
 # Import types separately to make it clear in what line the module is first loaded and
@@ -29,6 +31,10 @@ from apiserver.app.routers import (
     onboard,
     auth_router,
     ranking,
+    metrics,
+    diagnostics,
+    mail,
+    well_known,
 )
 
 
@@ -69,6 +75,8 @@ def define_middleware(routes_to_trace_log: set[str]) -> list[Middleware]:
     ]
 
     return [
+        # The first is the outermost, so the latency includes the other middleware
+        Middleware(MetricsMiddleware),
         Middleware(
             CORSMiddleware,
             allow_origins=origins,
@@ -76,11 +84,15 @@ def define_middleware(routes_to_trace_log: set[str]) -> list[Middleware]:
             allow_headers=["Authorization"],
         ),
         Middleware(LoggerMiddleware, trace_routes=routes_to_trace_log),
+        # Inside the LoggerMiddleware, so that warnings include the request ID
+        Middleware(RoundTripBudgetMiddleware),
     ]
 
 
 def add_routers(new_app: FastAPI) -> FastAPI:
     new_app.include_router(basic.router)
+    new_app.include_router(well_known.router)
+    new_app.include_router(metrics.router)
     new_app.include_router(auth_router)
     new_app.include_router(profile.router)
     new_app.include_router(onboard.router)
@@ -89,6 +101,8 @@ def add_routers(new_app: FastAPI) -> FastAPI:
 
     admin_router.include_router(onboard.onboard_admin_router)
     admin_router.include_router(ranking.ranking_admin_router)
+    admin_router.include_router(diagnostics.diagnostics_admin_router)
+    admin_router.include_router(mail.mail_admin_router)
     members_router.include_router(ranking.ranking_members_router)
 
     new_app.include_router(admin_router)
@@ -1,13 +1,26 @@
+import asyncio
+import gc
 from contextlib import asynccontextmanager
-from typing import AsyncContextManager, AsyncIterator, Callable, TypedDict
+from functools import cache
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    TypedDict,
+)
 
 from loguru import logger
 
 from fastapi import FastAPI
 from apiserver.app.app_logging import (
+    configure_log_sampling,
     enable_libraries,
     intercept_logging,
+    log_level,
     logger_stderr_sink,
+    logger_struct_file_sink,
     loguru_remove_default,
 )
 
@@ -20,6 +33,18 @@ from auth.data.token import ctx_reg as token_reg
 
 
 import apiserver.lib.utilities as util
+from apiserver.app.loop_monitor import (
+    install_slow_callback_monitor,
+    loop_lag_loop,
+    uninstall_slow_callback_monitor,
+)
+from apiserver.app.metrics import ContextMetricsHook, pool_metrics_loop
+from apiserver.app.ops.keys import key_state_loop
+from apiserver.app.ops.mail import (
+    get_mail_templates,
+    mail_from_config,
+    mail_outbox_loop,
+)
 from apiserver.app.ops.startup import startup
 from apiserver.data import Source
 from apiserver.data.context import Code, SourceContexts
@@ -30,6 +55,7 @@ from apiserver.data.context.authorize import ctx_reg as authrz_app_reg
 from apiserver.define import DEFINE
 from apiserver.env import Config, load_config_with_message
 from apiserver.resources import res_path, project_path
+from store.round_trips import attach_round_trip_counting
 
 
 class State(TypedDict):
@@ -41,6 +67,9 @@ class State(TypedDict):
 def safe_startup(dsrc_inst: Source, config: Config) -> Source:
     dsrc_inst.config = config
     dsrc_inst.store.init_objects(config)
+    dsrc_inst.mail_server = mail_from_config(config)
+    if dsrc_inst.mail_server is not None:
+        get_mail_templates().load_all()
 
     return dsrc_inst
 
@@ -48,7 +77,7 @@ def safe_startup(dsrc_inst: Source, config: Config) -> Source:
 # We use the functions below, so we can also manually call them in tests
 
 
-async def app_startup(dsrc_inst: Source) -> Source:
+async def app_startup(dsrc_inst: Source, config: Config, config_message: str) -> Source:
     # Only startup events that do not work in all environments or require other
     # processes to run belong here
     # Safe startup events with variables that depend on the environment, but should
@@ -56,8 +85,6 @@ async def app_startup(dsrc_inst: Source) -> Source:
     # Safe startup events that do not depend on the environment, can be included in
     # the 'create_app()' above
 
-    config, config_message = load_config_with_message()
-
     if config.APISERVER_ENV not in DEFINE.allowed_envs:
         raise RuntimeError(
             "Runtime environment (env.toml) does not correspond to compiled environment"
@@ -87,6 +114,8 @@ async def app_startup(dsrc_inst: Source) -> Source:
 
 async def app_shutdown(dsrc_inst: Source) -> None:
     await dsrc_inst.store.shutdown()
+    if dsrc_inst.mail_server is not None:
+        await dsrc_inst.mail_server.close()
 
 
 def register_and_define_code() -> Code:
@@ -109,20 +138,101 @@ def register_and_define_code() -> Code:
     )
 
 
+@cache
+def shared_code() -> Code:
+    """The contexts do not change after they are defined, so all workers can share them (see `preload_shared_state`)."""
+    cd = register_and_define_code()
+    # Measures every data function called through the contexts
+    context_hooks = [ContextMetricsHook()]
+    cd.auth_context.set_hooks(context_hooks)
+    cd.app_context.set_hooks(context_hooks)
+    return cd
+
+
+def preload_shared_state() -> None:
+    """Builds the state that is the same for all workers and never changes, when the app is loaded in the master process
+    before the workers are forked (see `apiserver.gunicorn_conf`). The workers then share it copy-on-write. Connections,
+    tasks and threads (such as those of the log sinks) must not be created here, they are created in the lifespan of
+    every worker."""
+    shared_code()
+    get_mail_templates().load_all()
+    # Objects that exist now are ignored by the garbage collector, so it does not write to them in the workers, which
+    # would copy the pages they are on
+    gc.freeze()
+
+
+def log_task_end(task: asyncio.Task[None]) -> None:
+    # Background tasks are only cancelled at shutdown, any other end means the worker no longer does that work
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.opt(exception=exc).error(f"Background task {task.get_name()} failed.")
+    else:
+        logger.error(f"Background task {task.get_name()} stopped.")
+
+
+def start_background_task(
+    coro: Coroutine[Any, Any, None], name: str
+) -> asyncio.Task[None]:
+    task = asyncio.create_task(coro, name=name)
+    task.add_done_callback(log_task_end)
+    return task
+
+
 AppLifespan = Callable[[FastAPI], AsyncContextManager[State]]
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncIterator[State]:
+    # The config is loaded first, as it determines the logging setup
+    config, config_message = load_config_with_message()
     # Logging setup
     loguru_remove_default()
-    logger_stderr_sink()
+    level = log_level(config)
+    logger_stderr_sink(level)
+    logger_struct_file_sink(config, level)
+    configure_log_sampling(config)
     enable_libraries()
     intercept_logging(["uvicorn.error"])
 
     logger.info("Running startup...")
+    # The lifespan runs in every worker after it is forked, so connections are never shared between processes
     dsrc = Source()
-    dsrc_started = await app_startup(dsrc)
-    yield {"dsrc": dsrc_started, "cd": register_and_define_code()}
+    dsrc_started = await app_startup(dsrc, config, config_message)
+    pool_metrics = start_background_task(
+        pool_metrics_loop(dsrc_started.store), "pool_metrics"
+    )
+    if config.ROUND_TRIP_BUDGETS != "off":
+        attach_round_trip_counting(dsrc_started.store)
+    slow_callback_threshold = config.LOOP_SLOW_CALLBACK_MS / 1000
+    # If slow callbacks cannot be monitored, the lag monitor logs blocking of the loop instead
+    if install_slow_callback_monitor(slow_callback_threshold):
+        loop_lag = start_background_task(loop_lag_loop(), "loop_lag")
+    else:
+        loop_lag = start_background_task(
+            loop_lag_loop(slow_callback_threshold or None), "loop_lag"
+        )
+    # Keys can be rotated by any worker
+    key_state = start_background_task(key_state_loop(dsrc_started), "key_state")
+    mail_outbox = None
+    if dsrc_started.mail_server is not None:
+        mail_outbox = start_background_task(
+            mail_outbox_loop(dsrc_started), "mail_outbox"
+        )
+    yield {"dsrc": dsrc_started, "cd": shared_code()}
     logger.info("Running shutdown...")
+    pool_metrics.cancel()
+    loop_lag.cancel()
+    key_state.cancel()
+    # Emails that are being sent remain in the outbox and are sent by another worker
+    if mail_outbox is not None:
+        mail_outbox.cancel()
+        # Only imported if mail is enabled, as it is only needed to send mail
+        from apiserver.app.ops.bulk_mail import stop_bulk_mail
+
+        await stop_bulk_mail()
+    uninstall_slow_callback_monitor()
     await app_shutdown(dsrc_started)
+    # Wait until the background threads have written all log messages
+    await logger.complete()
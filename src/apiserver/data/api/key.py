@@ -11,6 +11,7 @@ from schema.model import (
 from store.db import (
     LiteralDict,
     retrieve_by_id,
+    retrieve_by_id_for_update,
     get_largest_where,
     update_column_by_unique,
     insert,
@@ -36,6 +37,20 @@ async def get_newest_symmetric(conn: AsyncConnection) -> tuple[str, str]:
     return first_key.kid, second_key.kid
 
 
+async def get_newest_symmetric_issued(conn: AsyncConnection) -> int:
+    """Time (Unix timestamp) at which the current symmetric key was added."""
+    largest = await get_largest_where(
+        conn, KEY_TABLE, {KEY_ISSUED}, KEY_USE, "enc", KEY_ISSUED, 1
+    )
+    if len(largest) == 0:
+        raise NoDataError(
+            message="There is no most recent symmetric key!",
+            key="missing_symmetric_keys",
+        )
+
+    return int(largest[0][KEY_ISSUED])
+
+
 async def get_newest_pem(conn: AsyncConnection) -> str:
     largest = await get_largest_where(
         conn, KEY_TABLE, {KEY_ID}, KEY_USE, "sig", KEY_ISSUED, 1
@@ -71,8 +86,12 @@ async def update_jwk(conn: AsyncConnection, encrypted_jwk_set: str) -> None:
         )
 
 
-async def get_jwk(conn: AsyncConnection) -> str:
-    row_dict = await retrieve_by_id(conn, JWK_TABLE, 1)
+async def get_jwk(conn: AsyncConnection, for_update: bool = False) -> str:
+    """With `for_update`, the JWK Set is locked until the transaction ends, use this when it will be updated."""
+    if for_update:
+        row_dict = await retrieve_by_id_for_update(conn, JWK_TABLE, 1)
+    else:
+        row_dict = await retrieve_by_id(conn, JWK_TABLE, 1)
     if row_dict is None:
         raise DataError(message="JWK Set missing.", key="missing_jwks")
     return JWKSRow.model_validate(row_dict).encrypted_value
@@ -3,7 +3,13 @@ from typing import Any, Optional, Type
 
 from sqlalchemy.ext.asyncio import AsyncConnection
 
-from apiserver.lib.model.entities import UserData, SignedUp, IdInfo, UserNames
+from apiserver.lib.model.entities import (
+    UserData,
+    SignedUp,
+    IdInfo,
+    UserNames,
+    UserEmail,
+)
 from auth.data.relational.user import (
     IdUserDataOps as AuthIdUserDataOps,
     IdUserData as AuthIdUserData,
@@ -26,6 +32,7 @@ from store.db import (
     update_column_by_unique,
     select_where,
     select_some_where,
+    select_some_where_page,
 )
 from store.error import NoDataError, DataError, DbError
 
@@ -182,3 +189,21 @@ async def get_all_usernames(conn: AsyncConnection) -> list[UserNames]:
         )
         for u_names in all_user_names
     ]
+
+
+async def get_active_emails_page(
+    conn: AsyncConnection, after_user_id: str, limit: int
+) -> list[UserEmail]:
+    """Emails of at most `limit` active members, ordered by user ID and starting after `after_user_id` (use an empty
+    string for the first page)."""
+    rows = await select_some_where_page(
+        conn,
+        USERDATA_TABLE,
+        {USER_ID, UD_EMAIL, UD_FIRSTNAME, UD_LASTNAME},
+        UD_ACTIVE,
+        True,
+        USER_ID,
+        after_user_id,
+        limit,
+    )
+    return [UserEmail.model_validate(dict(row)) for row in rows]
@@ -19,6 +19,7 @@ from schema.model import (
     USER_ID,
     PASSWORD,
     USER_EMAIL,
+    SCOPES,
     UD_ACTIVE,
 )
 from auth.data.relational.user import (
@@ -65,6 +66,19 @@ class UserOps(AuthUserOps):
         user_row = await retrieve_by_unique(conn, USER_TABLE, USER_EMAIL, email)
         return parse_user(user_row)
 
+    @classmethod
+    async def get_user_auth_by_email(
+        cls, conn: AsyncConnection, email: str
+    ) -> tuple[str, str, str]:
+        # Only select what is needed for login, the email column is indexed
+        user_rows = await select_some_where(
+            conn, USER_TABLE, {USER_ID, SCOPES, PASSWORD}, USER_EMAIL, email
+        )
+        if len(user_rows) == 0:
+            raise NoDataError("User does not exist.", UserErrors.U_EMPTY)
+        row = user_rows[0]
+        return row[USER_ID], row[SCOPES], row[PASSWORD]
+
     @classmethod
     async def update_password_file(
         cls, conn: AsyncConnection, user_id: str, password_file: str
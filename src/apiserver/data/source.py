@@ -1,7 +1,8 @@
 __all__ = ["Source", "get_kv", "get_conn"]
 
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Optional
 
 from redis.asyncio import Redis
 from apiserver.env import Config
@@ -14,21 +15,50 @@ from store.conn import (
 )
 from store import Store
 
+if TYPE_CHECKING:
+    # Mail is optional, so its dependencies are only imported when it is enabled
+    from apiserver.lib.actions.mail import SmtpPool
+
 
 class KeyState(AuthKeyState):
     current_symmetric: str = ""
     old_symmetric: str = ""
     current_signing: str = ""
+    # Derived from the key IDs, so processes can tell whether they have the same keys
+    generation: str = ""
+
+
+@dataclass(frozen=True)
+class PublicKeys:
+    """The public keys of the current key generation, serialized once as they are served as is."""
+
+    generation: str = ""
+    jwks: bytes = b'{"keys":[]}'
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.generation}"'
 
 
 class Source:
     store: Store
     config: Config
     key_state: KeyState
+    # Replaced together with the key state
+    public_keys: PublicKeys
+    # OPAQUE server setup and password file of the fake record, they never change so they are loaded once at startup
+    opaque_setup: str
+    fake_password_file: str
+    # None if mail is disabled
+    mail_server: Optional["SmtpPool"]
 
     def __init__(self) -> None:
         self.store = Store()
         self.key_state = KeyState()
+        self.public_keys = PublicKeys()
+        self.opaque_setup = ""
+        self.fake_password_file = ""
+        self.mail_server = None
 
 
 def get_kv(dsrc: Source) -> Redis:
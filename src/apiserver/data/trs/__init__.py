@@ -1,6 +1,15 @@
 # trs for transient
 
-from apiserver.data.trs import reg, key, startup
+from apiserver.data.trs import reg, key, startup, outbox, bulk_mail
 from apiserver.data.trs.trs import store_string, pop_string, get_string
 
-__all__ = ["reg", "key", "startup", "store_string", "pop_string", "get_string"]
+__all__ = [
+    "reg",
+    "key",
+    "startup",
+    "outbox",
+    "bulk_mail",
+    "store_string",
+    "pop_string",
+    "get_string",
+]
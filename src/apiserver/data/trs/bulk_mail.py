@@ -0,0 +1,25 @@
+from typing import Optional
+
+from apiserver.data import Source, get_kv
+from apiserver.lib.model.entities import BulkMailJob
+from store.kv import get_json, store_json
+
+# Progress of a job can be retrieved for a day after it was last updated
+JOB_EXPIRATION = 24 * 60 * 60
+
+
+def job_key(job_id: str) -> str:
+    return f"bulk_mail:{job_id}"
+
+
+async def store_bulk_job(dsrc: Source, job: BulkMailJob) -> None:
+    await store_json(
+        get_kv(dsrc), job_key(job.job_id), job.model_dump(), expire=JOB_EXPIRATION
+    )
+
+
+async def get_bulk_job(dsrc: Source, job_id: str) -> Optional[BulkMailJob]:
+    job_dict = await get_json(get_kv(dsrc), job_key(job_id))
+    if job_dict is None:
+        return None
+    return BulkMailJob.model_validate(job_dict)
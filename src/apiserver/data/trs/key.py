@@ -1,11 +1,17 @@
+from typing import AsyncIterator, Optional
+
 from store.kv import store_json_multi, get_json, store_json_perm
 from apiserver.data import get_kv, Source
+from apiserver.data.source import KeyState
 from store.error import NoDataError
 from apiserver.lib.model.entities import PEMKey, JWKSet
 from auth.hazmat.structs import A256GCMKey, PEMPrivateKey
 
 pem_suffix = "-pem"
 pem_private_suffix = "-pem-private"
+key_state_key = "key_state"
+jwk_set_key = "jwk_set"
+KEY_STATE_CHANNEL = "key_state_updated"
 
 
 async def store_pem_keys(
@@ -27,7 +33,46 @@ async def store_symmetric_keys(dsrc: Source, keys: list[A256GCMKey]) -> None:
 
 
 async def store_jwks(dsrc: Source, value: JWKSet) -> None:
-    await store_json_perm(get_kv(dsrc), "jwk_set", value.model_dump())
+    await store_json_perm(get_kv(dsrc), jwk_set_key, value.model_dump())
+
+
+async def store_key_state(dsrc: Source, key_state: KeyState) -> None:
+    await store_json_perm(get_kv(dsrc), key_state_key, key_state.model_dump())
+
+
+async def get_key_state(dsrc: Source) -> Optional[KeyState]:
+    key_state_dict = await get_json(get_kv(dsrc), key_state_key)
+    if key_state_dict is None:
+        return None
+    return KeyState.model_validate(key_state_dict)
+
+
+async def publish_key_state(dsrc: Source, key_state: KeyState) -> None:
+    """Stores the key state and notifies all workers listening to `key_state_updates`."""
+    async with get_kv(dsrc).pipeline() as pipe:
+        # Redis type support is not perfect
+        pipe.json().set(key_state_key, ".", key_state.model_dump())  # type: ignore
+        pipe.publish(KEY_STATE_CHANNEL, key_state.model_dump_json())
+        await pipe.execute()
+
+
+async def key_state_updates(dsrc: Source) -> AsyncIterator[KeyState]:
+    """Yields the stored key state and then every newly published one. The stored key state is only read after
+    subscribing, so that no update is missed in between."""
+    pubsub = get_kv(dsrc).pubsub()
+    try:
+        await pubsub.subscribe(KEY_STATE_CHANNEL)
+        key_state = await get_key_state(dsrc)
+        if key_state is not None:
+            yield key_state
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=None
+            )
+            if message is not None:
+                yield KeyState.model_validate_json(message["data"])
+    finally:
+        await pubsub.aclose()  # type: ignore[no-untyped-call]
 
 
 async def get_jwks(dsrc: Source, kid: str) -> JWKSet:
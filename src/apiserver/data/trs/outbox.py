@@ -0,0 +1,119 @@
+"""
+The mail outbox is a Redis stream that is read by the workers using a consumer group, so every email is sent by a single
+worker. An email stays pending in the group until it is sent, so the emails of a worker that stops are claimed by
+another worker. Failed emails are moved to a sorted set by the time they should be retried and are added to the stream
+again at that time.
+"""
+
+from typing import Any, Optional
+
+from pydantic import ValidationError
+from redis.exceptions import ResponseError
+
+from apiserver.data import Source, get_kv
+from apiserver.lib.model.entities import QueuedEmail
+
+OUTBOX_STREAM = "mail_outbox"
+OUTBOX_GROUP = "mail_senders"
+OUTBOX_RETRY = "mail_outbox_retry"
+
+# Moves the due emails from the retry set to the stream, so that an email cannot be lost or added twice
+REQUEUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, email in ipairs(due) do
+    redis.call('XADD', KEYS[2], '*', 'email', email)
+    redis.call('ZREM', KEYS[1], email)
+end
+return #due
+"""
+
+OutboxEntry = tuple[str, QueuedEmail]
+# Entry ID and the reason it is not a valid email
+InvalidEntry = tuple[str, str]
+OutboxRead = tuple[list[OutboxEntry], list[InvalidEntry]]
+
+
+def parse_entries(
+    entries: list[tuple[bytes, Optional[dict[bytes, bytes]]]]
+) -> OutboxRead:
+    """Entries are parsed one by one, so an invalid entry does not prevent the others from being sent. Invalid entries
+    are returned separately, as they can never be sent and must be removed."""
+    parsed = []
+    invalid = []
+    for entry_id, fields in entries:
+        # Entries that were deleted while pending have no fields
+        if fields is None:
+            continue
+        try:
+            email = QueuedEmail.model_validate_json(fields[b"email"])
+        except KeyError:
+            invalid.append((entry_id.decode(), "no email field"))
+            continue
+        except ValidationError as e:
+            invalid.append((entry_id.decode(), str(e)))
+            continue
+        parsed.append((entry_id.decode(), email))
+    return parsed, invalid
+
+
+async def create_outbox_group(dsrc: Source) -> None:
+    try:
+        await get_kv(dsrc).xgroup_create(
+            OUTBOX_STREAM, OUTBOX_GROUP, id="0", mkstream=True
+        )
+    except ResponseError as e:
+        # Another worker already created it
+        if "BUSYGROUP" not in str(e):
+            raise e
+
+
+async def enqueue_email(dsrc: Source, email: QueuedEmail) -> None:
+    await get_kv(dsrc).xadd(OUTBOX_STREAM, {"email": email.model_dump_json()})
+
+
+async def read_emails(
+    dsrc: Source, consumer: str, count: int, block_ms: int
+) -> OutboxRead:
+    """Waits at most `block_ms` milliseconds for new emails."""
+    result: list[Any] = await get_kv(dsrc).xreadgroup(
+        OUTBOX_GROUP, consumer, {OUTBOX_STREAM: ">"}, count=count, block=block_ms
+    )
+    if not result:
+        return [], []
+    # There is a single list of entries, for the one stream
+    return parse_entries(result[0][1])
+
+
+async def claim_stale_emails(
+    dsrc: Source, consumer: str, min_idle_ms: int, count: int
+) -> OutboxRead:
+    """Claims emails that have been pending for at least `min_idle_ms` milliseconds, because the worker that read them
+    stopped before sending them."""
+    result: list[Any] = await get_kv(dsrc).xautoclaim(
+        OUTBOX_STREAM, OUTBOX_GROUP, consumer, min_idle_ms, count=count
+    )
+    return parse_entries(result[1])
+
+
+async def complete_email(dsrc: Source, entry_id: str) -> None:
+    async with get_kv(dsrc).pipeline() as pipe:
+        pipe.xack(OUTBOX_STREAM, OUTBOX_GROUP, entry_id)
+        pipe.xdel(OUTBOX_STREAM, entry_id)
+        await pipe.execute()
+
+
+async def retry_email(
+    dsrc: Source, entry_id: str, email: QueuedEmail, retry_at: int
+) -> None:
+    # The pipeline is a transaction, so the email is never lost
+    async with get_kv(dsrc).pipeline() as pipe:
+        pipe.zadd(OUTBOX_RETRY, {email.model_dump_json(): retry_at})
+        pipe.xack(OUTBOX_STREAM, OUTBOX_GROUP, entry_id)
+        pipe.xdel(OUTBOX_STREAM, entry_id)
+        await pipe.execute()
+
+
+async def requeue_due_emails(dsrc: Source, now: int, count: int) -> int:
+    requeue = get_kv(dsrc).register_script(REQUEUE_SCRIPT)
+    requeued: int = await requeue(keys=[OUTBOX_RETRY, OUTBOX_STREAM], args=[now, count])
+    return requeued
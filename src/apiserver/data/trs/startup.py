@@ -1,20 +1,88 @@
-from typing import Optional
+"""
+Lock that ensures a single process (the leader) runs the startup steps that must only run once, when multiple worker
+processes start at the same time. The lock is a key that is set only if it does not exist, to a token that is unique
+to the leader, so that only the leader can release it. When it is released, the key is kept for a while with the
+outcome as its value, so that processes starting shortly after know that startup is done. Processes that are waiting
+for the lock are notified of the outcome over a Redis channel.
+"""
+
+import asyncio
+from typing import Literal, Optional
 
 from apiserver.data import Source, get_kv
-from store.kv import store_string, get_string
+from store.kv import get_string
+
+STARTUP_LOCK = "startup_lock"
+STARTUP_CHANNEL = "startup_lock_released"
+# The leader must finish startup within this time, after which the lock expires
+LOCK_EXPIRE_MS = 25000
+# Processes that start within this time after the leader finished are not the first
+DONE_EXPIRE_MS = 25000
+
+StartupOutcome = Literal["done", "failed"]
+
+# Only releases the lock if it is still held by the same token, so a lock that expired and was acquired by another
+# process is never released
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == 'done' then
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('PUBLISH', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+async def acquire_startup_lock(dsrc: Source, token: str) -> bool:
+    acquired = await get_kv(dsrc).set(STARTUP_LOCK, token, nx=True, px=LOCK_EXPIRE_MS)
+    return bool(acquired)
 
 
-async def set_startup_lock(dsrc: Source, value: str = "locked") -> None:
-    await store_string(get_kv(dsrc), "startup_lock", value, 25)
+async def get_startup_lock(dsrc: Source) -> Optional[str]:
+    """Returns the token of the leader if it is locked, 'done' if startup finished recently and None otherwise."""
+    return await get_string(get_kv(dsrc), STARTUP_LOCK)
 
 
-async def startup_is_locked(dsrc: Source) -> Optional[bool]:
-    """Returns None if it did not exist (so it is the first), True if it is locked, False if it is not locked but was
-    previously locked."""
+async def release_startup_lock(
+    dsrc: Source, token: str, outcome: StartupOutcome
+) -> bool:
+    """Returns False if the lock was not held by `token` (anymore)."""
+    release = get_kv(dsrc).register_script(RELEASE_SCRIPT)
+    released: int = await release(
+        keys=[STARTUP_LOCK, STARTUP_CHANNEL], args=[token, outcome, DONE_EXPIRE_MS]
+    )
+    return bool(released)
 
-    lock = await get_string(get_kv(dsrc), "startup_lock")
 
-    if lock is not None:
-        return lock == "locked"
+async def wait_startup_lock_released(
+    dsrc: Source, timeout: float
+) -> Optional[StartupOutcome]:
+    """Waits until the lock is released and returns the outcome, or None if the lock expired or the timeout passed
+    before that."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    pubsub = get_kv(dsrc).pubsub()
+    try:
+        await pubsub.subscribe(STARTUP_CHANNEL)
+        # The lock might have been released before we subscribed
+        lock = await get_startup_lock(dsrc)
+        while lock is not None and lock != "done":
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=min(remaining, 1.0)
+            )
+            if message is not None:
+                outcome: StartupOutcome = message["data"].decode()
+                return outcome
+            # Also check the lock itself, in case it expired because the leader stopped
+            lock = await get_startup_lock(dsrc)
+    finally:
+        await pubsub.aclose()  # type: ignore[no-untyped-call]
 
-    return None
+    return "done" if lock == "done" else None
@@ -1,11 +1,15 @@
 import os
+from functools import cache
 from pathlib import Path
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 import tomllib
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 from apiserver.resources import res_path
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
 from auth.define import (
     Define as AuthDefine,
     default_define,
@@ -65,7 +69,13 @@ loc_path = res_path.joinpath("loc.toml")
 DEFINE = load_define(define_path)
 loc_dict = load_loc(loc_path)
 
-template_env = Environment(
-    loader=FileSystemLoader(res_path.joinpath("templates")),
-    autoescape=select_autoescape(),
-)
+
+@cache
+def get_template_env() -> "Environment":
+    """The templates are only used for sending mail, so Jinja is only imported once they are needed."""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    return Environment(
+        loader=FileSystemLoader(res_path.joinpath("templates")),
+        autoescape=select_autoescape(),
+    )
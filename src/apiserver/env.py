@@ -1,8 +1,9 @@
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 import os
 from pathlib import Path
 import tomllib
+from pydantic import Field
 from apiserver.app.error import AppEnvironmentError
 
 from apiserver.resources import res_path, project_path
@@ -41,11 +42,38 @@ class Config(StoreConfig):
 
     SMTP_SERVER: str
     SMTP_PORT: int
+    # Maximum number of connections to the SMTP server kept open by each worker
+    SMTP_POOL_SIZE: int = 2
+    # Emails sent per second (by a single worker) when sending a message to all members
+    BULK_MAIL_PER_SECOND: float = Field(default=5, gt=0)
 
     RECREATE: str = "no"
 
     DB_NAME_ADMIN: str
 
+    # Bearer token required to scrape /metrics, which is disabled if it is empty
+    # RECOMMENDED TO LOAD AS ENVIRON
+    METRICS_TOKEN: str = ""
+
+    # Minimum level of the logs, if empty it depends on APISERVER_ENV (see `app_logging.log_level`)
+    LOG_LEVEL: str = ""
+    # File to write structured logs (JSON lines) to, disabled if empty
+    LOG_STRUCT_PATH: str = ""
+    # Size or interval at which the structured log file is rotated and how many old files are kept
+    LOG_ROTATION: str = "100 MB"
+    LOG_RETENTION: int = 10
+    # DEBUG and TRACE messages are only logged for 1 in every LOG_SAMPLE_EVERY requests (per route), limited to
+    # LOG_SAMPLE_PER_SECOND requests per second (per route) if it is larger than 0
+    LOG_SAMPLE_EVERY: int = 1
+    LOG_SAMPLE_PER_SECOND: float = 0
+
+    # Event loop callbacks (or blocking of the loop) that take at least this long are logged, 0 disables logging them
+    LOOP_SLOW_CALLBACK_MS: int = 100
+
+    # Whether requests that exceed the round trip budget of their route are logged ('warn') or also raise ('fail'),
+    # see `apiserver.app.budgets`
+    ROUND_TRIP_BUDGETS: Literal["off", "warn", "fail"] = "off"
+
 
 def get_config_path(config_path_name: Optional[os.PathLike[Any]] = None) -> Path:
     env_config_path = os.environ.get("APISERVER_CONFIG")
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for running the app with multiple workers:
+
+    gunicorn -c python:apiserver.gunicorn_conf apiserver.app_inst:apiserver_app
+
+The app is loaded once in the master process, after which the state that never changes (see `preload_shared_state`)
+is built and shared by all workers. Every worker runs the lifespan itself, which sets up logging, connects to the
+databases and starts the background tasks. Other settings, such as the number of workers (`WEB_CONCURRENCY`) and the
+address, can be passed on the command line.
+"""
+
+from typing import Any, ClassVar
+
+from uvicorn.workers import UvicornWorker
+
+from apiserver.app.metrics import mark_worker_dead
+from apiserver.app_lifespan import preload_shared_state
+
+
+class AsyncioUvicornWorker(UvicornWorker):
+    """Runs on the default asyncio event loop instead of uvloop, so that the slow callback monitor can report the
+    request that blocked the loop (see `apiserver.app.loop_monitor`)."""
+
+    # Declared as an instance variable by uvicorn, but it is only read from the class
+    CONFIG_KWARGS: ClassVar[dict[str, Any]] = {  # type: ignore[misc]
+        **UvicornWorker.CONFIG_KWARGS,
+        "loop": "asyncio",
+    }
+
+
+worker_class = "apiserver.gunicorn_conf.AsyncioUvicornWorker"
+preload_app = True
+
+
+def when_ready(server: Any) -> None:
+    # Called in the master process after the app is loaded, before the workers are forked
+    preload_shared_state()
+
+
+def child_exit(server: Any, worker: Any) -> None:
+    mark_worker_dead(worker.pid)
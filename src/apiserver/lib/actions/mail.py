@@ -1,31 +1,183 @@
+import asyncio
 from loguru import logger
 from typing import Optional, Any
 
-from jinja2 import Environment
-import smtplib
+from aiosmtplib import SMTP, SMTPException, SMTPServerDisconnected
+from jinja2 import Environment, Template, TemplateNotFound, nodes
+from jinja2.visitor import NodeTransformer
 from email.headerregistry import Address
 from email.message import EmailMessage
 from email.utils import formatdate
 
 
-def send_email_vars(
-    template_name: str,
-    has_html: bool,
-    loaded_env: Environment,
-    templ_vars: dict[str, Any],
+class SmtpPool:
+    """Keeps up to `size` connections to the SMTP server open, so that the connection, TLS handshake and login are only
+    done once per connection instead of for every email. Connections are opened when they are first needed. The server
+    closes connections that are idle for too long, so a send that fails because the connection was closed is retried
+    once on a new connection."""
+
+    hostname: str
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+    start_tls: bool
+    timeout: float
+    _idle: list[SMTP]
+    _slots: asyncio.Semaphore
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        size: int = 2,
+        start_tls: bool = True,
+        timeout: float = 30,
+    ) -> None:
+        """
+        Args:
+            username: if None, the connections do not log in.
+            size: maximum number of open connections, which is also the maximum number of concurrent sends.
+            start_tls: whether to upgrade the connections with STARTTLS, which is required before logging in.
+        """
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self) -> SMTP:
+        smtp = SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            start_tls=self.start_tls,
+            timeout=self.timeout,
+        )
+        # This also upgrades the connection with STARTTLS and logs in
+        await smtp.connect()
+        logger.debug(f"Connected to SMTP server {self.hostname}:{self.port}.")
+        return smtp
+
+    async def send(self, message: EmailMessage) -> None:
+        """Sends the message to the recipients in its headers. Raises `SMTPException` if it could not be sent."""
+        async with self._slots:
+            # The most recently used connection is the least likely to have been closed by the server
+            smtp = self._idle.pop() if self._idle else None
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+                try:
+                    await smtp.send_message(message)
+                except SMTPServerDisconnected:
+                    logger.debug("SMTP connection was closed, reconnecting.")
+                    smtp = await self._connect()
+                    await smtp.send_message(message)
+            finally:
+                # After other errors the connection is reset and can still be used
+                if smtp is not None and smtp.is_connected:
+                    self._idle.append(smtp)
+
+    async def close(self) -> None:
+        idle = self._idle
+        self._idle = []
+        for smtp in idle:
+            try:
+                await smtp.quit()
+            except SMTPException:
+                smtp.close()
+
+
+class InlineStaticVars(NodeTransformer):
+    """Replaces the static variables in a template by constants. Jinja evaluates expressions that only use constants
+    (like `loc.org_name`) when compiling, and adds them to the static text of the template.
+    """
+
+    static_vars: dict[str, Any]
+
+    def __init__(self, static_vars: dict[str, Any]) -> None:
+        self.static_vars = static_vars
+
+    def visit_Name(self, node: nodes.Name) -> nodes.Node:
+        if node.ctx == "load" and node.name in self.static_vars:
+            return nodes.Const(self.static_vars[node.name], lineno=node.lineno)
+        return node
+
+
+class EmailTemplates:
+    """Compiled templates of the emails, where the text template `<name>.jinja2` can have an HTML alternative
+    `<name>.html.jinja2`. The static variables, i.e. the localization, are the same for every email, so they are
+    replaced by their values when a template is compiled. Rendering an email then only substitutes its own variables.
+    Templates are compiled when first used, or all at once by `load_all`."""
+
+    env: Environment
+    static_vars: dict[str, Any]
+    # Text template and optional HTML template by name of the text template
+    compiled: dict[str, tuple[Template, Optional[Template]]]
+
+    def __init__(self, env: Environment, static_vars: dict[str, Any]) -> None:
+        """
+        Args:
+            static_vars: variables of every template, which must not be assigned to in the templates.
+        """
+        self.env = env
+        self.static_vars = static_vars
+        self.compiled = {}
+
+    def compile_template(self, name: str) -> Template:
+        source, filename, _ = self.env.loader.get_source(self.env, name)  # type: ignore[union-attr]
+        ast = InlineStaticVars(self.static_vars).visit(
+            self.env.parse(source, name, filename)
+        )
+        # The name is passed on as the environment decides on autoescaping by name, which is off for `.jinja2`, so the
+        # HTML templates escape their variables themselves with `|e`
+        code = self.env.compile(ast, name, filename)
+        return self.env.template_class.from_code(
+            self.env, code, self.env.make_globals(None)
+        )
+
+    def load(self, name: str) -> tuple[Template, Optional[Template]]:
+        templates = self.compiled.get(name)
+        if templates is None:
+            html_name = f"{name.removesuffix('.jinja2')}.html.jinja2"
+            try:
+                html: Optional[Template] = self.compile_template(html_name)
+            except TemplateNotFound:
+                html = None
+            templates = (self.compile_template(name), html)
+            self.compiled[name] = templates
+        return templates
+
+    def load_all(self) -> None:
+        for name in self.env.list_templates(
+            filter_func=lambda n: not n.endswith(".html.jinja2")
+        ):
+            self.load(name)
+
+    def render(
+        self, name: str, templ_vars: dict[str, Any]
+    ) -> tuple[str, Optional[str]]:
+        """Renders the text and (if it exists) the HTML template."""
+        text, html = self.load(name)
+        return text.render(templ_vars), (
+            html.render(templ_vars) if html is not None else None
+        )
+
+
+def build_email_message(
+    text: str,
+    html: Optional[str],
     receiver_email: str,
-    mail_pass: str,
     from_email: str,
-    l_smtp_server: str,
-    l_smtp_port: int,
     subject: str,
     receiver_name: Optional[str] = None,
     from_name: Optional[str] = None,
-) -> None:
-    template = loaded_env.get_template(template_name)
-
-    txt_content = template.render(templ_vars)
-
+) -> EmailMessage:
     # Create the base text message.
     msg = EmailMessage()
     msg["Subject"] = subject
@@ -37,14 +189,9 @@ def send_email_vars(
     msg["To"] = Address(receiver_email_name, receiver_user, receiver_domain)
     msg["Date"] = formatdate(localtime=True)
 
-    msg.set_content(txt_content)
-
-    if has_html:
-        html_name = f"{template_name.removesuffix('.jinja2')}.html.jinja2"
-        template = loaded_env.get_template(html_name)
-
-        html = template.render(templ_vars)
+    msg.set_content(text)
 
+    if html is not None:
         # Necessary for images later
         # cid = make_msgid(domain=from_domain)
         # html.format(some_cid=cid[1:-1])
@@ -53,16 +200,32 @@ def send_email_vars(
 
         msg.add_alternative(html, subtype="html")
 
-    logger.debug(f"{l_smtp_server} {l_smtp_port}")
-
-    try:
-        with smtplib.SMTP(l_smtp_server, l_smtp_port) as server:
-            server.starttls()
-            server.login(from_email, mail_pass)
-            server.sendmail(from_email, receiver_email, msg.as_string())
-            logger.debug(
-                f"Sent an email from {from_email} to {receiver_email} with subject"
-                f" '{subject}'"
-            )
-    except smtplib.SMTPException as e:
-        logger.debug(str(e))
+    return msg
+
+
+async def send_email_vars(
+    template_name: str,
+    templates: EmailTemplates,
+    templ_vars: dict[str, Any],
+    receiver_email: str,
+    smtp_pool: SmtpPool,
+    from_email: str,
+    subject: str,
+    receiver_name: Optional[str] = None,
+    from_name: Optional[str] = None,
+) -> None:
+    text, html = templates.render(template_name, templ_vars)
+    msg = build_email_message(
+        text,
+        html,
+        receiver_email,
+        from_email,
+        subject,
+        receiver_name,
+        from_name,
+    )
+
+    await smtp_pool.send(msg)
+    logger.debug(
+        f"Sent an email from {from_email} to {receiver_email} with subject '{subject}'"
+    )
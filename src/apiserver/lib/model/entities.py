@@ -177,6 +177,18 @@ class Signup(BaseModel):
     phone: str
 
 
+class QueuedEmail(BaseModel):
+    # Unique, as the same email could be queued twice
+    email_id: str
+    template: str
+    receiver: str
+    subject: str
+    receiver_name: Optional[str] = None
+    add_vars: dict[str, str] = Field(default_factory=dict)
+    # Failed attempts to send it
+    attempts: int = 0
+
+
 class Classification(BaseModel):
     type: str
     start_date: date
@@ -202,6 +214,24 @@ class UserNames(BaseModel):
     lastname: str
 
 
+class UserEmail(BaseModel):
+    user_id: str
+    email: str
+    firstname: str
+    lastname: str
+
+
+class BulkMailJob(BaseModel):
+    job_id: str
+    subject: str
+    # Cancelled when the worker running it shuts down
+    status: Literal["running", "finished", "failed", "cancelled"] = "running"
+    sent: int = 0
+    failed: int = 0
+    started: int
+    finished: Optional[int] = None
+
+
 class ClassView(BaseModel):
     classification_id: int
     last_updated: date
@@ -1,7 +1,6 @@
 from pathlib import Path
 import sys
 import math
-import regex as re
 
 urlsafe = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_"
 urlsafe_set = set([
@@ -116,15 +115,21 @@ def strip_edge(string: str) -> str:
     # \p{Z} is all unicode whitespace
     # \p{C} is all kinds of nasty control and zero-width characters
     match_string = r"[\s\p{Z}\p{C}]+"
+    # Only used on cold paths, so it is imported when first needed
+    import regex as re
+
     # ^ start of string
     # $ end of string
     return re.sub(f"^{match_string}|{match_string}$", "", string)
 
 
 def gen_id_name(first_name: str, last_name: str) -> str:
+    import regex as re
+
     id_name_str = f"{first_name}_{last_name}".lower()
+    # The compiled pattern is cached by regex
     id_name_str = re.sub(whitespace_pattern, "_", id_name_str)
     return usp_hex(id_name_str)
 
 
-whitespace_pattern = re.compile(r"\s+")
+whitespace_pattern = r"\s+"
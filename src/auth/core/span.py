@@ -0,0 +1,90 @@
+"""
+Timing of the stages (spans) of an operation, e.g. fetching the keys or signing the tokens when creating new tokens.
+The `auth` module only marks the spans using `span`. The consuming application decides whether they are recorded, by
+running the operation inside `record_spans`. When nothing is being recorded, which is the default, `span` returns a
+shared object that does nothing, so marking a span costs only a context variable lookup.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import TracebackType
+from typing import ContextManager, Iterator, Optional, Type
+
+
+class SpanRecorder:
+    """Durations (in nanoseconds) of the spans that ended while this recorder was active, in order of ending."""
+
+    __slots__ = ("spans",)
+
+    spans: list[tuple[str, int]]
+
+    def __init__(self) -> None:
+        self.spans = []
+
+
+_active_recorder: ContextVar[Optional[SpanRecorder]] = ContextVar(
+    "active_span_recorder", default=None
+)
+
+
+class _Span:
+    __slots__ = ("name", "recorder", "start")
+
+    recorder: SpanRecorder
+    name: str
+    start: int
+
+    def __init__(self, recorder: SpanRecorder, name: str) -> None:
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter_ns()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.recorder.spans.append((self.name, time.perf_counter_ns() - self.start))
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        pass
+
+
+_noop_span = _NoopSpan()
+
+
+def span(name: str) -> ContextManager[None]:
+    """Use as `with span("name"):` to time the block, if a recorder is active."""
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return _noop_span
+    return _Span(recorder, name)
+
+
+@contextmanager
+def record_spans(
+    recorder: Optional[SpanRecorder] = None,
+) -> Iterator[SpanRecorder]:
+    """Records all spans inside the block (including in tasks started from it) to the (new) recorder."""
+    recorder = SpanRecorder() if recorder is None else recorder
+    token = _active_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _active_recorder.reset(token)
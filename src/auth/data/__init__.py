@@ -31,8 +31,9 @@ However, even though it doesn't rely on a specific schema, some of its operation
 basic relations. These operations, and the requirements on the relations, are found the in the `relational` module.
 
 The relations necessary for storing information for OPAQUE are assumed to not interfer with any existing schema.
-Therefore, they are directly implemented using `store` operations. However, the only required function,
-`get_apake_setup`, is implemented in a Context, meaning it can be overriden by the consuming application.
+Therefore, they are directly implemented using `store` operations. The only required function, `get_apake_setup`, is
+not a Context function, as the setup never changes. The consuming application should load it once at startup and pass
+it to the login and registration functions.
 
 TODO dep inj for opaque setup table name
 
@@ -1,6 +1,6 @@
 from auth.core.model import SavedState, FlowUser
 from auth.core.util import random_time_hash_hex
-from auth.data.context import RegisterContext, LoginContext, TokenContext
+from auth.data.context import LoginContext, TokenContext
 from auth.data.relational.opaque import get_setup
 from auth.data.relational.user import UserOps
 from datacontext.context import ContextRegistry
@@ -11,32 +11,45 @@ from store.kv import store_json, get_json, pop_json
 
 ctx_reg = ContextRegistry()
 
+# User ID of the fake record, which is used to make logins for non-existent users look like those for real users
+FAKE_RECORD_ID = "1_fakerecord"
+
 
-@ctx_reg.register_multiple([RegisterContext, LoginContext])
 async def get_apake_setup(store: Store) -> str:
-    """We get server setup required for using OPAQUE protocol (which is an aPAKE)."""
+    """We get server setup required for using OPAQUE protocol (which is an aPAKE). It is written once and never
+    changes, so this should only be called at startup (or to explicitly reload it). The result is then passed to
+    `start_login` and `send_register_start`."""
     async with get_conn(store) as conn:
         return await get_setup(conn)
 
 
+async def get_fake_password_file(store: Store, user_ops: UserOps) -> str:
+    """The password file of the fake record never changes, so like the OPAQUE setup this should only be called at
+    startup. The result is then passed to `start_login`."""
+    async with get_conn(store) as conn:
+        u = await user_ops.get_user_by_id(conn, FAKE_RECORD_ID)
+    return u.password_file
+
+
 @ctx_reg.register(LoginContext)
 async def get_user_auth_data(
-    store: Store, user_ops: UserOps, login_mail: str
+    store: Store, user_ops: UserOps, fake_password_file: str, login_mail: str
 ) -> tuple[str, str, str, str]:
+    # We start with the fake record, so that a login for a non-existent user does the same work as for a real one
+    user_id = FAKE_RECORD_ID
+    password_file = fake_password_file
     scope = "none"
     async with get_conn(store) as conn:
-        # We start with a fakerecord
-        u = await user_ops.get_user_by_id(conn, "1_fakerecord")
-        user_id = u.user_id
-        password_file = u.password_file
         try:
-            ru = await user_ops.get_user_by_email(conn, login_mail)
+            ru_id, ru_scope, ru_password_file = await user_ops.get_user_auth_by_email(
+                conn, login_mail
+            )
             # If the user exists and has a password set (meaning they are registered), we perform the check with the
             # actual password
-            if ru.password_file:
-                user_id = ru.user_id
-                password_file = ru.password_file
-                scope = ru.scope
+            if ru_password_file:
+                user_id = ru_id
+                password_file = ru_password_file
+                scope = ru_scope
         except NoDataError:
             # If user or password file does not exist, user, password_file and scope default to the fake record
             pass
@@ -22,13 +22,9 @@ from store import Store
 
 
 class LoginContext(Context):
-    @classmethod
-    async def get_apake_setup(cls, store: Store) -> str:
-        raise ContextNotImpl()
-
     @classmethod
     async def get_user_auth_data(
-        cls, store: Store, user_ops: UserOps, login_mail: str
+        cls, store: Store, user_ops: UserOps, fake_password_file: str, login_mail: str
     ) -> tuple[str, str, str, str]:
         raise ContextNotImpl()
 
@@ -112,10 +108,6 @@ class TokenContext(Context):
 
 
 class RegisterContext(Context):
-    @classmethod
-    async def get_apake_setup(cls, store: Store) -> str:
-        raise ContextNotImpl()
-
     @classmethod
     async def store_auth_register_state(
         cls, store: Store, user_id: str, state: SavedRegisterState
@@ -20,6 +20,14 @@ class UserOps(Protocol):
     @classmethod
     async def get_user_by_email(cls, conn: AsyncConnection, email: str) -> User: ...
 
+    @classmethod
+    async def get_user_auth_by_email(
+        cls, conn: AsyncConnection, email: str
+    ) -> tuple[str, str, str]:
+        """Returns (user_id, scope, password_file) using a single query, as this is done at the start of every login.
+        THROWS NoDataError if user does not exist, with key U_EMPTY."""
+        ...
+
     @classmethod
     async def update_password_file(
         cls, conn: AsyncConnection, user_id: str, password_file: str
@@ -5,7 +5,6 @@ from auth.core.model import PasswordRequest, SavedState, FinishLogin, FlowUser
 from auth.core.response import PasswordResponse
 from auth.core.util import utc_timestamp
 from auth.data.authentication import (
-    get_apake_setup,
     get_user_auth_data,
     store_auth_state,
     get_state,
@@ -15,22 +14,27 @@ from auth.data.context import LoginContext
 from store.error import NoDataError
 from auth.data.relational.user import UserOps
 from store import Store
-from store.conn import store_session
 
 
 async def start_login(
-    store: Store, user_ops: UserOps, context: LoginContext, login_start: PasswordRequest
+    store: Store,
+    user_ops: UserOps,
+    context: LoginContext,
+    apake_setup: str,
+    fake_password_file: str,
+    login_start: PasswordRequest,
 ) -> PasswordResponse:
     """Login can be initiated in 2 different flows: the first is the OAuth 2 flow, the second is a simple password
-    check flow."""
+    check flow. The `apake_setup` is the OPAQUE server setup and `fake_password_file` the password file of the fake
+    record, which are both loaded once at startup.
+    """
 
     login_mail = login_start.email.lower()
 
-    async with store_session(store) as session:
-        user_id, scope, password_file, auth_id = await get_user_auth_data(
-            context, session, user_ops, login_mail
-        )
-        apake_setup = await get_apake_setup(context, session)
+    # This is a single query, so there is no need to open a session for it
+    user_id, scope, password_file, auth_id = await get_user_auth_data(
+        context, store, user_ops, fake_password_file, login_mail
+    )
 
     # This will only fail if the client message is an invalid OPAQUE protocol message
     response, state = opq.login(
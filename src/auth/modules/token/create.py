@@ -12,6 +12,7 @@ from auth.token.build import build_refresh_save, create_tokens, finish_tokens
 from auth.token.crypt_token import decrypt_old_refresh
 from auth.hazmat.verify_token import verify_refresh
 from auth.core.model import Tokens, KeyState
+from auth.core.span import span
 from auth.core.util import utc_timestamp
 from auth.data.relational.ops import RelationOps
 from auth.define import grace_period, access_exp, id_exp, refresh_exp, Define
@@ -26,14 +27,17 @@ async def do_refresh(
     key_state: KeyState,
     old_refresh_token: str,
 ) -> Tokens:
-    keys = await get_keys(context, store, key_state)
-    old_refresh = decrypt_old_refresh(
-        keys.symmetric, keys.old_symmetric, old_refresh_token
-    )
+    with span("get_keys"):
+        keys = await get_keys(context, store, key_state)
+    with span("decrypt_refresh"):
+        old_refresh = decrypt_old_refresh(
+            keys.symmetric, keys.old_symmetric, old_refresh_token
+        )
 
     utc_now = utc_timestamp()
 
-    saved_refresh = await get_saved_refresh(context, store, ops, old_refresh)
+    with span("get_saved_refresh"):
+        saved_refresh = await get_saved_refresh(context, store, ops, old_refresh)
 
     verify_refresh(saved_refresh, old_refresh, utc_now, grace_period)
 
@@ -49,9 +53,10 @@ async def do_refresh(
 
     # Deletes previous token, saves new one, only succeeds if all components of the
     # transaction succeed
-    new_refresh_id = await replace_refresh(
-        context, store, ops, old_refresh.id, new_refresh_save
-    )
+    with span("replace_refresh"):
+        new_refresh_id = await replace_refresh(
+            context, store, ops, old_refresh.id, new_refresh_save
+        )
 
     refresh_token, access_token, id_token = finish_tokens(
         new_refresh_id,
@@ -89,13 +94,15 @@ async def new_token(
     id_nonce: str,
 ) -> Tokens:
     # THROWS UnexpectedError if keys are not present
-    keys = await get_keys(context, store, key_state)
+    with span("get_keys"):
+        keys = await get_keys(context, store, key_state)
 
     utc_now = utc_timestamp()
 
     async with store_session(store) as session:
         # THROWS AuthError if user does not exist
-        id_userdata = await get_id_userdata(context, session, ops, user_id)
+        with span("get_id_userdata"):
+            id_userdata = await get_id_userdata(context, session, ops, user_id)
 
         access_token_data, id_token_data, access_scope, refresh_save = create_tokens(
             user_id,
@@ -111,7 +118,8 @@ async def new_token(
         )
 
         # Stores the refresh token in the database
-        refresh_id = await add_refresh_token(context, store, ops, refresh_save)
+        with span("add_refresh_token"):
+            refresh_id = await add_refresh_token(context, store, ops, refresh_save)
 
     refresh_token, access_token, id_token = finish_tokens(
         refresh_id,
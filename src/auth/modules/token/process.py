@@ -7,6 +7,7 @@ from auth.core.model import (
     KeyState,
     TokenRequest,
 )
+from auth.core.span import span
 from auth.data.authentication import pop_flow_user
 from auth.data.authorize import get_auth_request
 from auth.data.context import TokenContext
@@ -82,7 +83,8 @@ async def auth_code_grant(
 ) -> Tokens:
     # Get flow_user and auth_request
     try:
-        flow_user = await pop_flow_user(context, store, code_grant_request.code)
+        with span("pop_flow_user"):
+            flow_user = await pop_flow_user(context, store, code_grant_request.code)
     except NoDataError:
         reason = "Expired or missing auth code"
         raise AuthError(
@@ -90,7 +92,8 @@ async def auth_code_grant(
         )
 
     try:
-        auth_request = await get_auth_request(context, store, flow_user.flow_id)
+        with span("get_auth_request"):
+            auth_request = await get_auth_request(context, store, flow_user.flow_id)
     except NoDataError:
         # TODO maybe check auth time just in case
         reason = "Expired or missing auth request"
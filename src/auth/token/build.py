@@ -5,6 +5,7 @@ from auth.data.relational.user import IdUserData
 
 from auth.token.build_util import encode_token_dict, decode_refresh, add_info_to_id
 from auth.core.model import RefreshToken, IdTokenBase, AccessTokenBase
+from auth.core.span import span
 from auth.hazmat.structs import PEMPrivateKey, SymmetricKey
 from auth.data.relational.entities import SavedRefreshToken
 from auth.token.crypt_token import encrypt_refresh
@@ -150,16 +151,21 @@ def finish_tokens(
     refresh = RefreshToken(id=refresh_id, family_id=refresh_save.family_id, nonce=nonce)
     # This function performs encryption of the refresh token
     # ! Calls cryptographic primitives
-    refresh_token = encrypt_refresh(refresh_key, refresh)
+    with span("encrypt_refresh"):
+        refresh_token = encrypt_refresh(refresh_key, refresh)
 
     # This function adds exp and signing time info and signs the access token using the signing key
     # ! Calls the PyJWT library
-    access_token = sign_access_token(
-        signing_key, access_token_data, utc_now, access_exp
-    )
+    with span("sign_access_token"):
+        access_token = sign_access_token(
+            signing_key, access_token_data, utc_now, access_exp
+        )
     # This function adds exp and signing time info as well as id_info and signs the id token using the signing key
     # ! Calls the PyJWT library
-    id_token = sign_id_token(signing_key, id_token_data, id_userdata, utc_now, id_exp)
+    with span("sign_id_token"):
+        id_token = sign_id_token(
+            signing_key, id_token_data, id_userdata, utc_now, id_exp
+        )
 
     return refresh_token, access_token, id_token
 
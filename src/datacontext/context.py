@@ -8,7 +8,9 @@ from typing import (
     Concatenate,
     Coroutine,
     Generic,
+    Optional,
     Protocol,
+    Sequence,
     Type,
     TypeAlias,
     TypeVar,
@@ -40,9 +42,16 @@ Short tutorial:
   AbsractContexts subclass is globally accessible in each consuming location.
 - Simply call the original top-level function, providing the correct Context as its first argument. By overriding
   the Context class in some way, you can easily use it to override the call to your original function.
+
+As every call goes through a Context, it is also the place to measure them. Hooks (see `ContextHook`) can be set on
+the contexts using `AbstractContexts.set_hooks`, which are then called before and after every call.
 """
 
 
+T = TypeVar("T")
+P = ParamSpec("P")
+
+
 class ContextError(Exception):
     pass
 
@@ -54,8 +63,67 @@ class ContextNotImpl(ContextError):
         )
 
 
+class ContextHook(Protocol):
+    """Called around every call through a context that has this hook. `before` is called with the name of the function
+    and its return value is passed to `after`, which is called when the call finishes. For async functions, that is
+    when the coroutine finishes. `error` is the exception raised by the call, if any."""
+
+    def before(self, name: str) -> Any: ...
+
+    def after(self, name: str, state: Any, error: Optional[BaseException]) -> None: ...
+
+
 class Context:
     dont_replace: bool = False
+    # Empty by default, so calls without hooks only pay for checking this
+    hooks: tuple[ContextHook, ...] = ()
+
+
+def _hooks_after(
+    hooks: tuple[ContextHook, ...],
+    name: str,
+    states: list[Any],
+    error: Optional[BaseException],
+) -> None:
+    for hook, state in zip(hooks, states):
+        hook.after(name, state, error)
+
+
+async def _await_hooked(
+    hooks: tuple[ContextHook, ...],
+    name: str,
+    states: list[Any],
+    coro: Coroutine[Any, Any, T],
+) -> T:
+    try:
+        result = await coro
+    except BaseException as e:
+        _hooks_after(hooks, name, states, e)
+        raise
+    _hooks_after(hooks, name, states, None)
+    return result
+
+
+def call_hooked(
+    hooks: tuple[ContextHook, ...],
+    name: str,
+    func: Callable[P, T],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    """Calls `func` with the hooks around it, using `name` as the name of the call. If `func` returns a coroutine, it
+    is wrapped so that `after` is only called once it has been awaited."""
+    states = [hook.before(name) for hook in hooks]
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        _hooks_after(hooks, name, states, e)
+        raise
+    if inspect.iscoroutine(result):
+        # The coroutine returns what the async function returns, which is the T of the caller
+        return _await_hooked(hooks, name, states, result)  # type: ignore
+    _hooks_after(hooks, name, states, None)
+    return result
 
 
 class DontReplaceContext(Context):
@@ -111,7 +179,6 @@ def create_context_impl(context: Type[C]) -> C:
 
 
 T_co = TypeVar("T_co", covariant=True)
-P = ParamSpec("P")
 
 
 class ContextCallable(Protocol, Generic[P, T_co]):
@@ -124,9 +191,12 @@ def replace_context(func: Callable[P, T_co]) -> ContextCallable[P, T_co]:
 
     def replace(ctx: Context, *args: P.args, **kwargs: P.kwargs) -> T_co:
         if ctx.dont_replace:
-            return func(*args, **kwargs)
+            replace_func = func
+        else:
+            replace_func = getattr(ctx, func.__name__)
 
-        replace_func: Callable[P, T_co] = getattr(ctx, func.__name__)
+        if ctx.hooks:
+            return call_hooked(ctx.hooks, func.__name__, replace_func, *args, **kwargs)
         return replace_func(*args, **kwargs)
 
     return replace
@@ -191,6 +261,14 @@ class AbstractContexts(abc.ABC):
                 self.context_from_type(registry_type), registry_type, func
             )
 
+    def set_hooks(self, hooks: Sequence[ContextHook]) -> None:
+        """Sets the hooks of every context that is an attribute of this object, replacing any previous hooks. Pass an
+        empty list to remove them. Contexts that are replaced afterwards (e.g. in tests) do not have the hooks.
+        """
+        for ctx in vars(self).values():
+            if isinstance(ctx, Context):
+                ctx.hooks = tuple(hooks)
+
 
 # Everything below should only be used for very simple functions that are exposed directly to consumers, i.e. some
 # function that loads something from a database and then returns it without performing any kind of logic.
@@ -261,9 +339,27 @@ def ctxlize_wrap(
             replaced_f: ROut[R_out_contra, P, T_co] = getattr(
                 ctx, original_function.__name__
             )
+            if ctx.hooks:
+                return call_hooked(
+                    ctx.hooks,
+                    original_function.__name__,
+                    replaced_f,
+                    replaced_arg,
+                    *args,
+                    **kwargs,
+                )
             return replaced_f(replaced_arg, *args, **kwargs)
 
         new_f = wrapper_function(original_function)
+        if ctx.hooks:
+            return call_hooked(
+                ctx.hooks,
+                original_function.__name__,
+                new_f,
+                replaced_arg,
+                *args,
+                **kwargs,
+            )
         return new_f(replaced_arg, *args, **kwargs)
 
     return ctx_callable
@@ -278,8 +374,13 @@ def ctxlize(
     def ctx_callable(ctx: Context, *args: P.args, **kwargs: P.kwargs) -> T_co:
         if not ctx.dont_replace and hasattr(ctx, original_function.__name__):
             replaced_f: Callable[P, T_co] = getattr(ctx, original_function.__name__)
-            return replaced_f(*args, **kwargs)
+        else:
+            replaced_f = original_function
 
-        return original_function(*args, **kwargs)
+        if ctx.hooks:
+            return call_hooked(
+                ctx.hooks, original_function.__name__, replaced_f, *args, **kwargs
+            )
+        return replaced_f(*args, **kwargs)
 
     return ctx_callable
@@ -90,6 +90,16 @@ async def retrieve_by_id(
     return first_or_none(res)
 
 
+async def retrieve_by_id_for_update(
+    conn: AsyncConnection, table: LiteralString, id_int: int
+) -> Optional[dict[str, Any]]:
+    """Locks the row until the end of the transaction, so that concurrent transactions that also lock it wait until
+    this one is done. Ensure `table` is never user-defined."""
+    query = text(f"SELECT * FROM {table} WHERE id = :id FOR UPDATE;")
+    res: CursorResult[Any] = await conn.execute(query, parameters={"id": id_int})
+    return first_or_none(res)
+
+
 async def retrieve_by_unique(
     conn: AsyncConnection,
     table: LiteralString,
@@ -116,6 +126,31 @@ async def select_some_where(
     return all_rows(res)
 
 
+async def select_some_where_page(
+    conn: AsyncConnection,
+    table: LiteralString,
+    sel_col: set[LiteralString],
+    where_col: LiteralString,
+    where_value: Any,
+    key_col: LiteralString,
+    after: Any,
+    limit: int,
+) -> list[RowMapping]:
+    """Ensure `table`, `where_col`, `sel_col` and `key_col` are never user-defined. Returns at most `limit` rows ordered
+    by `key_col`, starting after the row with key `after`. Pass the key of the last row to get the next page, which uses
+    the index on `key_col` instead of skipping over all previous rows (like OFFSET does).
+    """
+    some = select_set(sel_col)
+    query = text(
+        f"SELECT {some} FROM {table} WHERE {where_col} = :val AND {key_col} > :after"
+        f" ORDER BY {key_col} LIMIT :limit;"
+    )
+    res = await conn.execute(
+        query, parameters={"val": where_value, "after": after, "limit": limit}
+    )
+    return all_rows(res)
+
+
 async def select_some_two_where(
     conn: AsyncConnection,
     table: LiteralString,
@@ -0,0 +1,95 @@
+"""
+Counts the round trips to the database and Redis made while running some code, such as handling a request. Opening a
+few `get_conn` blocks in sequence is easy to do by accident and adds a round trip (and a connection checkout) each time,
+so these counts can be compared against a budget in tests or during development.
+
+Counting must be enabled for a store using `attach_round_trip_counting`. The round trips are then counted for the code
+that runs inside `count_round_trips`, including tasks started from it.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Iterator, Optional
+
+from sqlalchemy import event
+
+from store.store import Store, StoreError
+
+
+@dataclass(slots=True)
+class RoundTrips:
+    # Connections checked out from the database pool, i.e. every `get_conn` without a session
+    db_checkouts: int = 0
+    # SQL statements sent to the database
+    statements: int = 0
+    # Redis commands, where a pipeline counts as a single command
+    kv_commands: int = 0
+
+    def exceeded(self, budget: "RoundTrips") -> list[str]:
+        """Names of the counts that are larger than in `budget`."""
+        return [
+            f.name
+            for f in fields(self)
+            if getattr(self, f.name) > getattr(budget, f.name)
+        ]
+
+
+_current_round_trips: ContextVar[Optional[RoundTrips]] = ContextVar(
+    "current_round_trips", default=None
+)
+
+
+@contextmanager
+def count_round_trips() -> Iterator[RoundTrips]:
+    trips = RoundTrips()
+    token = _current_round_trips.set(trips)
+    try:
+        yield trips
+    finally:
+        _current_round_trips.reset(token)
+
+
+def _count_checkout(*args: Any) -> None:
+    trips = _current_round_trips.get()
+    if trips is not None:
+        trips.db_checkouts += 1
+
+
+def _count_statement(*args: Any) -> None:
+    trips = _current_round_trips.get()
+    if trips is not None:
+        trips.statements += 1
+
+
+def _counting_get_connection(get_connection: Callable[..., Any]) -> Callable[..., Any]:
+    # Every command, or pipeline of commands, gets a connection from the pool to send it
+    async def counted_get_connection(*args: Any, **kwargs: Any) -> Any:
+        trips = _current_round_trips.get()
+        if trips is not None:
+            trips.kv_commands += 1
+        return await get_connection(*args, **kwargs)
+
+    return counted_get_connection
+
+
+def attach_round_trip_counting(store: Store) -> None:
+    if store.db is None or store.kv is None:
+        raise StoreError("Cannot count round trips of uninitialized store!")
+
+    # SQLAlchemy events for the async engine are set on its sync engine
+    event.listen(store.db.sync_engine, "checkout", _count_checkout)
+    event.listen(store.db.sync_engine, "before_cursor_execute", _count_statement)
+    kv_pool = store.kv.connection_pool
+    # Redis has no events, so the method is replaced on the pool instance only
+    kv_pool.get_connection = _counting_get_connection(kv_pool.get_connection)  # type: ignore[method-assign]
+
+
+def detach_round_trip_counting(store: Store) -> None:
+    if store.db is None or store.kv is None:
+        raise StoreError("Cannot count round trips of uninitialized store!")
+
+    event.remove(store.db.sync_engine, "checkout", _count_checkout)
+    event.remove(store.db.sync_engine, "before_cursor_execute", _count_statement)
+    # Removing the instance attribute restores the method of the class
+    del store.kv.connection_pool.get_connection
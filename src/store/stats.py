@@ -0,0 +1,115 @@
+"""
+Statistics of the SQL statements executed by an engine. Every statement is recorded by its template, i.e. the SQL text
+with placeholders for the parameters, so all calls of e.g. `select_some_where` for the same table and columns are
+counted together. This uses SQLAlchemy's cursor execution events, so it includes statements executed directly with
+`conn.execute` as well as those from the helpers in `store.db`. Statements that fail are counted as well, in `errors`.
+"""
+
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Literal
+
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.engine.interfaces import (
+    DBAPICursor,
+    ExceptionContext,
+    ExecutionContext,
+)
+
+StatsOrder = Literal["total_time", "max_time", "count", "rows"]
+
+
+@dataclass
+class StatementStats:
+    statement: str
+    count: int = 0
+    # Times are in seconds
+    total_time: float = 0.0
+    max_time: float = 0.0
+    # Rows returned by queries or affected by other statements
+    rows: int = 0
+    # Executions that raised an error, which are included in `count`
+    errors: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class StatementStatsCollector:
+    """Collects `StatementStats` of the engines it is attached to. All statements beyond `max_statements` different
+    templates are counted together, to bound the memory use."""
+
+    OTHER_STATEMENT = "<other>"
+
+    stats: dict[str, StatementStats]
+    max_statements: int
+
+    def __init__(self, max_statements: int = 1000) -> None:
+        self.stats = {}
+        self.max_statements = max_statements
+
+    def attach(self, engine: Engine) -> None:
+        """For an `AsyncEngine`, attach its `sync_engine`."""
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def detach(self, engine: Engine) -> None:
+        event.remove(engine, "before_cursor_execute", self._before_execute)
+        event.remove(engine, "after_cursor_execute", self._after_execute)
+        event.remove(engine, "handle_error", self._handle_error)
+
+    def _before_execute(
+        self,
+        conn: Connection,
+        cursor: DBAPICursor,
+        statement: str,
+        parameters: Any,
+        context: ExecutionContext,
+        executemany: bool,
+    ) -> None:
+        # Kept on the execution context of the statement, so nothing is left on the connection if the statement fails
+        context._statement_start = time.perf_counter()  # type: ignore[attr-defined]
+
+    def _after_execute(
+        self,
+        conn: Connection,
+        cursor: DBAPICursor,
+        statement: str,
+        parameters: Any,
+        context: ExecutionContext,
+        executemany: bool,
+    ) -> None:
+        start: float = context._statement_start  # type: ignore[attr-defined]
+        self.record(statement, time.perf_counter() - start, cursor.rowcount)
+
+    def _handle_error(self, exception_context: ExceptionContext) -> None:
+        # Errors can also occur before the cursor is executed, such as when connecting
+        start = getattr(exception_context.execution_context, "_statement_start", None)
+        statement = exception_context.statement
+        if start is None or statement is None:
+            return
+        self.record(statement, time.perf_counter() - start, 0, failed=True)
+
+    def record(
+        self, statement: str, duration: float, rows: int, failed: bool = False
+    ) -> None:
+        stats = self.stats.get(statement)
+        if stats is None:
+            if len(self.stats) >= self.max_statements:
+                statement = self.OTHER_STATEMENT
+            stats = self.stats.setdefault(statement, StatementStats(statement))
+        stats.count += 1
+        stats.total_time += duration
+        stats.max_time = max(stats.max_time, duration)
+        # The row count is -1 if it is unknown
+        stats.rows += max(rows, 0)
+        stats.errors += failed
+
+    def top(self, n: int, order: StatsOrder = "total_time") -> list[StatementStats]:
+        return sorted(
+            self.stats.values(), key=lambda s: getattr(s, order), reverse=True
+        )[:n]
+
+    def reset(self) -> None:
+        self.stats = {}
@@ -4,8 +4,11 @@ from redis import ConnectionError as RedisConnectionError
 from pydantic import BaseModel
 from redis.asyncio import Redis
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncConnection
 
+from store.stats import StatementStatsCollector
+
 
 class StoreError(ConnectionError):
     pass
@@ -23,12 +26,17 @@ class StoreConfig(BaseModel):
     # RECOMMENDED TO LOAD AS ENVIRON
     KV_PASS: str
 
+    # Collect statistics of the executed SQL statements (see `store.stats`)
+    DB_STATEMENT_STATS: bool = False
+
 
 class Store:
     db: Optional[AsyncEngine] = None
     kv: Optional[Redis] = None
     # Session is for reusing a single connection across multiple functions
     session: Optional[AsyncConnection] = None
+    # Only set if statement statistics are enabled
+    statement_stats: Optional[StatementStatsCollector] = None
 
     def init_objects(self, config: StoreConfig) -> None:
         db_cluster = (
@@ -40,6 +48,9 @@ class Store:
             host=config.KV_HOST, port=config.KV_PORT, db=0, password=config.KV_PASS
         )
         self.db = create_async_engine(f"postgresql+asyncpg://{db_url}")
+        if config.DB_STATEMENT_STATS:
+            self.statement_stats = StatementStatsCollector()
+            self.statement_stats.attach(self.db.sync_engine)
 
     async def connect(self) -> None:
         if self.kv is None or self.db is None:
@@ -62,6 +73,24 @@ class Store:
                 " running."
             )
 
+    def pool_stats(self) -> dict[str, int]:
+        """Current state of the database and Redis connection pools of this process. This does not do any I/O."""
+        stats = {}
+        if self.db is not None and isinstance(self.db.pool, QueuePool):
+            stats["db_size"] = self.db.pool.size()
+            stats["db_checked_out"] = self.db.pool.checkedout()
+            stats["db_overflow"] = self.db.pool.overflow()
+        if self.kv is not None:
+            kv_pool = self.kv.connection_pool
+            # Redis does not expose these publicly, so they are left out if a version no longer has them
+            in_use = getattr(kv_pool, "_in_use_connections", None)
+            available = getattr(kv_pool, "_available_connections", None)
+            if in_use is not None:
+                stats["kv_in_use"] = len(in_use)
+            if available is not None:
+                stats["kv_available"] = len(available)
+        return stats
+
     async def disconnect(self) -> None:
         if self.kv is None:
             raise StoreError("Cannot disconenct from uninitialized KV!")
@@ -0,0 +1,215 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+from httpx import codes
+from loguru import logger
+from pytest_mock import MockerFixture
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from apiserver.app.app_logging import (
+    LoggerMiddleware,
+    LogSampler,
+    RequestIdGenerator,
+    log_level,
+    logger_dict_sink,
+    logger_struct_file_sink,
+    sampled_filter,
+)
+from apiserver.env import Config, load_config
+from auth.core.util import random_time_hash_hex
+from tests.test_resources import res_path
+from tests.test_util import Fixture
+
+# Request IDs have the same length as the other short IDs
+REQUEST_ID_LENGTH = len(random_time_hash_hex(short=True))
+
+
+@pytest.fixture(scope="module")
+def api_config() -> Fixture[Config]:
+    yield load_config(res_path.joinpath("testenv.toml"))
+
+
+def test_request_ids_unique():
+    generator = RequestIdGenerator()
+    request_ids = [generator.next_id() for _ in range(1000)]
+    assert len(set(request_ids)) == len(request_ids)
+    assert all(len(request_id) == REQUEST_ID_LENGTH for request_id in request_ids)
+    # Different processes use a different prefix
+    assert RequestIdGenerator().next_id() != RequestIdGenerator().next_id()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires fork")
+def test_request_ids_after_fork():
+    """With gunicorn's preload, the generator is created before the workers are forked."""
+    generator = RequestIdGenerator()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, generator.next_id().encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    child_id = os.read(read_fd, REQUEST_ID_LENGTH).decode()
+    os.close(read_fd)
+    os.close(write_fd)
+
+    assert len(child_id) == REQUEST_ID_LENGTH
+    assert child_id[: len(generator.prefix)] != generator.prefix
+
+
+@pytest.fixture
+def log_records() -> Fixture[list[dict]]:
+    records: list[dict] = []
+    handler_id = logger.add(lambda msg: records.append(msg.record), level="TRACE")
+    yield records
+    logger.remove(handler_id)
+
+
+@pytest.fixture
+def logged_client() -> Fixture[TestClient]:
+    async def endpoint(request):
+        logger.info("in endpoint")
+        return PlainTextResponse("ok", status_code=codes.CREATED)
+
+    app = Starlette(
+        routes=[
+            Route("/route/", endpoint),
+            Route("/static/file", endpoint),
+        ]
+    )
+    with TestClient(LoggerMiddleware(app, trace_routes={"static"})) as client:
+        yield client
+
+
+def test_logger_middleware(logged_client: TestClient, log_records: list[dict]):
+    response = logged_client.get("/route/")
+    assert response.status_code == codes.CREATED
+
+    assert [(r["level"].name, r["message"]) for r in log_records] == [
+        ("DEBUG", "/route/"),
+        ("INFO", "in endpoint"),
+        ("DEBUG", "201"),
+    ]
+    # Everything logged during the request, including in the endpoint, has the same request ID
+    request_ids = {r["extra"]["request_id"] for r in log_records}
+    assert len(request_ids) == 1
+    assert request_ids.pop().endswith(": ")
+
+
+def test_logger_middleware_trace(logged_client: TestClient, log_records: list[dict]):
+    logged_client.get("/static/file")
+
+    levels = [r["level"].name for r in log_records]
+    assert levels == ["TRACE", "INFO", "TRACE"]
+
+
+def test_log_level(api_config: Config):
+    assert log_level(api_config) == "DEBUG"
+    production = api_config.model_copy(update={"APISERVER_ENV": "production"})
+    assert log_level(production) == "INFO"
+    configured = production.model_copy(update={"LOG_LEVEL": "WARNING"})
+    assert log_level(configured) == "WARNING"
+
+
+def test_dict_sink():
+    records: list[dict] = []
+    handler_id = logger_dict_sink(records, level="INFO")
+    try:
+        with logger.contextualize(request_id="abc: "):
+            logger.debug("not included")
+            logger.bind(user="1_user").info("included")
+        try:
+            raise ValueError("failed")
+        except ValueError:
+            logger.exception("with exception")
+    finally:
+        logger.remove(handler_id)
+
+    assert [r["message"] for r in records] == ["included", "with exception"]
+    assert records[0]["request_id"] == "abc"
+    assert records[0]["user"] == "1_user"
+    assert records[0]["level"] == "INFO"
+    assert "ValueError: failed" in records[1]["exception"]
+
+
+def test_struct_file_sink(api_config: Config, tmp_path: Path):
+    assert logger_struct_file_sink(api_config) is None
+
+    log_path = tmp_path.joinpath("log.jsonl")
+    config = api_config.model_copy(update={"LOG_STRUCT_PATH": str(log_path)})
+    handler_id = logger_struct_file_sink(config, level="INFO")
+    assert handler_id is not None
+    with logger.contextualize(request_id="abc: "):
+        logger.debug("not included")
+        # Braces in the message must not be formatted
+        logger.info("message with {braces}")
+    # Waits for the background thread to write the queued messages
+    logger.remove(handler_id)
+
+    lines = log_path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["message"] == "message with {braces}"
+    assert record["request_id"] == "abc"
+    assert record["name"] == __name__
+
+
+def test_sampler_every():
+    sampler = LogSampler(every=3)
+    assert [sampler.sample("a") for _ in range(6)] == [True, False, False] * 2
+    # Keys are counted separately
+    assert sampler.sample("b")
+
+
+def test_sampler_per_second(mocker: MockerFixture):
+    now = 100.0
+    mocker.patch("apiserver.app.app_logging.time.monotonic", side_effect=lambda: now)
+    sampler = LogSampler(per_second=2)
+    assert [sampler.sample("a") for _ in range(3)] == [True, True, False]
+    now += 0.5
+    assert [sampler.sample("a") for _ in range(2)] == [True, False]
+    assert sampler.sample("b")
+
+
+def test_sampler_max_keys():
+    sampler = LogSampler()
+    overflow = 10
+    for i in range(LogSampler.MAX_KEYS + overflow):
+        sampler.sample(f"key{i}")
+    assert len(sampler.counts) == LogSampler.MAX_KEYS + 1
+    assert sampler.counts[LogSampler.OTHER_KEY] == overflow
+
+
+def test_logger_middleware_sampled():
+    async def endpoint(request):
+        logger.debug("debug in endpoint")
+        logger.info("info in endpoint")
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/route/", endpoint)])
+    middleware = LoggerMiddleware(app, trace_routes=set(), sampler=LogSampler(every=2))
+    records: list[dict] = []
+    handler_id = logger.add(
+        lambda msg: records.append(msg.record), level="TRACE", filter=sampled_filter
+    )
+    try:
+        with TestClient(middleware) as client:
+            client.get("/route/")
+            client.get("/route/")
+    finally:
+        logger.remove(handler_id)
+
+    assert [r["message"] for r in records] == [
+        "/route/",
+        "debug in endpoint",
+        "info in endpoint",
+        "200",
+        # Only INFO and above of the request that is not sampled
+        "info in endpoint",
+    ]
+    # Outside of requests, everything is logged
+    assert sampled_filter(records[1])
@@ -1,7 +1,24 @@
+import asyncio
+import statistics
+import time
+from typing import ClassVar
+from unittest.mock import AsyncMock, MagicMock
+
 import opaquepy.lib as opq
 import pytest
+from sqlalchemy.ext.asyncio import AsyncConnection
 
 import apiserver.lib.utilities as util
+from apiserver.lib.hazmat.keys import gen_pw_file as gen_pw_file_for
+from auth.core.model import PasswordRequest, SavedState
+from auth.data import authentication
+from auth.data.context import LoginContext
+from auth.data.relational.entities import User
+from auth.data.relational.user import UserOps
+from auth.modules.login import start_login
+from datacontext.context import DontReplaceContext
+from store import Store
+from store.error import NoDataError
 from tests.test_util import Fixture
 
 
@@ -42,3 +59,114 @@ def test_login_wrong_user_id(gen_pw_file: str, opaque_setup: str):
 
     with pytest.raises(ValueError):
         opq.login_client_finish(cl_state, password, serv_resp)
+
+
+fake_password = "fake_record_password"
+# Maximum ratio between the slowest and fastest median login start duration
+max_timing_ratio = 1.5
+timing_email = "timing@example.com"
+unregistered_email = "unregistered@example.com"
+
+
+class TimingUserOps:
+    """Stand-in for the database, in which every lookup takes the same (simulated) time. Any timing difference
+    between logins for existing and non-existing users must then come from our own code.
+    """
+
+    users: ClassVar[dict[str, User]] = {}
+    queries: ClassVar[list[str]] = []
+
+    @classmethod
+    async def get_user_auth_by_email(
+        cls, conn: AsyncConnection, email: str
+    ) -> tuple[str, str, str]:
+        cls.queries.append("auth")
+        await asyncio.sleep(0)
+        if email not in cls.users:
+            raise NoDataError("User does not exist.", "user_empty")
+        u = cls.users[email]
+        return u.user_id, u.scope, u.password_file
+
+    @classmethod
+    async def update_password_file(
+        cls, conn: AsyncConnection, user_id: str, password_file: str
+    ) -> int:
+        return 0
+
+
+class TimingLoginContext(LoginContext):
+    @classmethod
+    async def get_user_auth_data(
+        cls,
+        store: Store,
+        user_ops: UserOps,
+        fake_password_file: str,
+        login_mail: str,
+    ) -> tuple[str, str, str, str]:
+        return await authentication.get_user_auth_data(
+            DontReplaceContext(), store, user_ops, fake_password_file, login_mail
+        )
+
+    @classmethod
+    async def store_auth_state(
+        cls, store: Store, auth_id: str, state: SavedState
+    ) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_login_start_timing_indistinguishable(opaque_setup: str):
+    """Logins for an existing user, a non-existent user and a user that has not yet registered should do the same
+    work, so that an attacker cannot find out which e-mails are in use by timing login attempts.
+    """
+    TimingUserOps.users = {
+        timing_email: User(
+            user_id="5_timing",
+            email=timing_email,
+            password_file=gen_pw_file_for(opaque_setup, password, "5_timing"),
+            scope="member",
+        ),
+        unregistered_email: User(
+            user_id="6_unregistered",
+            email=unregistered_email,
+            password_file="",
+            scope="member",
+        ),
+    }
+    fake_password_file = gen_pw_file_for(opaque_setup, fake_password, "1_fakerecord")
+    store = Store()
+    store.db = MagicMock()
+    store.db.begin.return_value = AsyncMock()
+    context = TimingLoginContext()
+
+    async def time_login(email: str) -> int:
+        client_request, _ = opq.login_client(password)
+        login_start = PasswordRequest(email=email, client_request=client_request)
+        start = time.perf_counter_ns()
+        await start_login(
+            store,
+            TimingUserOps,
+            context,
+            opaque_setup,
+            fake_password_file,
+            login_start,
+        )
+        return time.perf_counter_ns() - start
+
+    emails = [timing_email, "doesnotexist@example.com", unregistered_email]
+    queries = {}
+    for email in emails:
+        TimingUserOps.queries = []
+        await time_login(email)
+        queries[email] = TimingUserOps.queries
+    # Structurally the same: every path does a single query, none loads the fake record
+    assert queries[emails[0]] == queries[emails[1]] == queries[emails[2]] == ["auth"]
+
+    durations: dict[str, list[int]] = {email: [] for email in emails}
+    # Interleave the runs, so that any drift in machine load affects all paths equally
+    for _ in range(60):
+        for email in emails:
+            durations[email].append(await time_login(email))
+    medians = [statistics.median(durations[email]) for email in emails]
+    # The OPAQUE computation dominates and is identical for all paths, the tolerance only absorbs machine noise
+    assert max(medians) / min(medians) < max_timing_ratio
@@ -0,0 +1,172 @@
+from typing import Any, Optional, Type
+
+import pytest
+
+from datacontext.context import (
+    AbstractContexts,
+    Context,
+    ContextError,
+    ContextNotImpl,
+    ContextRegistry,
+    DontReplaceContext,
+    ctxlize,
+    ctxlize_wrap,
+)
+
+
+class ExampleContext(Context):
+    @classmethod
+    async def load_value(cls, key: str) -> str:
+        raise ContextNotImpl()
+
+    @classmethod
+    def sync_value(cls, key: str) -> str:
+        raise ContextNotImpl()
+
+
+class ExampleContexts(AbstractContexts):
+    example_ctx: ExampleContext
+
+    def __init__(self) -> None:
+        self.example_ctx = ExampleContext()
+
+    def context_from_type(self, registry_type: Type[Context]) -> Context:
+        if registry_type is ExampleContext:
+            return self.example_ctx
+
+        raise ContextError("Type does not match any valid contexts!")
+
+
+ctx_reg = ContextRegistry()
+
+
+@ctx_reg.register(ExampleContext)
+async def load_value(key: str) -> str:
+    if key == "missing":
+        raise KeyError(key)
+    return f"value_{key}"
+
+
+@ctx_reg.register(ExampleContext)
+def sync_value(key: str) -> str:
+    return f"sync_{key}"
+
+
+async def load_wrapped(conn: str, key: str) -> str:
+    return f"{conn}_{key}"
+
+
+def conn_wrap(original_function: Any) -> Any:
+    async def wrapped(source: dict[str, str], key: str) -> str:
+        return await original_function(source["conn"], key)
+
+    return wrapped
+
+
+load_from_source = ctxlize_wrap(load_wrapped, conn_wrap)
+
+
+def plain_value(key: str) -> str:
+    return f"plain_{key}"
+
+
+ctx_plain_value = ctxlize(plain_value)
+
+
+class RecordingHook:
+    calls: list[tuple[str, str, Optional[type]]]
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def before(self, name: str) -> str:
+        self.calls.append(("before", name, None))
+        return name
+
+    def after(self, name: str, state: Any, error: Optional[BaseException]) -> None:
+        assert state == name
+        self.calls.append(("after", name, type(error) if error else None))
+
+
+@pytest.fixture
+def contexts() -> ExampleContexts:
+    contexts = ExampleContexts()
+    contexts.include_registry(ctx_reg)
+    return contexts
+
+
+@pytest.mark.asyncio
+async def test_no_hooks(contexts: ExampleContexts):
+    assert await load_value(contexts.example_ctx, "a") == "value_a"
+    assert contexts.example_ctx.hooks == ()
+
+
+@pytest.mark.asyncio
+async def test_hooks(contexts: ExampleContexts):
+    hook = RecordingHook()
+    contexts.set_hooks([hook])
+
+    coro = load_value(contexts.example_ctx, "a")
+    # For async functions, `after` is only called once the call has been awaited
+    assert hook.calls == [("before", "load_value", None)]
+    assert await coro == "value_a"
+    assert sync_value(contexts.example_ctx, "b") == "sync_b"
+    expected_calls = [
+        ("before", "load_value", None),
+        ("after", "load_value", None),
+        ("before", "sync_value", None),
+        ("after", "sync_value", None),
+    ]
+    assert hook.calls == expected_calls
+
+    contexts.set_hooks([])
+    await load_value(contexts.example_ctx, "a")
+    # Removed hooks are no longer called
+    assert hook.calls == expected_calls
+
+
+@pytest.mark.asyncio
+async def test_hooks_error(contexts: ExampleContexts):
+    hook = RecordingHook()
+    contexts.set_hooks([hook])
+
+    with pytest.raises(KeyError):
+        await load_value(contexts.example_ctx, "missing")
+
+    assert hook.calls[-1] == ("after", "load_value", KeyError)
+
+
+@pytest.mark.asyncio
+async def test_hooks_replaced(contexts: ExampleContexts):
+    """Hooks are also called for replaced functions, but under the original name."""
+    hook = RecordingHook()
+
+    class ReplacedContext(Context):
+        hooks = (hook,)
+
+        @classmethod
+        async def load_wrapped(cls, source: dict[str, str], key: str) -> str:
+            return "replaced"
+
+    assert await load_from_source(ReplacedContext(), {"conn": "c"}, "k") == "replaced"
+    assert await load_from_source(contexts.example_ctx, {"conn": "c"}, "k") == "c_k"
+    assert hook.calls == [
+        ("before", "load_wrapped", None),
+        ("after", "load_wrapped", None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_hooks_ctxlize_dont_replace():
+    hook = RecordingHook()
+    ctx = DontReplaceContext()
+    ctx.hooks = (hook,)
+
+    assert ctx_plain_value(ctx, "c") == "plain_c"
+    assert await load_value(ctx, "d") == "value_d"
+    assert [name for _, name, _ in hook.calls] == [
+        "plain_value",
+        "plain_value",
+        "load_value",
+        "load_value",
+    ]
@@ -0,0 +1,50 @@
+"""
+Import time of the app, which is paid by every worker when it boots. To see where the time goes, run:
+
+    python -X importtime -c "import apiserver.app_inst" 2> import.log
+
+Every line contains the time spent in the module itself and the cumulative time including its imports, in µs.
+"""
+
+import subprocess
+import sys
+
+# Cumulative import time of `apiserver.app_inst`, which is around 1 second on a typical machine. There is a large
+# margin as it depends a lot on the machine, but it catches heavy dependencies being imported at startup again.
+IMPORT_BUDGET_US = 3_000_000
+
+# Only used on cold paths (sending mail, admin actions, migrations), so they must not be imported at startup
+LAZY_MODULES = [
+    "jinja2",
+    "aiosmtplib",
+    "regex",
+    "alembic",
+    "apiserver.lib.actions.mail",
+    "apiserver.app.ops.bulk_mail",
+]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Imports the module in a new interpreter and returns the cumulative import time (µs) of every imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_app_import_budget():
+    times = import_times("apiserver.app_inst")
+
+    assert times["apiserver.app_inst"] < IMPORT_BUDGET_US
+    imported_lazy = [m for m in LAZY_MODULES if m in times]
+    assert not imported_lazy, f"Imported at startup: {imported_lazy}"
@@ -0,0 +1,203 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from unittest.mock import AsyncMock
+
+import pytest
+from redis.exceptions import RedisError
+
+from apiserver.app.error import AppError
+from apiserver.app.ops.keys import key_state_loop, rotate_keys
+from apiserver.data import Source
+from apiserver.data.source import KeyState, PublicKeys
+from auth.core.util import utc_timestamp
+from store.error import NoDataError
+
+
+class FakeKeyChannel:
+    """Stands in for the stored key state and channel in Redis, with the same semantics as the data functions."""
+
+    def __init__(self) -> None:
+        self.key_state: Optional[KeyState] = None
+        self.subscribers: list[asyncio.Queue[KeyState]] = []
+
+    async def publish(self, dsrc: Source, key_state: KeyState) -> None:
+        self.key_state = key_state
+        for subscriber in self.subscribers:
+            subscriber.put_nowait(key_state)
+
+    async def updates(self, dsrc: Source) -> AsyncIterator[KeyState]:
+        subscriber: asyncio.Queue[KeyState] = asyncio.Queue()
+        self.subscribers.append(subscriber)
+        if self.key_state is not None:
+            yield self.key_state
+        while True:
+            yield await subscriber.get()
+
+
+@pytest.fixture
+def key_channel(mocker):
+    channel = FakeKeyChannel()
+    mocker.patch(
+        "apiserver.data.trs.key.publish_key_state", side_effect=channel.publish
+    )
+    mocker.patch(
+        "apiserver.data.trs.key.key_state_updates", side_effect=channel.updates
+    )
+    # Only the generation is needed to find the public keys
+    mocker.patch(
+        "apiserver.app.ops.keys.load_public_keys",
+        side_effect=load_public_keys,
+    )
+    yield channel
+
+
+async def load_public_keys(dsrc: Source, key_state: KeyState) -> PublicKeys:
+    return PublicKeys(generation=key_state.generation)
+
+
+@pytest.mark.asyncio
+async def test_rotation_reaches_all_workers(key_channel: FakeKeyChannel, mocker):
+    @asynccontextmanager
+    async def get_conn(_dsrc):
+        yield None
+
+    mocker.patch("apiserver.data.get_conn", get_conn)
+    mocker.patch("apiserver.app.ops.keys.load_keys_from_jwk", new_callable=AsyncMock)
+    mocker.patch("apiserver.data.key.insert_key", new_callable=AsyncMock)
+    new_state = KeyState(current_symmetric="b", old_symmetric="a", generation="gen2")
+    store_keys = mocker.patch(
+        "apiserver.app.ops.keys.store_keys",
+        new_callable=AsyncMock,
+        return_value=new_state,
+    )
+
+    old_state = KeyState(current_symmetric="a", old_symmetric="z", generation="gen1")
+    await key_channel.publish(Source(), old_state)
+    workers = [Source() for _ in range(3)]
+    listeners = [asyncio.create_task(key_state_loop(w)) for w in workers]
+    try:
+        await asyncio.sleep(0)
+        assert all(w.key_state == old_state for w in workers)
+
+        await rotate_keys(workers[0], None, "sig")
+        # The rotating worker has the new keys immediately
+        assert workers[0].key_state == new_state
+        assert store_keys.call_count == 1
+        await asyncio.sleep(0)
+        assert all(w.key_state == new_state for w in workers)
+        assert all(w.public_keys.etag == '"gen2"' for w in workers)
+    finally:
+        for listener in listeners:
+            listener.cancel()
+
+
+@pytest.mark.asyncio
+async def test_rotation_commits_before_use(key_channel: FakeKeyChannel, mocker):
+    calls: list[str] = []
+
+    @asynccontextmanager
+    async def get_conn(_dsrc):
+        yield None
+        calls.append("commit")
+
+    def record(name: str):
+        async def recorded(*args, **kwargs):
+            calls.append(name)
+            return KeyState(generation="gen2")
+
+        return recorded
+
+    mocker.patch("apiserver.data.get_conn", get_conn)
+    mocker.patch(
+        "apiserver.app.ops.keys.load_keys_from_jwk", side_effect=record("load")
+    )
+    mocker.patch("apiserver.data.key.insert_key", side_effect=record("insert"))
+    mocker.patch("apiserver.app.ops.keys.store_keys", side_effect=record("store"))
+    mocker.patch(
+        "apiserver.data.trs.key.publish_key_state", side_effect=record("publish")
+    )
+
+    await rotate_keys(Source(), None, "sig")
+
+    # The new key is committed before any worker uses it
+    assert calls == ["load", "insert", "commit", "load", "store", "publish", "commit"]
+
+
+@pytest.mark.asyncio
+async def test_symmetric_rotation_too_soon(mocker):
+    @asynccontextmanager
+    async def get_conn(_dsrc):
+        yield None
+
+    mocker.patch("apiserver.data.get_conn", get_conn)
+    mocker.patch("apiserver.app.ops.keys.load_keys_from_jwk", new_callable=AsyncMock)
+    insert_key = mocker.patch("apiserver.data.key.insert_key", new_callable=AsyncMock)
+    # The current symmetric key was added one day ago
+    mocker.patch(
+        "apiserver.data.key.get_newest_symmetric_issued",
+        new_callable=AsyncMock,
+        return_value=utc_timestamp() - 24 * 60 * 60,
+    )
+
+    # Refresh tokens encrypted with the old key would no longer be accepted
+    with pytest.raises(AppError):
+        await rotate_keys(Source(), None, "enc")
+    insert_key.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error", [RedisError("connection lost"), ValueError("invalid key state")]
+)
+async def test_listen_after_error(key_channel: FakeKeyChannel, mocker, error):
+    mocker.patch("apiserver.app.ops.keys.KEY_STATE_ERROR_DELAY", 0)
+    updates = key_channel.updates
+    failures = [error]
+
+    async def failing_updates(dsrc: Source) -> AsyncIterator[KeyState]:
+        if failures:
+            raise failures.pop()
+        async for key_state in updates(dsrc):
+            yield key_state
+
+    mocker.patch(
+        "apiserver.data.trs.key.key_state_updates", side_effect=failing_updates
+    )
+    # Published while the worker could not listen
+    await key_channel.publish(Source(), KeyState(generation="gen2"))
+
+    dsrc = Source()
+    listener = asyncio.create_task(key_state_loop(dsrc))
+    try:
+        await asyncio.sleep(0.01)
+        assert dsrc.key_state.generation == "gen2"
+    finally:
+        listener.cancel()
+
+
+@pytest.mark.asyncio
+async def test_listen_after_unusable_key_state(key_channel: FakeKeyChannel, mocker):
+    async def load_missing_public_keys(dsrc: Source, key_state: KeyState) -> PublicKeys:
+        if key_state.generation == "gen2":
+            raise NoDataError("JWK does not exist or expired.", "jwk_empty")
+        return PublicKeys(generation=key_state.generation)
+
+    mocker.patch(
+        "apiserver.app.ops.keys.load_public_keys",
+        side_effect=load_missing_public_keys,
+    )
+
+    dsrc = Source()
+    listener = asyncio.create_task(key_state_loop(dsrc))
+    try:
+        await asyncio.sleep(0)
+        await key_channel.publish(Source(), KeyState(generation="gen2"))
+        await asyncio.sleep(0)
+        assert dsrc.key_state.generation == ""
+        # The worker is still listening
+        await key_channel.publish(Source(), KeyState(generation="gen3"))
+        await asyncio.sleep(0)
+        assert dsrc.key_state.generation == "gen3"
+    finally:
+        listener.cancel()
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from loguru import logger
+
+from apiserver.app.app_logging import logger_dict_sink
+from apiserver.app_lifespan import start_background_task
+
+
+async def failing_loop() -> None:
+    raise ValueError("unexpected")
+
+
+async def stopping_loop() -> None:
+    return
+
+
+@pytest.mark.asyncio
+async def test_background_task_end_logged():
+    records: list[dict] = []
+    handler_id = logger_dict_sink(records, level="ERROR")
+    try:
+        failed = start_background_task(failing_loop(), "failing")
+        stopped = start_background_task(stopping_loop(), "stopping")
+        cancelled = start_background_task(asyncio.sleep(10), "cancelled")
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(failed, stopped, cancelled, return_exceptions=True)
+        # The done callbacks run after the tasks end
+        await asyncio.sleep(0)
+    finally:
+        logger.remove(handler_id)
+
+    # Cancelling at shutdown is expected
+    by_message = {record["message"]: record for record in records}
+    assert sorted(by_message) == [
+        "Background task failing failed.",
+        "Background task stopping stopped.",
+    ]
+    assert (
+        "ValueError: unexpected"
+        in by_message["Background task failing failed."]["exception"]
+    )
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from gunicorn.util import load_class
+from prometheus_client import REGISTRY
+from uvicorn import Config
+
+from apiserver import gunicorn_conf
+
+from apiserver.app.app_logging import RequestInfo, current_request, logger_dict_sink
+from apiserver.app.loop_monitor import (
+    install_slow_callback_monitor,
+    loop_lag_loop,
+    uninstall_slow_callback_monitor,
+)
+from loguru import logger
+
+
+async def blocking_request() -> None:
+    scope = {"route": SimpleNamespace(path="/slow/")}
+    current_request.set(RequestInfo("abc: ", scope, True))
+    await asyncio.sleep(0)
+    time.sleep(0.06)
+
+
+@pytest.mark.asyncio
+async def test_slow_callback():
+    records: list[dict] = []
+    handler_id = logger_dict_sink(records, level="WARNING")
+    assert install_slow_callback_monitor(0.05)
+    try:
+        await asyncio.create_task(blocking_request())
+    finally:
+        uninstall_slow_callback_monitor()
+        logger.remove(handler_id)
+
+    assert len(records) == 1
+    assert records[0]["request_id"] == "abc"
+    assert "(route /slow/)" in records[0]["message"]
+    assert "blocking_request" in records[0]["message"]
+    assert REGISTRY.get_sample_value(
+        "event_loop_slow_callback_duration_seconds_count", {"route": "/slow/"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_callback_disabled():
+    assert not install_slow_callback_monitor(0)
+    assert asyncio.Handle._run.__name__ == "_run"
+
+
+@pytest.mark.asyncio
+async def test_loop_lag():
+    before = REGISTRY.get_sample_value("event_loop_lag_seconds_count") or 0
+    records: list[dict] = []
+    handler_id = logger_dict_sink(records, level="WARNING")
+    lag_task = asyncio.create_task(loop_lag_loop(log_threshold=0.05, interval=0.01))
+    try:
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.05)
+    finally:
+        lag_task.cancel()
+        logger.remove(handler_id)
+
+    assert REGISTRY.get_sample_value("event_loop_lag_seconds_count") > before
+    assert len(records) == 1
+    assert records[0]["message"].startswith("Event loop blocked for")
+
+
+def test_worker_loop_monitored():
+    worker_class = load_class(gunicorn_conf.worker_class)
+    config = Config(app=None, **worker_class.CONFIG_KWARGS)
+    # uvloop would be used if it is installed, on which slow callbacks cannot be monitored
+    assert config.loop == "asyncio"
+    config.setup_event_loop()
+
+    async def install() -> bool:
+        try:
+            return install_slow_callback_monitor(0.05)
+        finally:
+            uninstall_slow_callback_monitor()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(install())
+    finally:
+        loop.close()
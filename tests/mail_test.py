@@ -0,0 +1,499 @@
+import asyncio
+import math
+import socket
+import time
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.handlers import Sink
+from aiosmtpd.smtp import AuthResult, LoginPassword
+
+from apiserver.app.ops.bulk_mail import (
+    RateLimiter,
+    active_email_batches,
+    bulk_tasks,
+    run_bulk_mail,
+    send_bulk_mail,
+    start_bulk_mail,
+    stop_bulk_mail,
+)
+from apiserver.app.ops.mail import (
+    MAX_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    deliver_batch,
+    get_mail_templates,
+    mail_outbox_loop,
+    process_outbox,
+    retry_delay,
+    send_reset_email,
+)
+from apiserver.data import Source
+from apiserver.data.trs.outbox import parse_entries
+from apiserver.define import get_template_env, loc_dict
+from apiserver.env import Config, load_config
+from apiserver.lib.actions.mail import (
+    EmailTemplates,
+    SmtpPool,
+    build_email_message,
+)
+from apiserver.lib.model.entities import BulkMailJob, QueuedEmail, UserEmail
+from auth.core.util import utc_timestamp
+from tests.test_resources import res_path
+
+POOL_SIZE = 2
+BULK_RECIPIENTS = 5
+BULK_BATCH_SIZE = 2
+
+
+class RecordingHandler(Sink):
+    def __init__(self) -> None:
+        self.messages: list[tuple[str, list[str], bytes]] = []
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        self.messages.append(
+            (envelope.mail_from, envelope.rcpt_tos, envelope.original_content)
+        )
+        return "250 OK"
+
+
+class CountingAuthenticator:
+    """Authentication happens once for every connection."""
+
+    def __init__(self) -> None:
+        self.logins = 0
+
+    def __call__(self, server, session, envelope, mechanism, auth_data) -> AuthResult:
+        assert isinstance(auth_data, LoginPassword)
+        success = auth_data.password == b"mailpass"
+        self.logins += success
+        return AuthResult(success=success)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_controller(
+    handler: RecordingHandler, authenticator: CountingAuthenticator, port: int
+) -> Controller:
+    # No TLS, so login must be allowed without it
+    controller = Controller(
+        handler,
+        hostname="127.0.0.1",
+        port=port,
+        authenticator=authenticator,
+        auth_require_tls=False,
+    )
+    controller.start()
+    return controller
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    authenticator = CountingAuthenticator()
+    controller = start_controller(handler, authenticator, free_port())
+    yield controller, handler, authenticator
+    # The test might have stopped it already
+    if not controller.loop.is_closed():
+        controller.stop()
+
+
+def make_pool(controller: Controller) -> SmtpPool:
+    return SmtpPool(
+        controller.hostname,
+        controller.port,
+        username="noreply@example.com",
+        password="mailpass",
+        start_tls=False,
+        size=POOL_SIZE,
+    )
+
+
+def make_message(receiver: str):
+    text, html = get_mail_templates().render(
+        "passwordchange.jinja2", {"reset_link": "https://example.com/reset"}
+    )
+    return build_email_message(
+        text,
+        html,
+        receiver,
+        "noreply@example.com",
+        "Request for password reset",
+        from_name="Example",
+    )
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connection(smtp_server):
+    controller, handler, authenticator = smtp_server
+    pool = make_pool(controller)
+
+    for i in range(3):
+        await pool.send(make_message(f"user{i}@example.com"))
+    await pool.close()
+
+    assert authenticator.logins == 1
+    assert [m[1] for m in handler.messages] == [
+        ["user0@example.com"],
+        ["user1@example.com"],
+        ["user2@example.com"],
+    ]
+    assert all(m[0] == "noreply@example.com" for m in handler.messages)
+    assert b"https://example.com/reset" in handler.messages[0][2]
+
+
+@pytest.mark.asyncio
+async def test_pool_reconnects(smtp_server):
+    controller, handler, authenticator = smtp_server
+    pool = make_pool(controller)
+    receivers = ["user0@example.com", "user1@example.com"]
+
+    await pool.send(make_message(receivers[0]))
+    # The server closes the connection, which the client has not noticed yet
+    controller.stop()
+    restarted = start_controller(handler, authenticator, controller.port)
+    try:
+        await pool.send(make_message(receivers[1]))
+        await pool.close()
+    finally:
+        restarted.stop()
+
+    # Both messages were sent, each over its own connection
+    assert authenticator.logins == len(receivers)
+    assert [m[1] for m in handler.messages] == [[r] for r in receivers]
+
+
+class RefusingHandler(RecordingHandler):
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "450 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+
+def queued(receiver: str, attempts: int = 0) -> QueuedEmail:
+    return QueuedEmail(
+        email_id=receiver,
+        template="passwordchange.jinja2",
+        receiver=receiver,
+        subject="Request for password reset",
+        add_vars={"reset_link": "https://example.com/reset"},
+        attempts=attempts,
+    )
+
+
+@pytest.fixture
+def mock_outbox(mocker):
+    complete = mocker.patch(
+        "apiserver.data.trs.outbox.complete_email", new_callable=AsyncMock
+    )
+    retry = mocker.patch(
+        "apiserver.data.trs.outbox.retry_email", new_callable=AsyncMock
+    )
+    yield complete, retry
+
+
+@pytest.mark.asyncio
+async def test_outbox_batch(mock_outbox):
+    complete, retry = mock_outbox
+    handler = RefusingHandler()
+    controller = start_controller(handler, CountingAuthenticator(), free_port())
+    dsrc = Source()
+    dsrc.mail_server = make_pool(controller)
+
+    entries = [
+        ("1-0", queued("user0@example.com")),
+        ("2-0", queued("refused@example.com")),
+        ("3-0", queued("refused2@example.com", attempts=MAX_ATTEMPTS - 1)),
+    ]
+    try:
+        await deliver_batch(dsrc, entries)
+        await dsrc.mail_server.close()
+    finally:
+        controller.stop()
+
+    assert [m[1] for m in handler.messages] == [["user0@example.com"]]
+    # Sent and dropped emails are both removed from the outbox
+    assert sorted(c.args[1] for c in complete.call_args_list) == ["1-0", "3-0"]
+    retry.assert_called_once()
+    _, entry_id, retried, retry_at = retry.call_args.args
+    assert entry_id == "2-0"
+    assert retried.attempts == 1
+    assert retry_at >= utc_timestamp() + RETRY_BASE_DELAY - 1
+
+
+def test_parse_invalid_entries():
+    valid = queued("user0@example.com").model_dump_json().encode()
+    entries = [
+        (b"1-0", {b"email": valid}),
+        (b"2-0", {b"email": b'{"template": 1}'}),
+        (b"3-0", {b"other": valid}),
+        (b"4-0", None),
+        (b"5-0", {b"email": valid}),
+    ]
+
+    parsed, invalid = parse_entries(entries)
+
+    # The entries after an invalid one are still read
+    assert [entry_id for entry_id, _ in parsed] == ["1-0", "5-0"]
+    assert [entry_id for entry_id, _ in invalid] == ["2-0", "3-0"]
+
+
+@pytest.mark.asyncio
+async def test_outbox_drops_poison_entry(mock_outbox, mocker):
+    complete, _ = mock_outbox
+    mocker.patch("apiserver.data.trs.outbox.requeue_due_emails", new_callable=AsyncMock)
+    # Left by a worker that stopped, or that could not parse it before
+    mocker.patch(
+        "apiserver.data.trs.outbox.claim_stale_emails",
+        new_callable=AsyncMock,
+        return_value=([], [("2-0", "invalid")]),
+    )
+    read_emails = mocker.patch(
+        "apiserver.data.trs.outbox.read_emails", new_callable=AsyncMock
+    )
+
+    assert await process_outbox(Source(), "consumer", 0) == 1
+
+    complete.assert_called_once()
+    assert complete.call_args.args[1] == "2-0"
+    read_emails.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_outbox_loop_continues(mocker):
+    mocker.patch(
+        "apiserver.data.trs.outbox.create_outbox_group", new_callable=AsyncMock
+    )
+    mocker.patch("apiserver.app.ops.mail.OUTBOX_ERROR_DELAY", 0)
+    # The loop is stopped by cancelling it after the error
+    results = [ValueError("unexpected"), 0, asyncio.CancelledError()]
+    process = mocker.patch(
+        "apiserver.app.ops.mail.process_outbox",
+        new_callable=AsyncMock,
+        side_effect=results,
+    )
+
+    with pytest.raises(asyncio.CancelledError):
+        await mail_outbox_loop(Source())
+
+    assert process.call_count == len(results)
+
+
+def test_retry_delay():
+    assert retry_delay(1) == RETRY_BASE_DELAY
+    assert retry_delay(2) == 2 * RETRY_BASE_DELAY
+    assert retry_delay(MAX_ATTEMPTS) == RETRY_MAX_DELAY
+
+
+@pytest.mark.asyncio
+async def test_queue_email_disabled(mocker):
+    enqueue = mocker.patch(
+        "apiserver.data.trs.outbox.enqueue_email", new_callable=AsyncMock
+    )
+    dsrc = Source()
+
+    await send_reset_email(dsrc, "user@example.com", "https://example.com/reset")
+    enqueue.assert_not_called()
+
+    dsrc.mail_server = SmtpPool("localhost", 25)
+    await send_reset_email(dsrc, "user@example.com", "https://example.com/reset")
+    email: QueuedEmail = enqueue.call_args.args[1]
+    assert email.template == "passwordchange.jinja2"
+    assert email.add_vars == {"reset_link": "https://example.com/reset"}
+
+
+def test_templates_match_environment():
+    """The compiled templates with the localization inlined must render the same as the templates of the environment
+    with the localization as variables."""
+    templates = EmailTemplates(get_template_env(), loc_dict)
+    templates.load_all()
+    assert "register.jinja2" in templates.compiled
+    add_vars = {
+        "redirect_link": "https://example.com/?a=1&b=2",
+        "signup_link": "https://example.com/signup",
+        "register_link": "https://example.com/register",
+        "reset_link": "https://example.com/reset",
+        "old_email": "old@example.com",
+    }
+
+    for name, (_, html) in templates.compiled.items():
+        text, html_text = templates.render(name, add_vars)
+        env_vars = loc_dict | add_vars
+        assert text == get_template_env().get_template(name).render(env_vars)
+        assert html is not None
+        html_name = name.replace(".jinja2", ".html.jinja2")
+        assert html_text == get_template_env().get_template(html_name).render(env_vars)
+
+
+def test_templates_inline_localization():
+    static_vars = {"loc": {"org_name": "Org & Co", "admin_org": "Admin"}}
+    templates = EmailTemplates(get_template_env(), static_vars)
+    text, html = templates.load("register.jinja2")
+    assert html is not None
+
+    # The localization is part of the template, so it is not a variable anymore
+    other_loc = {"loc": {"org_name": "Other", "admin_org": "Other"}}
+    rendered = text.render(other_loc | {"register_link": "https://example.com"})
+    assert "Org & Co" in rendered
+    assert "Other" not in rendered
+    # Text templates are not escaped, just like those of the environment
+    assert "Org &amp; Co" not in rendered
+
+
+async def recipient_batches(count: int, batch_size: int):
+    recipients = [
+        UserEmail(
+            user_id=f"{i}_user",
+            email=f"user{i}@example.com",
+            firstname=f"First{i}",
+            lastname="Last",
+        )
+        for i in range(count)
+    ]
+    for i in range(0, count, batch_size):
+        yield recipients[i : i + batch_size]
+
+
+@pytest.mark.asyncio
+async def test_send_bulk_mail(smtp_server, mocker):
+    controller, handler, authenticator = smtp_server
+    store_job = mocker.patch(
+        "apiserver.data.trs.bulk_mail.store_bulk_job", new_callable=AsyncMock
+    )
+    pool = make_pool(controller)
+    job = BulkMailJob(job_id="abc", subject="Announcement", started=0)
+
+    await send_bulk_mail(
+        Source(),
+        pool,
+        job,
+        "Training is <cancelled>",
+        recipient_batches(BULK_RECIPIENTS, BULK_BATCH_SIZE),
+        RateLimiter(1000),
+    )
+    await pool.close()
+
+    assert job.sent == BULK_RECIPIENTS
+    assert job.failed == 0
+    # The progress is stored after every batch
+    assert store_job.call_count == math.ceil(BULK_RECIPIENTS / BULK_BATCH_SIZE)
+    # Emails are sent concurrently, over at most the size of the pool connections
+    assert 1 <= authenticator.logins <= POOL_SIZE
+    assert sorted(m[1][0] for m in handler.messages) == [
+        f"user{i}@example.com" for i in range(BULK_RECIPIENTS)
+    ]
+    content = handler.messages[0][2].decode()
+    assert "Training is <cancelled>" in content
+    assert "Training is &lt;cancelled&gt;" in content
+
+
+@pytest.mark.asyncio
+async def test_active_email_batches(mocker):
+    members = [
+        UserEmail(
+            user_id=f"{i}_user",
+            email=f"user{i}@example.com",
+            firstname=f"First{i}",
+            lastname="Last",
+        )
+        for i in range(5)
+    ]
+    open_conns = 0
+
+    @asynccontextmanager
+    async def get_conn(_dsrc):
+        nonlocal open_conns
+        open_conns += 1
+        yield None
+        open_conns -= 1
+
+    async def get_page(_conn, after_user_id: str, limit: int):
+        return [m for m in members if m.user_id > after_user_id][:limit]
+
+    mocker.patch("apiserver.data.get_conn", get_conn)
+    get_page_mock = mocker.patch(
+        "apiserver.data.ud.get_active_emails_page", side_effect=get_page
+    )
+
+    batches = []
+    async for batch in active_email_batches(Source(), 2):
+        # No connection is held while a batch is sent
+        assert open_conns == 0
+        batches.append([m.user_id for m in batch])
+
+    assert batches == [["0_user", "1_user"], ["2_user", "3_user"], ["4_user"]]
+    assert [c.args[1] for c in get_page_mock.call_args_list] == [
+        "",
+        "1_user",
+        "3_user",
+    ]
+
+
+def test_bulk_mail_rate_config():
+    config = load_config(res_path.joinpath("testenv.toml"))
+    # Emails could never be sent, so it is rejected at startup
+    with pytest.raises(ValueError):
+        Config.model_validate({**config.model_dump(), "BULK_MAIL_PER_SECOND": 0})
+
+
+@pytest.mark.asyncio
+async def test_stop_bulk_mail(mocker):
+    store_job = mocker.patch(
+        "apiserver.data.trs.bulk_mail.store_bulk_job", new_callable=AsyncMock
+    )
+
+    async def send_forever(*args) -> None:
+        await asyncio.Event().wait()
+
+    mocker.patch("apiserver.app.ops.bulk_mail.send_bulk_mail", side_effect=send_forever)
+    dsrc = Source()
+    dsrc.config = load_config(res_path.joinpath("testenv.toml"))
+
+    job = await start_bulk_mail(dsrc, None, "Announcement", "Message")
+    await asyncio.sleep(0)
+    await stop_bulk_mail()
+
+    assert not bulk_tasks
+    stored = store_job.call_args.args[1]
+    assert stored.job_id == job.job_id
+    assert stored.status == "cancelled"
+    assert stored.finished is not None
+
+
+@pytest.mark.asyncio
+async def test_bulk_mail_result_not_stored(mocker):
+    mocker.patch(
+        "apiserver.data.trs.bulk_mail.store_bulk_job",
+        new_callable=AsyncMock,
+        side_effect=ConnectionError("Redis is gone"),
+    )
+    mocker.patch(
+        "apiserver.app.ops.bulk_mail.send_bulk_mail",
+        new_callable=AsyncMock,
+        side_effect=ValueError("unexpected"),
+    )
+    dsrc = Source()
+    dsrc.config = load_config(res_path.joinpath("testenv.toml"))
+    job = BulkMailJob(job_id="abc", subject="Announcement", started=0)
+
+    # The task ends normally, so its exception is never left unretrieved
+    await run_bulk_mail(dsrc, None, job, "Message")
+
+    assert job.status == "failed"
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter():
+    limiter = RateLimiter(100)
+    calls = 6
+    start = time.perf_counter()
+    await asyncio.gather(*(limiter.wait() for _ in range(calls)))
+    # The first returns immediately, the others 10 ms after the previous one
+    assert time.perf_counter() - start >= (calls - 1) * limiter.interval
@@ -0,0 +1,23 @@
+import gc
+
+from apiserver import gunicorn_conf
+from apiserver.app.ops.mail import get_mail_templates
+from apiserver.app_lifespan import preload_shared_state, shared_code
+
+
+def test_preload_shared_state():
+    try:
+        preload_shared_state()
+    finally:
+        gc.unfreeze()
+
+    # The workers use what was built before they were forked
+    assert shared_code() is shared_code()
+    assert "register.jinja2" in get_mail_templates().compiled
+
+
+def test_child_exit(mocker):
+    mark_dead = mocker.patch("apiserver.gunicorn_conf.mark_worker_dead")
+    worker = mocker.Mock(pid=1234)
+    gunicorn_conf.child_exit(mocker.Mock(), worker)
+    mark_dead.assert_called_once_with(1234)
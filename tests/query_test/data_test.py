@@ -7,6 +7,13 @@ import pytest
 import pytest_asyncio
 from sqlalchemy import Engine, create_engine, text
 from apiserver.data.api.classifications import insert_classification
+from apiserver.data.api.user import UserOps, insert_return_user_id
+from apiserver.data.api.ud.userdata import (
+    insert_userdata,
+    new_userdata,
+    get_active_emails_page,
+)
+from apiserver.lib.model.entities import SignedUp, User
 
 
 from apiserver.env import Config, load_config
@@ -20,6 +27,7 @@ from schema.model.model import (
 )
 from tests.test_util import Fixture
 from store.conn import get_conn
+from store.error import NoDataError
 from store.store import Store
 from tests.test_resources import res_path
 
@@ -104,3 +112,60 @@ async def test_create_class(new_db_store: Store):
     assert res_item[CLASS_START_DATE] == datetime(2022, 1, 1, 0, 0)
     assert res_item[CLASS_END_DATE] == datetime(2022, 5, 31, 0, 0)
     assert res_item[CLASS_HIDDEN_DATE] == datetime(2022, 5, 1, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_get_user_auth_by_email(new_db_store: Store):
+    async with get_conn(new_db_store) as conn:
+        user_id = await insert_return_user_id(
+            conn,
+            User(
+                id_name="auth_user",
+                email="auth@example.com",
+                password_file="",
+                scope="member",
+            ),
+        )
+        # Not yet registered, so there is no password file
+        assert await UserOps.get_user_auth_by_email(conn, "auth@example.com") == (
+            user_id,
+            "member",
+            "",
+        )
+        await UserOps.update_password_file(conn, user_id, "pw_file")
+        assert await UserOps.get_user_auth_by_email(conn, "auth@example.com") == (
+            user_id,
+            "member",
+            "pw_file",
+        )
+
+        with pytest.raises(NoDataError):
+            await UserOps.get_user_auth_by_email(conn, "missing@example.com")
+
+
+@pytest.mark.asyncio
+async def test_active_emails_page(new_db_store: Store):
+    users, active_users = 5, 4
+    async with get_conn(new_db_store) as conn:
+        for i in range(users):
+            email = f"user{i}@example.com"
+            user_id = await insert_return_user_id(
+                conn,
+                User(id_name=f"user{i}", email=email, password_file=""),
+            )
+            signed_up = SignedUp(
+                firstname=f"First{i}", lastname="Last", email=email, phone=""
+            )
+            ud = new_userdata(signed_up, user_id, f"reg{i}", i, date(2022, 1, 1))
+            # The last user is no longer active
+            ud.active = i < active_users
+            await insert_userdata(conn, ud)
+
+        first_page = await get_active_emails_page(conn, "", 3)
+        second_page = await get_active_emails_page(conn, first_page[-1].user_id, 3)
+
+    assert [len(first_page), len(second_page)] == [3, 1]
+    user_ids = [u.user_id for u in first_page + second_page]
+    assert user_ids == sorted(user_ids)
+    emails = sorted(u.email for u in first_page + second_page)
+    assert emails == [f"user{i}@example.com" for i in range(active_users)]
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncIterator
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import jwt
+import opaquepy.lib as opq
+import pytest
+from httpx import codes
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from starlette.testclient import TestClient
+
+from apiserver import data
+from apiserver.app.error import AppError
+from apiserver.app.ops.keys import rotate_keys
+from apiserver.app.ops.startup import load_keys_from_jwk, startup_steps
+from apiserver.app_def import create_app
+from apiserver.app_lifespan import (
+    State,
+    app_shutdown,
+    register_and_define_code,
+    safe_startup,
+)
+from apiserver.data import Source
+from apiserver.data.source import KeyState
+from apiserver.data.api.ud.userdata import insert_userdata, new_userdata
+from apiserver.data.api.user import UserOps, insert_return_user_id
+from apiserver.define import DEFINE, refresh_exp
+from apiserver.env import Config, load_config
+from apiserver.lib.hazmat import keys
+from apiserver.lib.model.entities import SignedUp, User
+from auth.core.util import enc_b64url
+from schema.model.model import KEY_ISSUED, KEY_TABLE, KEY_USE
+from store.round_trips import attach_round_trip_counting
+from tests.test_resources import res_path
+from tests.test_util import Fixture
+
+if not os.environ.get("QUERY_TEST"):
+    pytest.skip("Skipping flow_test as QUERY_TEST is not set.", allow_module_level=True)
+
+EMAIL = "flow@example.com"
+PASSWORD = "flow_password"
+
+
+@pytest.fixture(scope="module")
+def api_config() -> Fixture[Config]:
+    test_config_path = res_path.joinpath("querytestenv.toml")
+    config = load_config(test_config_path)
+    db_name = f"db_{uuid4()}".replace("-", "_")
+    # Every request of the flow must stay within its round trip budget
+    yield config.model_copy(update={"DB_NAME": db_name, "ROUND_TRIP_BUDGETS": "fail"})
+
+    db_cluster = f"{config.DB_USER}:{config.DB_PASS}@{config.DB_HOST}:{config.DB_PORT}"
+    admin_engine = create_engine(
+        f"postgresql+psycopg://{db_cluster}/{config.DB_NAME_ADMIN}",
+        isolation_level="AUTOCOMMIT",
+    )
+    with admin_engine.connect() as conn:
+        conn.execute(text(f"DROP DATABASE IF EXISTS {db_name} WITH (FORCE);"))
+    admin_engine.dispose()
+
+
+async def add_flow_user(dsrc: Source) -> None:
+    async with data.get_conn(dsrc) as conn:
+        user_id = await insert_return_user_id(
+            conn,
+            User(id_name="flow_user", email=EMAIL, password_file="", scope="member"),
+        )
+        password_file = keys.gen_pw_file(dsrc.opaque_setup, PASSWORD, user_id)
+        await UserOps.update_password_file(conn, user_id, password_file)
+        signed_up = SignedUp(
+            firstname="Flow", lastname="User", email=EMAIL, phone="+31612345678"
+        )
+        userdata = new_userdata(signed_up, user_id, "flow_register", 0, date.today())
+        await insert_userdata(conn, userdata)
+
+
+def flow_app(config: Config) -> FastAPI:
+    """The real app, with a lifespan that starts the store like the startup leader (without waiting for the startup
+    lock) and adds a registered user."""
+
+    @asynccontextmanager
+    async def lifespan(_app: FastAPI) -> AsyncIterator[State]:
+        dsrc = safe_startup(Source(), config)
+        await startup_steps(dsrc, config, True, True)
+        await add_flow_user(dsrc)
+        attach_round_trip_counting(dsrc.store)
+        yield {"dsrc": dsrc, "cd": register_and_define_code()}
+        await app_shutdown(dsrc)
+
+    return create_app(lifespan)
+
+
+@pytest.fixture(scope="module")
+def client(api_config: Config) -> Fixture[TestClient]:
+    with TestClient(flow_app(api_config)) as test_client:
+        yield test_client
+
+
+def query_param(location: str, name: str) -> str:
+    return parse_qs(urlparse(location).query)[name][0]
+
+
+def login_tokens(client: TestClient) -> dict[str, str]:
+    """Logs in with OPAQUE and exchanges the authorization code, like the frontend does."""
+    redirect_uri = sorted(DEFINE.valid_redirects)[0]
+    code_verifier = secrets.token_urlsafe(48)
+    code_challenge = enc_b64url(hashlib.sha256(code_verifier.encode()).digest())
+    response = client.get(
+        "/oauth/authorize/",
+        params={
+            "response_type": "code",
+            "client_id": DEFINE.frontend_client_id,
+            "redirect_uri": redirect_uri,
+            "state": "flow_state",
+            "code_challenge": code_challenge,
+            "code_challenge_method": "S256",
+            "nonce": "flow_nonce",
+        },
+        follow_redirects=False,
+    )
+    assert response.status_code == codes.SEE_OTHER
+    flow_id = query_param(response.headers["location"], "flow_id")
+
+    client_request, client_state = opq.login_client(PASSWORD)
+    response = client.post(
+        "/login/start/", json={"email": EMAIL, "client_request": client_request}
+    )
+    assert response.status_code == codes.OK
+    started = response.json()
+    finish_request, session_key = opq.login_client_finish(
+        client_state, PASSWORD, started["server_message"]
+    )
+    response = client.post(
+        "/login/finish/",
+        json={
+            "auth_id": started["auth_id"],
+            "email": EMAIL,
+            "client_request": finish_request,
+            "flow_id": flow_id,
+        },
+    )
+    assert response.status_code == codes.OK
+
+    response = client.get(
+        "/oauth/callback/",
+        params={"flow_id": flow_id, "code": session_key},
+        follow_redirects=False,
+    )
+    assert response.status_code == codes.SEE_OTHER
+    code = query_param(response.headers["location"], "code")
+
+    response = client.post(
+        "/oauth/token/",
+        json={
+            "client_id": DEFINE.frontend_client_id,
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "code_verifier": code_verifier,
+        },
+    )
+    assert response.status_code == codes.OK
+    tokens: dict[str, str] = response.json()
+    return tokens
+
+
+def refresh_tokens(client: TestClient, refresh_token: str) -> dict[str, str]:
+    response = client.post(
+        "/oauth/token/",
+        json={
+            "client_id": DEFINE.frontend_client_id,
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        },
+    )
+    assert response.status_code == codes.OK
+    tokens: dict[str, str] = response.json()
+    return tokens
+
+
+def test_login_flow_within_budgets(client: TestClient):
+    # With ROUND_TRIP_BUDGETS="fail", a request that exceeds its budget raises in the test client
+    tokens = login_tokens(client)
+    assert tokens["token_type"] == "Bearer"
+    assert tokens["id_token"] and tokens["access_token"]
+
+    refreshed = refresh_tokens(client, tokens["refresh_token"])
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+
+
+def test_concurrent_rotations(client: TestClient, api_config: Config):
+    dsrc: Source = client.app_state["dsrc"]
+
+    async def rotate_twice() -> list[KeyState]:
+        return await asyncio.gather(
+            rotate_keys(dsrc, api_config, "sig"), rotate_keys(dsrc, api_config, "sig")
+        )
+
+    async def stored_kids() -> set[str]:
+        async with data.get_conn(dsrc) as conn:
+            key_set = await load_keys_from_jwk(conn, api_config)
+        return {key.kid for key in key_set.keys}
+
+    first, second = client.portal.call(rotate_twice)
+    kids = client.portal.call(stored_kids)
+
+    # Neither rotation overwrote the key added by the other
+    first_kid = first.current_signing.removesuffix("-pem-private")
+    second_kid = second.current_signing.removesuffix("-pem-private")
+    assert first_kid != second_kid
+    assert {first_kid, second_kid} <= kids
+    # The rotation that was applied last is the one in use
+    assert dsrc.key_state.current_signing in {
+        first.current_signing,
+        second.current_signing,
+    }
+
+
+async def age_symmetric_keys(dsrc: Source) -> None:
+    """As if the symmetric keys were added a refresh token lifetime ago."""
+    async with data.get_conn(dsrc) as conn:
+        await conn.execute(
+            text(
+                f"UPDATE {KEY_TABLE} SET {KEY_ISSUED} = {KEY_ISSUED} - :exp WHERE"
+                f" {KEY_USE} = 'enc';"
+            ),
+            parameters={"exp": refresh_exp},
+        )
+
+
+def test_rotation_keeps_refresh_tokens(client: TestClient, api_config: Config):
+    dsrc: Source = client.app_state["dsrc"]
+    tokens = login_tokens(client)
+
+    # The symmetric keys were just added, so they cannot be rotated yet
+    with pytest.raises(AppError):
+        client.portal.call(rotate_keys, dsrc, api_config, "enc")
+    client.portal.call(age_symmetric_keys, dsrc)
+    enc_state = client.portal.call(rotate_keys, dsrc, api_config, "enc")
+    # The refresh token was encrypted with the previous symmetric key, which is now the old one
+    refreshed = refresh_tokens(client, tokens["refresh_token"])
+    assert enc_state.old_symmetric != enc_state.current_symmetric
+
+    sig_state = client.portal.call(rotate_keys, dsrc, api_config, "sig")
+    new_tokens = refresh_tokens(client, refreshed["refresh_token"])
+    kid = jwt.get_unverified_header(new_tokens["access_token"])["kid"]
+    assert kid == sig_state.current_signing.removesuffix("-pem-private")
+    # The new access token is accepted, so it is verified with the new public key
+    response = client.get(
+        "/members/profile/",
+        headers={"Authorization": f"Bearer {new_tokens['access_token']}"},
+    )
+    assert response.status_code == codes.OK
+    assert response.json()["email"] == EMAIL
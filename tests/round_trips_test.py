@@ -0,0 +1,98 @@
+import pytest
+from fastapi import FastAPI
+from httpx import codes
+from loguru import logger
+from sqlalchemy import event
+from starlette.testclient import TestClient
+
+from apiserver.app.app_logging import logger_dict_sink
+from apiserver.app.budgets import RoundTripBudgetExceeded, RoundTripBudgetMiddleware
+from apiserver.env import Config, load_config
+from store import Store
+from store.round_trips import (
+    RoundTrips,
+    _count_checkout,
+    _count_statement,
+    _counting_get_connection,
+    attach_round_trip_counting,
+    count_round_trips,
+    detach_round_trip_counting,
+)
+from tests.test_resources import res_path
+
+
+def test_exceeded():
+    budget = RoundTrips(db_checkouts=1, statements=2, kv_commands=0)
+    assert RoundTrips(1, 2, 0).exceeded(budget) == []
+    assert RoundTrips(2, 1, 1).exceeded(budget) == ["db_checkouts", "kv_commands"]
+
+
+@pytest.mark.asyncio
+async def test_count_round_trips():
+    async def get_connection(command_name: str) -> str:
+        return "connection"
+
+    counted_get_connection = _counting_get_connection(get_connection)
+    # Nothing is counted outside of `count_round_trips`
+    _count_statement()
+    with count_round_trips() as trips:
+        _count_checkout()
+        _count_statement()
+        _count_statement()
+        assert await counted_get_connection("GET") == "connection"
+
+    assert trips == RoundTrips(db_checkouts=1, statements=2, kv_commands=1)
+
+
+def test_attach():
+    store = Store()
+    store.init_objects(load_config(res_path.joinpath("testenv.toml")))
+    attach_round_trip_counting(store)
+    assert event.contains(store.db.sync_engine, "checkout", _count_checkout)
+    assert "get_connection" in vars(store.kv.connection_pool)
+    detach_round_trip_counting(store)
+    assert not event.contains(store.db.sync_engine, "checkout", _count_checkout)
+    assert "get_connection" not in vars(store.kv.connection_pool)
+
+
+def budget_client(mode: str) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/budget/")
+    async def budget_route() -> None:
+        _count_statement()
+        _count_statement()
+
+    budgets = {"/budget/": RoundTrips(statements=1)}
+    app.add_middleware(RoundTripBudgetMiddleware, budgets=budgets, mode=mode)
+    return TestClient(app)
+
+
+def test_budget_fail():
+    with pytest.raises(RoundTripBudgetExceeded):
+        budget_client("fail").get("/budget/")
+
+
+def test_budget_warn():
+    records: list[dict] = []
+    handler_id = logger_dict_sink(records, level="WARNING")
+    try:
+        response = budget_client("warn").get("/budget/")
+    finally:
+        logger.remove(handler_id)
+
+    assert response.status_code == codes.OK
+    assert len(records) == 1
+    assert "exceeded its round trip budget" in records[0]["message"]
+    assert "statements" in records[0]["message"]
+
+
+def test_budget_off():
+    assert budget_client("off").get("/budget/").status_code == codes.OK
+
+
+def test_config_mode():
+    config = load_config(res_path.joinpath("testenv.toml"))
+    assert config.ROUND_TRIP_BUDGETS == "off"
+    with pytest.raises(ValueError):
+        Config.model_validate({**config.model_dump(), "ROUND_TRIP_BUDGETS": "on"})
@@ -0,0 +1,77 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from httpx import codes
+from starlette.testclient import TestClient
+
+from apiserver.data import Source
+from apiserver.data.context import Code
+from apiserver.lib.actions.mail import SmtpPool
+from apiserver.lib.model.entities import BulkMailJob
+from tests.router_test.ranking_test import mock_authrz_ctx
+from tests.test_util import acc_token_from_info
+
+pytest_plugins = [
+    "tests.router_test.data_fixtures",
+]
+
+
+@pytest.fixture
+def admin_headers(make_cd: Code):
+    acc_token = acc_token_from_info("1_admin", "admin member")
+    make_cd.app_context.authrz_ctx = mock_authrz_ctx(acc_token)
+    yield {"Authorization": "something"}
+
+
+def test_bulk_mail_disabled(
+    test_client: TestClient, admin_headers: dict[str, str], make_dsrc: Source
+):
+    make_dsrc.mail_server = None
+    response = test_client.post(
+        "/admin/mail/bulk/",
+        json={"subject": "Announcement", "message": "Hello"},
+        headers=admin_headers,
+    )
+    assert response.status_code == codes.BAD_REQUEST
+    assert response.json()["error"] == "mail_disabled"
+
+
+def test_bulk_mail_start(
+    test_client: TestClient, admin_headers: dict[str, str], make_dsrc: Source, mocker
+):
+    make_dsrc.mail_server = SmtpPool("localhost", 25)
+    start = mocker.patch(
+        "apiserver.app.ops.bulk_mail.start_bulk_mail",
+        new_callable=AsyncMock,
+        return_value=BulkMailJob(job_id="abc", subject="Announcement", started=0),
+    )
+    try:
+        response = test_client.post(
+            "/admin/mail/bulk/",
+            json={"subject": "Announcement", "message": "Hello"},
+            headers=admin_headers,
+        )
+    finally:
+        make_dsrc.mail_server = None
+    assert response.status_code == codes.OK
+    assert response.json() == {"job_id": "abc"}
+    assert start.call_args.args[2:] == ("Announcement", "Hello")
+
+
+def test_bulk_mail_progress(
+    test_client: TestClient, admin_headers: dict[str, str], mocker
+):
+    job = BulkMailJob(job_id="abc", subject="Announcement", started=0, sent=3)
+    mocker.patch(
+        "apiserver.data.trs.bulk_mail.get_bulk_job",
+        new_callable=AsyncMock,
+        side_effect=lambda dsrc, job_id: job if job_id == "abc" else None,
+    )
+
+    response = test_client.get("/admin/mail/bulk/abc/", headers=admin_headers)
+    assert response.status_code == codes.OK
+    assert response.json()["sent"] == job.sent
+    assert response.json()["status"] == "running"
+
+    response = test_client.get("/admin/mail/bulk/other/", headers=admin_headers)
+    assert response.status_code == codes.NOT_FOUND
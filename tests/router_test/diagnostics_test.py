@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from httpx import codes
+from starlette.testclient import TestClient
+
+from apiserver.app.profiler import collapse_stack, sample_stacks
+from apiserver.app.routers.diagnostics import profile_lock
+from apiserver.data import Source
+from apiserver.data.context import Code
+from store.stats import StatementStatsCollector
+from tests.router_test.ranking_test import mock_authrz_ctx
+from tests.test_util import acc_token_from_info
+
+pytest_plugins = [
+    "tests.router_test.data_fixtures",
+]
+
+
+def busy_function(stop: threading.Event) -> None:
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sample_stacks():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_function, args=(stop,))
+    thread.start()
+    try:
+        stacks = sample_stacks(thread.ident, 0.1, 0.001)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert sum(stacks.values()) > 0
+    stack = stacks.most_common(1)[0][0]
+    assert stack.startswith("threading:Thread._bootstrap")
+    assert stack.endswith(f"{__name__}:busy_function")
+
+
+def test_sample_stacks_current_thread():
+    with pytest.raises(ValueError):
+        sample_stacks(threading.get_ident(), 0.1)
+
+
+def test_collapse_stack():
+    assert collapse_stack(None) == ""
+
+
+@pytest.fixture
+def admin_headers(make_cd: Code):
+    acc_token = acc_token_from_info("1_admin", "admin member")
+    make_cd.app_context.authrz_ctx = mock_authrz_ctx(acc_token)
+    yield {"Authorization": "something"}
+
+
+def test_profile(test_client: TestClient, admin_headers: dict[str, str]):
+    response = test_client.get(
+        "/admin/diagnostics/profile/?seconds=0.2&interval=0.001", headers=admin_headers
+    )
+    assert response.status_code == codes.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert lines
+    # Every line is a stack followed by its count
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert ";" in stack
+
+
+def test_profile_running(test_client: TestClient, admin_headers: dict[str, str]):
+    asyncio.run(profile_lock.acquire())
+    try:
+        response = test_client.get(
+            "/admin/diagnostics/profile/?seconds=0.1", headers=admin_headers
+        )
+    finally:
+        profile_lock.release()
+    assert response.status_code == codes.CONFLICT
+
+
+def test_profile_limits(test_client: TestClient, admin_headers: dict[str, str]):
+    response = test_client.get(
+        "/admin/diagnostics/profile/?seconds=1000", headers=admin_headers
+    )
+    assert response.status_code == codes.BAD_REQUEST
+
+
+def test_profile_not_admin(test_client: TestClient, make_cd: Code):
+    acc_token = acc_token_from_info("1_member", "member")
+    make_cd.app_context.authrz_ctx = mock_authrz_ctx(acc_token)
+    response = test_client.get(
+        "/admin/diagnostics/profile/", headers={"Authorization": "something"}
+    )
+    assert response.status_code == codes.FORBIDDEN
+
+
+def test_statement_stats(
+    test_client: TestClient, admin_headers: dict[str, str], make_dsrc: Source
+):
+    make_dsrc.store.statement_stats = None
+    response = test_client.get("/admin/diagnostics/statements/", headers=admin_headers)
+    assert response.status_code == codes.NOT_FOUND
+
+    collector = StatementStatsCollector()
+    collector.record("SELECT 1;", 0.001, 1)
+    collector.record("SELECT 2;", 0.01, 1)
+    make_dsrc.store.statement_stats = collector
+    try:
+        response = test_client.get(
+            "/admin/diagnostics/statements/?n=1", headers=admin_headers
+        )
+        assert response.status_code == codes.OK
+        assert [s["statement"] for s in response.json()] == ["SELECT 2;"]
+
+        response = test_client.post(
+            "/admin/diagnostics/statements/reset/", headers=admin_headers
+        )
+        assert response.status_code == codes.OK
+        assert not collector.stats
+    finally:
+        make_dsrc.store.statement_stats = None
@@ -0,0 +1,66 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from httpx import codes
+from starlette.testclient import TestClient
+
+from apiserver.app.error import AppError, ErrorKeys
+from apiserver.data.context import Code
+from apiserver.data.source import KeyState
+from tests.router_test.ranking_test import mock_authrz_ctx
+from tests.test_util import acc_token_from_info
+
+pytest_plugins = [
+    "tests.router_test.data_fixtures",
+]
+
+
+@pytest.fixture
+def admin_headers(make_cd: Code):
+    acc_token = acc_token_from_info("1_admin", "admin member")
+    make_cd.app_context.authrz_ctx = mock_authrz_ctx(acc_token)
+    yield {"Authorization": "something"}
+
+
+def test_rotate_key(test_client: TestClient, admin_headers: dict[str, str], mocker):
+    new_state = KeyState(
+        current_symmetric="b",
+        old_symmetric="a",
+        current_signing="c-pem-private",
+        generation="gen2",
+    )
+    rotate = mocker.patch(
+        "apiserver.app.routers.admin.rotate_keys",
+        new_callable=AsyncMock,
+        return_value=new_state,
+    )
+    response = test_client.post(
+        "/admin/keys/rotate/", json={"use": "enc"}, headers=admin_headers
+    )
+    assert response.status_code == codes.OK
+    assert response.json() == new_state.model_dump()
+    assert rotate.call_args.args[2] == "enc"
+
+
+def test_rotate_key_invalid_use(test_client: TestClient, admin_headers: dict[str, str]):
+    response = test_client.post(
+        "/admin/keys/rotate/", json={"use": "other"}, headers=admin_headers
+    )
+    assert response.status_code == codes.BAD_REQUEST
+
+
+def test_rotate_key_too_soon(
+    test_client: TestClient, admin_headers: dict[str, str], mocker
+):
+    mocker.patch(
+        "apiserver.app.routers.admin.rotate_keys",
+        new_callable=AsyncMock,
+        side_effect=AppError(
+            ErrorKeys.KEY_ROTATION, "Too soon", "symmetric_rotation_too_soon"
+        ),
+    )
+    response = test_client.post(
+        "/admin/keys/rotate/", json={"use": "enc"}, headers=admin_headers
+    )
+    assert response.status_code == codes.BAD_REQUEST
+    assert response.json()["error"] == ErrorKeys.KEY_ROTATION
@@ -44,19 +44,18 @@ def opq_val(test_values: dict):
 def mock_login_start_context(
     test_user: GenUser,
     pw_file: str,
-    server_setup: str,
     test_scope: str,
     test_auth_id: str,
     state_store: dict,
 ):
     class MockLoginContext(LoginContext):
-        @classmethod
-        async def get_apake_setup(cls, store: Store) -> str:
-            return server_setup
-
         @classmethod
         async def get_user_auth_data(
-            cls, store: Store, user_ops: UserOps, login_mail: str
+            cls,
+            store: Store,
+            user_ops: UserOps,
+            fake_password_file: str,
+            login_mail: str,
         ) -> tuple[str, str, str, str]:
             if test_user.user_email == login_mail:
                 return test_user.user_id, test_scope, pw_file, test_auth_id
@@ -71,15 +70,17 @@ def mock_login_start_context(
     return MockLoginContext
 
 
-def test_login(test_client, make_cd, gen_user: GenUser, opq_val: OpaqueValues):
+def test_login(
+    test_client, make_cd, make_dsrc, gen_user: GenUser, opq_val: OpaqueValues
+):
     state_store = {}
     test_auth_id = "12345"
     test_scope = "some_scope another"
 
+    make_dsrc.opaque_setup = opq_val.server_setup
     make_cd.auth_context.login_ctx = mock_login_start_context(
         gen_user,
         opq_val.correct_password_file,
-        opq_val.server_setup,
         test_scope,
         test_auth_id,
         state_store,
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from httpx import codes
+from redis.asyncio import Redis
+
+from apiserver.app.metrics import pool_metrics_loop
+from apiserver.data import Source
+from store import Store
+
+pytest_plugins = [
+    "tests.router_test.data_fixtures",
+]
+
+metrics_token = "abcmetrics"
+
+
+@pytest.fixture
+def metrics_enabled(make_dsrc: Source):
+    config = make_dsrc.config
+    make_dsrc.config = config.model_copy(update={"METRICS_TOKEN": metrics_token})
+    yield
+    make_dsrc.config = config
+
+
+def test_metrics(test_client, metrics_enabled):
+    test_client.get("/")
+    response = test_client.get(
+        "/metrics", headers={"Authorization": f"Bearer {metrics_token}"}
+    )
+    assert response.status_code == codes.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    # The route template is used as label
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert "http_request_duration_seconds_bucket" in response.text
+    assert "http_requests_in_progress" in response.text
+
+
+def test_metrics_wrong_token(test_client, metrics_enabled):
+    response = test_client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == codes.FORBIDDEN
+
+
+def test_metrics_disabled(test_client):
+    response = test_client.get(
+        "/metrics", headers={"Authorization": f"Bearer {metrics_token}"}
+    )
+    assert response.status_code == codes.NOT_FOUND
+
+
+worker_script = """
+from apiserver.app.metrics import http_requests
+http_requests.labels("GET", "/", "200").inc()
+"""
+
+scrape_script = """
+from apiserver.app.metrics import render_metrics
+print(render_metrics()[0].decode())
+"""
+
+
+def test_metrics_multiprocess(tmp_path: Path):
+    """Every gunicorn worker is a separate process, the scrape must include the metrics of all of them."""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker_script], env=env, check=True)
+    scrape = subprocess.run(
+        [sys.executable, "-c", scrape_script],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert 'http_requests_total{method="GET",route="/",status="200"} 2.0' in (
+        scrape.stdout
+    )
+
+
+def test_pool_stats_kv():
+    store = Store()
+    # Does not connect until it is used
+    store.kv = Redis()
+    assert store.pool_stats() == {"kv_in_use": 0, "kv_available": 0}
+
+    # The counts are private in Redis, so they are left out if they do not exist
+    store.kv = Redis()
+    store.kv.connection_pool = object()
+    assert store.pool_stats() == {}
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics_loop_continues(mocker):
+    mocker.patch("apiserver.app.metrics.POOL_STATS_INTERVAL", 0)
+    results = [RuntimeError("broken"), None, None]
+    update = mocker.patch(
+        "apiserver.app.metrics.update_pool_metrics", side_effect=results
+    )
+    loop_task = asyncio.create_task(pool_metrics_loop(Store()))
+    while update.call_count < len(results):
+        await asyncio.sleep(0)
+    loop_task.cancel()
+    assert update.call_count == len(results)
@@ -83,12 +83,8 @@ def mock_register_start_ctx(test_ud: UserData, test_user: User, test_register_id
     return MockRegisterContext()
 
 
-def mock_register_context(server_setup: str, mock_auth_id: str, mock_req_store: dict):
+def mock_register_context(mock_auth_id: str, mock_req_store: dict):
     class MockRegisterContext(RegisterContext):
-        @classmethod
-        async def get_apake_setup(cls, store: Store) -> str:
-            return server_setup
-
         @classmethod
         async def store_auth_register_state(
             cls, store: Store, user_id: str, state: SavedRegisterState
@@ -100,7 +96,11 @@ def mock_register_context(server_setup: str, mock_auth_id: str, mock_req_store:
 
 
 def test_start_register(
-    test_client, gen_ud_u: tuple[UserData, User], make_cd: Code, opq_val: OpaqueValues
+    test_client,
+    gen_ud_u: tuple[UserData, User],
+    make_cd: Code,
+    make_dsrc: Source,
+    opq_val: OpaqueValues,
 ):
     test_ud, test_u = gen_ud_u
     test_register_id = (
@@ -112,9 +112,8 @@ def test_start_register(
     make_cd.app_context.register_ctx = mock_register_start_ctx(
         test_ud, test_u, test_register_id
     )
-    make_cd.auth_context.register_ctx = mock_register_context(
-        opq_val.server_setup, test_auth_id, req_store
-    )
+    make_dsrc.opaque_setup = opq_val.server_setup
+    make_cd.auth_context.register_ctx = mock_register_context(test_auth_id, req_store)
 
     # password 'clientele'
     req = {
@@ -186,6 +186,10 @@ def test_auth_code(
     saved_refresh = mock_db[test_refresh_id]
     assert isinstance(saved_refresh, SavedRefreshToken)
     assert saved_refresh.user_id == test_user.user_id
+    # Outside production the durations of the stages are included
+    server_timing = response.headers["Server-Timing"]
+    for stage in ("pop_flow_user", "get_keys", "add_refresh_token", "sign_id_token"):
+        assert f"{stage};dur=" in server_timing
 
 
 def fake_tokens(
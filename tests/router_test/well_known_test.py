@@ -0,0 +1,54 @@
+import pytest
+from httpx import codes
+from starlette.testclient import TestClient
+
+from apiserver.data import Source
+from apiserver.data.source import PublicKeys
+from apiserver.define import DEFINE
+
+pytest_plugins = [
+    "tests.router_test.data_fixtures",
+]
+
+
+@pytest.fixture
+def public_keys(make_dsrc: Source):
+    jwks = b'{"keys":[{"kty":"OKP","use":"sig","alg":"EdDSA","kid":"a","crv":"Ed448","x":"abc"}]}'
+    make_dsrc.public_keys = PublicKeys(generation="gen1", jwks=jwks)
+    yield make_dsrc.public_keys
+    make_dsrc.public_keys = PublicKeys()
+
+
+def test_jwks(test_client: TestClient, public_keys: PublicKeys):
+    response = test_client.get("/.well-known/jwks.json")
+    assert response.status_code == codes.OK
+    assert response.content == public_keys.jwks
+    assert response.headers["ETag"] == '"gen1"'
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = test_client.get(
+        "/.well-known/jwks.json", headers={"If-None-Match": '"gen1"'}
+    )
+    assert response.status_code == codes.NOT_MODIFIED
+    assert response.content == b""
+
+    # Clients can send several ETags, also marked as weak
+    for if_none_match in ['"gen0", "gen1"', 'W/"gen1"', "*"]:
+        response = test_client.get(
+            "/.well-known/jwks.json", headers={"If-None-Match": if_none_match}
+        )
+        assert response.status_code == codes.NOT_MODIFIED
+
+    # After the keys are rotated
+    response = test_client.get(
+        "/.well-known/jwks.json", headers={"If-None-Match": '"gen0", W/"gen2"'}
+    )
+    assert response.status_code == codes.OK
+
+
+def test_openid_configuration(test_client: TestClient):
+    response = test_client.get("/.well-known/openid-configuration")
+    assert response.status_code == codes.OK
+    config = response.json()
+    assert config["issuer"] == DEFINE.issuer
+    assert config["jwks_uri"].endswith("/.well-known/jwks.json")
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from auth.core.span import SpanRecorder, record_spans, span
+
+
+def test_span_not_recorded():
+    with span("stage"):
+        pass
+    # Without an active recorder nothing is allocated
+    assert span("stage") is span("other")
+
+
+def test_record_spans():
+    with record_spans() as recorder:
+        with span("first"):
+            with span("nested"):
+                pass
+        with span("second"):
+            pass
+
+    assert [name for name, _ in recorder.spans] == ["nested", "first", "second"]
+    assert all(duration >= 0 for _, duration in recorder.spans)
+    nested, first, _ = (duration for _, duration in recorder.spans)
+    assert first >= nested
+
+    recorded = list(recorder.spans)
+    with span("after"):
+        pass
+    # Spans outside of the recording are not recorded
+    assert recorder.spans == recorded
+
+
+def test_span_exception():
+    recorder = SpanRecorder()
+    with record_spans(recorder), pytest.raises(ValueError), span("failing"):
+        raise ValueError()
+
+    assert [name for name, _ in recorder.spans] == ["failing"]
+
+
+@pytest.mark.asyncio
+async def test_record_spans_tasks():
+    async def stage(name: str):
+        with span(name):
+            await asyncio.sleep(0)
+
+    with record_spans() as recorder:
+        await asyncio.gather(stage("a"), stage("b"))
+    # Concurrent requests each have their own recorder
+    with record_spans() as other:
+        await stage("c")
+
+    assert sorted(name for name, _ in recorder.spans) == ["a", "b"]
+    assert [name for name, _ in other.spans] == ["c"]
@@ -0,0 +1,183 @@
+import asyncio
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from apiserver.app.ops import startup
+from apiserver.app.ops.startup import wait_for_lock_is_first
+from apiserver.data import Source
+from apiserver.data.source import KeyState
+from store import StoreError
+
+
+class FakeStartupLock:
+    """Stands in for the lock in Redis, with the same semantics as the data functions."""
+
+    def __init__(self) -> None:
+        self.value: Optional[str] = None
+        self.released = asyncio.Event()
+        self.outcome: Optional[str] = None
+
+    async def acquire(self, dsrc: Source, token: str) -> bool:
+        await asyncio.sleep(0)
+        if self.value is not None:
+            return False
+        self.value = token
+        return True
+
+    async def release(self, dsrc: Source, token: str, outcome: str) -> bool:
+        if self.value != token:
+            return False
+        self.value = "done" if outcome == "done" else None
+        self.outcome = outcome
+        self.released.set()
+        return True
+
+    async def wait(self, dsrc: Source, timeout: float) -> Optional[str]:
+        if self.value == "done":
+            return "done"
+        try:
+            await asyncio.wait_for(self.released.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.outcome
+
+
+@pytest.fixture
+def fake_lock(mocker):
+    lock = FakeStartupLock()
+    mocker.patch(
+        "apiserver.data.trs.startup.acquire_startup_lock", side_effect=lock.acquire
+    )
+    mocker.patch(
+        "apiserver.data.trs.startup.release_startup_lock", side_effect=lock.release
+    )
+    mocker.patch(
+        "apiserver.data.trs.startup.wait_startup_lock_released",
+        side_effect=lock.wait,
+    )
+    yield lock
+
+
+@pytest.mark.asyncio
+async def test_single_leader(fake_lock: FakeStartupLock, mocker):
+    leaders = []
+
+    async def startup_steps(
+        dsrc: Source, config, is_first_process: bool, recreate: bool
+    ) -> None:
+        assert recreate
+        if is_first_process:
+            leaders.append(dsrc)
+            # Followers must wait until the leader is done
+            await asyncio.sleep(0.01)
+        else:
+            assert fake_lock.value == "done"
+
+    mocker.patch("apiserver.app.ops.startup.startup_steps", side_effect=startup_steps)
+
+    await asyncio.gather(*(startup.startup(Source(), None, True) for _ in range(8)))
+
+    assert len(leaders) == 1
+    assert fake_lock.value == "done"
+    # Processes that start later are followers
+    assert not await wait_for_lock_is_first(Source(), "late")
+
+
+@pytest.mark.asyncio
+async def test_leader_failed(fake_lock: FakeStartupLock, mocker):
+    mocker.patch(
+        "apiserver.app.ops.startup.startup_steps",
+        new_callable=AsyncMock,
+        side_effect=StoreError("no database"),
+    )
+    assert await wait_for_lock_is_first(Source(), "other")
+
+    follower = asyncio.create_task(wait_for_lock_is_first(Source(), "follower"))
+    # Until the follower is waiting
+    await asyncio.sleep(0.01)
+    await fake_lock.release(Source(), "other", "failed")
+    with pytest.raises(StoreError):
+        await follower
+
+    # The lock is removed, so a restarted process becomes the leader, but fails again
+    with pytest.raises(StoreError, match="no database"):
+        await startup.startup(Source(), None)
+    assert fake_lock.value is None
+    assert fake_lock.outcome == "failed"
+
+
+@pytest.mark.asyncio
+async def test_wait_too_long(fake_lock: FakeStartupLock, mocker):
+    mocker.patch("apiserver.app.ops.startup.MAX_WAIT", 0.01)
+    assert await wait_for_lock_is_first(Source(), "stopped")
+
+    with pytest.raises(StoreError, match="too long"):
+        await wait_for_lock_is_first(Source(), "follower")
+
+
+@pytest.mark.asyncio
+async def test_followers_use_prepared_keys(mocker):
+    prepared: dict[str, KeyState] = {}
+
+    async def store_key_state(dsrc: Source, key_state: KeyState) -> None:
+        prepared["key_state"] = key_state
+
+    async def get_key_state(dsrc: Source) -> Optional[KeyState]:
+        return prepared.get("key_state")
+
+    leader_keys = KeyState(current_symmetric="sym", generation="gen1")
+    load_keys = mocker.patch(
+        "apiserver.app.ops.startup.load_keys",
+        new_callable=AsyncMock,
+        return_value=leader_keys,
+    )
+    mocker.patch("apiserver.data.trs.key.store_key_state", side_effect=store_key_state)
+    mocker.patch("apiserver.data.trs.key.get_key_state", side_effect=get_key_state)
+    mocker.patch("apiserver.app.ops.startup.load_opaque_setup", new_callable=AsyncMock)
+    mocker.patch("apiserver.app.ops.startup.load_public_keys", new_callable=AsyncMock)
+
+    def make_dsrc() -> Source:
+        dsrc = Source()
+        dsrc.store = MagicMock()
+        dsrc.store.startup = AsyncMock()
+        return dsrc
+
+    leader = make_dsrc()
+    await startup.startup_steps(leader, None, True, False)
+    assert load_keys.call_count == 1
+
+    followers = [make_dsrc() for _ in range(4)]
+    for follower in followers:
+        await startup.startup_steps(follower, None, False, False)
+    # Only the leader decrypts the keys
+    assert load_keys.call_count == 1
+    assert all(f.key_state == leader.key_state == leader_keys for f in followers)
+
+    # If the prepared keys are gone, a follower loads them itself
+    prepared.clear()
+    load_keys.reset_mock()
+    follower = make_dsrc()
+    await startup.startup_steps(follower, None, False, False)
+    load_keys.assert_called_once()
+    assert prepared["key_state"] == leader_keys
+
+
+@pytest.mark.asyncio
+async def test_keystate_generation(mocker):
+    newest_pem = mocker.patch(
+        "apiserver.data.key.get_newest_pem", new_callable=AsyncMock, return_value="p1"
+    )
+    mocker.patch(
+        "apiserver.data.key.get_newest_symmetric",
+        new_callable=AsyncMock,
+        return_value=("s2", "s1"),
+    )
+
+    key_state = await startup.get_keystate(None)
+    # Loading the same keys again gives the same generation
+    assert (await startup.get_keystate(None)).generation == key_state.generation
+
+    newest_pem.return_value = "p2"
+    assert (await startup.get_keystate(None)).generation != key_state.generation
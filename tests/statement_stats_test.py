@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from store.stats import StatementStatsCollector
+
+
+def test_statement_stats():
+    engine = create_engine("sqlite://")
+    collector = StatementStatsCollector()
+    collector.attach(engine)
+    inserts, deleted = 3, 2
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE numbers (n integer);"))
+        for i in range(inserts):
+            conn.execute(text("INSERT INTO numbers (n) VALUES (:n);"), {"n": i})
+        conn.execute(text("DELETE FROM numbers WHERE n < :n;"), {"n": deleted})
+    collector.detach(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM numbers;"))
+
+    insert_stats = collector.stats["INSERT INTO numbers (n) VALUES (?);"]
+    assert insert_stats.count == inserts
+    assert insert_stats.rows == inserts
+    assert 0 < insert_stats.max_time <= insert_stats.total_time
+    assert collector.stats["DELETE FROM numbers WHERE n < ?;"].rows == deleted
+    # Statements after detaching are not recorded
+    assert "DELETE FROM numbers;" not in collector.stats
+
+    top = collector.top(1, "count")
+    assert top == [insert_stats]
+
+
+def test_statement_stats_max():
+    max_statements, statements = 2, 4
+    collector = StatementStatsCollector(max_statements=max_statements)
+    for i in range(statements):
+        collector.record(f"SELECT {i};", 0.001, 1)
+    assert len(collector.stats) == max_statements + 1
+    other = collector.stats[StatementStatsCollector.OTHER_STATEMENT]
+    assert other.count == statements - max_statements
+    collector.reset()
+    assert not collector.stats
+
+
+def test_failed_statement():
+    engine = create_engine("sqlite://")
+    collector = StatementStatsCollector()
+    collector.attach(engine)
+    with engine.connect() as conn:
+        info = dict(conn.info)
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing;"))
+        # Nothing is left on the pooled connection
+        assert conn.info == info
+
+    stats = collector.stats["SELECT * FROM missing;"]
+    assert stats.count == stats.errors == 1
+    assert stats.rows == 0